@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import sys
+import json
+import argparse
+from os import environ, listdir, path
+from shutil import rmtree
+from tempfile import mkdtemp
+from contextlib import redirect_stdout
+from time import perf_counter
+from subprocess import DEVNULL, Popen
+from fake_jenkins import FakeJenkins
+from synthetic_metadata import count_jobs, write_metadata
+from jobgenerator import Generator
+from metadata_schema import validate_metadata
+from shards import merge_summaries
+
+# (configs, repositories per config, releases), going from about ten jobs
+# to about ten thousand
+SIZES = {"10": (1, 3, 2),
+         "100": (2, 20, 2),
+         "1k": (4, 60, 4),
+         "10k": (10, 270, 4)}
+
+# The metadata schema is measured separately, on (configs, repositories
+# per config, releases) with ten thousand repositories in total
+SCHEMA_SIZE = (10, 1000, 4)
+
+# Only these are compared against a baseline, they're all in seconds
+COMPARED = ["parse_seconds", "render_seconds", "push_cold_seconds",
+            "push_warm_seconds", "push_sharded_seconds", "validate_seconds"]
+
+
+def timed(func, *args):
+    """Run the function quietly, return how long it took and its result"""
+
+    with redirect_stdout(io.StringIO()):
+        start = perf_counter()
+        result = func(*args)
+        return perf_counter() - start, result
+
+
+def run_shards(url, shards, workers, push_backend="rest"):
+    """Push every job with one generator process per shard, all at once
+
+    Returns how long it took for all of them to finish, and their merged
+    summary.
+    """
+
+    generator = path.join(path.dirname(path.abspath(__file__)),
+                          "jobgenerator.py")
+    summary_loc = mkdtemp()
+    try:
+        start = perf_counter()
+        processes = []
+        for shard in range(shards):
+            processes.append(Popen(
+                [sys.executable, generator, "--shard",
+                 "%d/%d" % (shard, shards), "--summary-json",
+                 path.join(summary_loc, "%d.json" % shard), "--jobs",
+                 str(workers), "--push-backend", push_backend],
+                env=dict(environ, API_SITE=url), stdout=DEVNULL))
+        for process in processes:
+            process.wait()
+        seconds = perf_counter() - start
+
+        summaries = []
+        for file_name in sorted(listdir(summary_loc)):
+            with open(path.join(summary_loc, file_name)) as summary_file:
+                summaries.append(json.load(summary_file))
+    finally:
+        rmtree(summary_loc)
+
+    return seconds, merge_summaries(summaries)
+
+
+def run_size(size, workers, push=True, push_backend="rest", shards=1):
+    """Benchmark the generator on synthetic metadata of the given size
+
+    This measures parsing the metadata, rendering every job, and pushing
+    every job to a fake Jenkins server, both when none of the jobs exist
+    yet and when all of them are already up to date. With more than one
+    shard, pushing every job from that many processes at once is measured
+    too.
+    """
+
+    configs, repositories, releases = SIZES[size]
+    jobs = count_jobs(configs, repositories, releases)
+    result = {"size": size, "jobs": jobs, "configs": configs,
+              "repositories": repositories, "releases": releases}
+
+    metadata_loc = mkdtemp()
+    fake = None
+    try:
+        write_metadata(path.join(metadata_loc, "metadata"), configs,
+                       repositories, releases)
+        environ["METADATA_URL"] = path.join(metadata_loc, "metadata")
+        environ["METADATA_REPO_NAME"] = "metadata"
+
+        generator = Generator(workers=workers)
+        seconds, metadata = timed(generator.parse_metadata)
+        result["parse_seconds"] = seconds
+
+        def render():
+            for spec in generator.job_specs(metadata):
+                generator.load_config(spec)
+
+        seconds, _ = timed(render)
+        result["render_seconds"] = seconds
+        result["render_jobs_per_second"] = jobs / seconds
+
+        if push:
+            fake = FakeJenkins().start()
+            environ["API_SITE"] = fake.url
+            environ["API_USER"] = "benchmark"
+            environ["API_KEY"] = "benchmark"
+
+            for run in ["cold", "warm"]:
+                fake.requests.clear()
+                seconds, errors = timed(
+                    Generator(workers=workers,
+                              push_backend=push_backend).create_jenkins_jobs)
+                if errors:
+                    raise RuntimeError("%d jobs failed to push" % len(errors))
+                result["push_%s_seconds" % run] = seconds
+                result["push_%s_jobs_per_second" % run] = jobs / seconds
+                result["push_%s_requests" % run] = fake.total_requests()
+
+            if shards > 1:
+                fake.stop()
+                fake = FakeJenkins().start()
+                seconds, merged = run_shards(fake.url, shards, workers,
+                                             push_backend)
+                if merged["failed"] or merged["missing"] or \
+                        merged["jobs"] != jobs or len(fake.jobs) != jobs:
+                    raise RuntimeError("The shards pushed %d of %d jobs, "
+                                       "with %d failures" %
+                                       (len(fake.jobs), jobs,
+                                        merged["failed"]))
+                result["shards"] = shards
+                result["push_sharded_seconds"] = seconds
+                result["push_sharded_jobs_per_second"] = jobs / seconds
+                result["push_sharded_requests"] = merged["requests"]
+    finally:
+        if fake:
+            fake.stop()
+        rmtree(metadata_loc)
+
+    return result
+
+
+def run_schema():
+    """Benchmark validating metadata with ten thousand repositories
+
+    Only the validation is timed, not loading the YAML.
+    """
+
+    configs, repositories, releases = SCHEMA_SIZE
+    result = {"size": "schema-10k", "configs": configs,
+              "repositories": configs * repositories, "releases": releases}
+
+    metadata_loc = mkdtemp()
+    try:
+        write_metadata(metadata_loc, configs, repositories, releases)
+
+        def read_file(file_path):
+            with open(path.join(metadata_loc, file_path)) as conf_file:
+                return conf_file.read()
+
+        generator = Generator()
+        metadata = generator.read_metadata(read_file)
+        variables = generator.template_variables()
+    finally:
+        rmtree(metadata_loc)
+
+    seconds, _ = timed(validate_metadata, metadata, variables)
+    result["validate_seconds"] = seconds
+    result["validate_repositories_per_second"] = \
+        result["repositories"] / seconds
+    return result
+
+
+def compare(results, baseline, threshold):
+    """Return the measurements which got slower than the baseline
+
+    Anything more than threshold percent slower counts.
+    """
+
+    base = {result["size"]: result for result in baseline["results"]}
+    slower = []
+    for result in results:
+        if result["size"] not in base:
+            continue
+        for key in COMPARED:
+            old = base[result["size"]].get(key)
+            new = result.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100.0
+            if change > threshold:
+                slower.append((result["size"], key, old, new, change))
+
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--sizes", nargs="+", choices=list(SIZES),
+                        default=["10", "100", "1k"],
+                        help="The sizes to benchmark, in jobs")
+    parser.add_argument("-j", "--jobs", type=int, default=8,
+                        help="Maximum number of concurrent Jenkins requests")
+    parser.add_argument("--schema", action="store_true",
+                        help="Also measure validating metadata with ten "
+                             "thousand repositories")
+    parser.add_argument("--no-push", action="store_true",
+                        help="Only measure parsing and rendering")
+    parser.add_argument("-p", "--push-backend", choices=["rest", "script"],
+                        default="rest", help="How to push the jobs")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Also push every job from this many generator "
+                             "processes at once, one per shard")
+    parser.add_argument("-o", "--output",
+                        help="Write the results here as JSON")
+    parser.add_argument("-b", "--baseline",
+                        help="Compare against the results in this file")
+    parser.add_argument("-t", "--threshold", type=float, default=20.0,
+                        help="Percent slower than the baseline that counts "
+                             "as a regression")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        result = run_size(size, args.jobs, push=not args.no_push,
+                          push_backend=args.push_backend,
+                          shards=args.shards)
+        print(json.dumps(result))
+        results.append(result)
+    if args.schema:
+        result = run_schema()
+        print(json.dumps(result))
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"results": results}, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            slower = compare(results, json.load(baseline_file),
+                             args.threshold)
+        for size, key, old, new, change in slower:
+            print("Regression: %s jobs %s went from %.3f to %.3f (+%.1f%%)" %
+                  (size, key, old, new, change))
+        if slower:
+            sys.exit(1)
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import argparse
+from fcntl import flock, LOCK_EX
+from datetime import datetime, timedelta, timezone
+from timer_metrics import escape_label, percentile, write_atomically
+
+# The stages an upload goes through, in order, measured per architecture
+# apart from the source ones
+STAGES = ["upload_to_source_publish", "source_detection",
+          "source_to_build_start", "build", "build_to_binary_publish",
+          "binary_detection", "upload_to_binary_publish"]
+
+
+def now():
+    """Return the current time as an ISO 8601 string"""
+    return datetime.now(timezone.utc).isoformat()
+
+
+def timestamp(entry, name):
+    """Return a date attribute of a Launchpad entry as an ISO 8601 string
+
+    This is None if the entry doesn't have the date (yet).
+    """
+    value = getattr(entry, name, None)
+    return value.isoformat() if value is not None else None
+
+
+def seconds_between(start, end):
+    """Return the seconds between two ISO 8601 strings, if both are set"""
+    if start is None or end is None:
+        return None
+    return (datetime.fromisoformat(end) -
+            datetime.fromisoformat(start)).total_seconds()
+
+
+def link_name(entry, name):
+    """Return the last part of a link attribute, such as the series name"""
+    link = getattr(entry, name, None)
+    return link.rstrip("/").rsplit("/", 1)[-1] if link else None
+
+
+class BuildTelemetry:
+    """Build Telemetry
+
+    This records how one upload moves through Launchpad: when the source
+    was uploaded and published, when every architecture started and
+    finished building, and when every binary was published, as Launchpad
+    reports them. Every state seen for a build or binary is also kept with
+    the time we first saw it, so how late we notice things shows up too.
+
+    All of the times are ISO 8601 strings, so the record is plain JSON:
+    {
+        "source": {"created": ..., "published": ..., "detected": ...},
+        "builds": {
+            "amd64": {"created": ..., "started": ..., "built": ...,
+                      "state": "Successfully built",
+                      "transitions": [["Needs building", ...], ...]}
+        },
+        "binaries": {
+            "package/amd64": {"name": "package", "arch": "amd64",
+                              "created": ..., "published": ...,
+                              "detected": ..., "transitions": [...]}
+        }
+    }
+    """
+
+    def __init__(self, package, version, team, ppa):
+        self.package = package
+        self.version = version
+        self.team = team
+        self.ppa = ppa
+        self.release = None
+        self.started = now()
+        self.finished = None
+        self.outcome = None
+        self.source = {}
+        self.builds = {}
+        self.binaries = {}
+
+    def transition(self, entry, state):
+        """Add the state to the entry's transitions if it changed"""
+        transitions = entry.setdefault("transitions", [])
+        if not transitions or transitions[-1][0] != state:
+            transitions.append([state, now()])
+
+    def observe_source(self, source):
+        """Record the published source; only the first call counts"""
+        if self.source:
+            return
+        self.release = link_name(source, "distro_series_link")
+        self.source = {"created": timestamp(source, "date_created"),
+                       "published": timestamp(source, "date_published"),
+                       "detected": now()}
+
+    def observe_build(self, build):
+        """Record the current state of a build"""
+        entry = self.builds.setdefault(build.arch_tag, {})
+        self.transition(entry, build.buildstate)
+        entry.update(state=build.buildstate,
+                     created=timestamp(build, "datecreated"),
+                     started=timestamp(build, "date_started"),
+                     built=timestamp(build, "datebuilt"))
+
+    def observe_binary(self, binary):
+        """Record the current state of a binary publication"""
+        arch = link_name(binary, "distro_arch_series_link")
+        key = "%s/%s" % (binary.binary_package_name, arch)
+        entry = self.binaries.setdefault(
+            key, {"name": binary.binary_package_name, "arch": arch})
+        self.transition(entry, binary.status)
+        entry.update(created=timestamp(binary, "date_created"),
+                     published=timestamp(binary, "date_published"))
+        if binary.status == "Published" and "detected" not in entry:
+            entry["detected"] = now()
+
+    def finish(self, outcome):
+        """Record how the check ended: published, failed or timeout"""
+        self.finished = now()
+        self.outcome = outcome
+
+    def latencies(self):
+        """Return (stage, architecture, seconds) for every known stage
+
+        The source stages have no architecture. Binaries are published
+        one at a time, so an architecture is only done once the last of
+        its binaries is.
+        """
+
+        rows = []
+
+        def add(stage, arch, start, end):
+            seconds = seconds_between(start, end)
+            if seconds is not None:
+                rows.append((stage, arch, seconds))
+
+        uploaded = self.source.get("created")
+        published = self.source.get("published")
+        add("upload_to_source_publish", None, uploaded, published)
+        add("source_detection", None, published, self.source.get("detected"))
+
+        by_arch = {}
+        for entry in self.binaries.values():
+            by_arch.setdefault(entry["arch"], []).append(entry)
+        for arch, build in sorted(self.builds.items()):
+            add("source_to_build_start", arch, published, build["started"])
+            add("build", arch, build["started"], build["built"])
+
+            binaries = by_arch.get(arch, [])
+            if not binaries or not all(binary.get("published") and
+                                       binary.get("detected")
+                                       for binary in binaries):
+                continue
+            last = max(binaries, key=lambda binary: binary["published"])
+            add("build_to_binary_publish", arch, build["built"],
+                last["published"])
+            add("binary_detection", arch, last["published"],
+                max(binary["detected"] for binary in binaries))
+            add("upload_to_binary_publish", arch, uploaded,
+                last["published"])
+
+        return rows
+
+    def load(self, record):
+        """Take over a record made by as_dict(), such as lp_watcher.py's"""
+        self.release = record["release"]
+        self.started = record["started"]
+        self.finished = record["finished"]
+        self.outcome = record["outcome"]
+        self.source = record["source"]
+        self.builds = record["builds"]
+        self.binaries = record["binaries"]
+
+    def as_dict(self):
+        """Return the whole record, with the latencies worked out"""
+        return {"package": self.package, "version": self.version,
+                "team": self.team, "ppa": self.ppa, "release": self.release,
+                "started": self.started, "finished": self.finished,
+                "outcome": self.outcome, "source": self.source,
+                "builds": self.builds, "binaries": self.binaries,
+                "latencies": [{"stage": stage, "arch": arch,
+                               "seconds": seconds}
+                              for stage, arch, seconds in self.latencies()]}
+
+    def write_json(self, file_name):
+        """Write the record to a file as JSON"""
+        write_atomically(file_name, json.dumps(self.as_dict(), indent=2))
+
+    def write_openmetrics(self, file_name, prefix="lp_check"):
+        """Write the latencies in the OpenMetrics format
+
+        This is meant for node_exporter's textfile collector, with one
+        file per package job, so only the last upload is exported.
+        """
+
+        labels = [("package", self.package), ("team", self.team),
+                  ("ppa", self.ppa), ("release", self.release or "")]
+
+        def sample(name, extra, value):
+            return "%s_%s{%s} %r" % (
+                prefix, name,
+                ",".join('%s="%s"' % (key, escape_label(str(label)))
+                         for key, label in labels + extra), value)
+
+        lines = ["# TYPE %s_latency_seconds gauge" % prefix,
+                 "# HELP %s_latency_seconds How long each stage of the "
+                 "last upload took" % prefix]
+        for stage, arch, seconds in self.latencies():
+            lines.append(sample("latency_seconds",
+                                [("stage", stage), ("arch", arch or "")],
+                                seconds))
+
+        if self.finished:
+            lines += ["# TYPE %s_finished_timestamp_seconds gauge" % prefix,
+                      "# HELP %s_finished_timestamp_seconds When the check "
+                      "of the last upload ended, and how" % prefix,
+                      sample("finished_timestamp_seconds",
+                             [("outcome", self.outcome)],
+                             datetime.fromisoformat(self.finished)
+                             .timestamp())]
+
+        lines.append("# EOF")
+        write_atomically(file_name, "\n".join(lines) + "\n")
+
+
+def append_history(file_name, record):
+    """Append a record to the history, as one line of JSON
+
+    Several checks on one node can share the file, so it's locked while
+    writing.
+    """
+
+    with open(file_name, "a") as history_file:
+        flock(history_file, LOCK_EX)
+        history_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+def load_history(file_name, since=None):
+    """Yield every record in the history, optionally from a date onwards
+
+    since is an aware datetime. Lines which can't be read, such as one cut
+    short by a full disk, are skipped.
+    """
+
+    with open(file_name) as history_file:
+        for line in history_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if since is not None and \
+                    datetime.fromisoformat(record["started"]) < since:
+                continue
+            yield record
+
+
+def history_percentiles(records, package=None, arch=None, ppa=None,
+                        stage=None, percents=(50, 95)):
+    """Return the percentiles of every stage in the history
+
+    The latencies are grouped by package, PPA (as team/name), architecture
+    and stage, and can be filtered on any of them. Returns a list of
+    (package, ppa, arch, stage, count, {percent: seconds}, max), in order.
+    """
+
+    groups = {}
+    for record in records:
+        record_ppa = "%s/%s" % (record["team"], record["ppa"])
+        if package not in (None, record["package"]) or \
+                ppa not in (None, record_ppa):
+            continue
+        for latency in record["latencies"]:
+            if arch not in (None, latency["arch"]) or \
+                    stage not in (None, latency["stage"]):
+                continue
+            key = (record["package"], record_ppa, latency["arch"] or "",
+                   latency["stage"])
+            groups.setdefault(key, []).append(latency["seconds"])
+
+    def order(key):
+        return key[:2] + (STAGES.index(key[3]) if key[3] in STAGES
+                          else len(STAGES), key[2])
+
+    rows = []
+    for key in sorted(groups, key=order):
+        seconds = sorted(groups[key])
+        rows.append(key + (len(seconds),
+                           {percent: percentile(seconds, percent)
+                            for percent in percents}, seconds[-1]))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show the percentiles of the Launchpad build latencies "
+                    "recorded by lp_check.py --history")
+    parser.add_argument("history", help="The history file")
+    parser.add_argument("-p", "--package", help="Only this source package")
+    parser.add_argument("-a", "--arch", help="Only this architecture")
+    parser.add_argument("-r", "--ppa", help="Only this PPA, as team/name")
+    parser.add_argument("-s", "--stage", choices=STAGES,
+                        help="Only this stage")
+    parser.add_argument("-d", "--days", type=float,
+                        help="Only uploads from the last this many days")
+    parser.add_argument("--percentile", type=float, action="append",
+                        help="Show this percentile; can be given more than "
+                             "once, the default is 50 and 95")
+    parser.add_argument("--json", action="store_true",
+                        help="Print the results as JSON")
+    args = parser.parse_args()
+
+    since = None
+    if args.days is not None:
+        since = datetime.now(timezone.utc) - timedelta(days=args.days)
+    percents = args.percentile or [50, 95]
+    rows = history_percentiles(load_history(args.history, since),
+                               args.package, args.arch, args.ppa,
+                               args.stage, percents)
+
+    if args.json:
+        print(json.dumps([{"package": package, "ppa": ppa, "arch": arch,
+                           "stage": stage, "count": count,
+                           "percentiles": {"p%g" % percent: value for
+                                           percent, value in values.items()},
+                           "max": maximum}
+                          for package, ppa, arch, stage, count, values,
+                          maximum in rows], indent=2))
+    else:
+        from tabulate import tabulate
+        headers = ["Package", "PPA", "Arch", "Stage", "Count"] + \
+            ["p%g" % percent for percent in percents] + ["Max"]
+        print(tabulate([row[:5] + tuple(row[5][percent]
+                                        for percent in percents) + row[6:]
+                        for row in rows], headers=headers, tablefmt="grid",
+                       floatfmt=".1f"))
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+import json
+import argparse
+from base64 import b64decode
+from time import sleep
+from socket import IPPROTO_TCP, TCP_NODELAY
+from threading import Lock, Thread
+from urllib.parse import parse_qs, unquote, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeJenkins:
+    """Fake Jenkins
+
+    A small, in-memory stand-in for the parts of the Jenkins HTTP API the
+    job generator uses, so it can be run and measured without a real
+    Jenkins server. It isn't meant to be complete or secure.
+
+    Data structure:
+    jobs = {
+        "job name": "config.xml contents"
+    }
+    disabled = {"job name", ...}
+    views = {
+        "View name": ["job name", ...]
+    }
+    requests = {
+        "GET /job/*/config.xml": 12
+    }
+    """
+
+    # The longest string literal Groovy can compile
+    MAX_STRING_CONSTANT = 65535
+
+    # The crumb every POST has to send when crumbs are turned on
+    CRUMB_FIELD = "Jenkins-Crumb"
+    CRUMB = "fake-crumb"
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, crumbs=False,
+                 fail_every=0):
+        self.jobs = {}
+        self.disabled = set()
+        self.views = {"all": []}
+        self.requests = {}
+        # Seconds to wait before answering every request, to simulate a
+        # server under load
+        self.latency = latency
+        # Whether POSTs need a CSRF crumb
+        self.crumbs = crumbs
+        # Answer every nth request with a 503, to exercise retries
+        self.fail_every = fail_every
+        self.served = 0
+        self.lock = Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep connections alive, like Jenkins does
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                # The headers and body are written separately, don't let
+                # Nagle's algorithm hold the body back
+                BaseHTTPRequestHandler.setup(self)
+                self.connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fake.handle(self, "GET")
+
+            def do_POST(self):
+                fake.handle(self, "POST")
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        """The base URL of the server"""
+
+        host, port = self.httpd.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def start(self):
+        """Serve requests from a background thread"""
+
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving requests"""
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def total_requests(self):
+        """Return the number of requests served, for every endpoint"""
+
+        with self.lock:
+            return sum(self.requests.values())
+
+    def handle(self, request, method):
+        """Dispatch a request to the right endpoint"""
+
+        url = urlsplit(request.path)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        length = int(request.headers.get("Content-Length") or 0)
+        body = request.rfile.read(length).decode("utf-8") if length else ""
+        if request.headers.get("Content-Type", "").startswith(
+                "application/x-www-form-urlencoded"):
+            params.update({k: v[0] for k, v in parse_qs(body).items()})
+
+        # Count the endpoint, not the individual job or view
+        endpoint = list(parts)
+        if len(endpoint) > 1 and endpoint[0] in ("job", "view"):
+            endpoint[1] = "*"
+        with self.lock:
+            key = "%s /%s" % (method, "/".join(endpoint))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.served += 1
+            failing = self.fail_every and self.served % self.fail_every == 0
+
+        if self.latency:
+            sleep(self.latency)
+
+        if failing:
+            status, content_type, text = 503, "text/plain", "Overloaded"
+        elif self.crumbs and method == "POST" and \
+                request.headers.get(self.CRUMB_FIELD) != self.CRUMB:
+            status, content_type, text = 403, "text/plain", "No valid crumb"
+        else:
+            with self.lock:
+                status, content_type, text = self.route(method, parts,
+                                                        params, body)
+
+        data = text.encode("utf-8")
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def route(self, method, parts, params, body):
+        """Return the status, content type and body of a response"""
+
+        if method == "GET" and parts == ["api", "json"]:
+            data = {"jobs": [{"name": name,
+                              "color": "disabled" if name in self.disabled
+                              else "notbuilt"}
+                             for name in sorted(self.jobs)],
+                    "views": [{"name": name,
+                               "jobs": [{"name": job} for job in jobs]}
+                              for name, jobs in self.views.items()]}
+            return 200, "application/json", json.dumps(data)
+
+        if method == "GET" and parts == ["crumbIssuer", "api", "json"]:
+            if not self.crumbs:
+                return 404, "text/plain", "Not found"
+            return 200, "application/json", json.dumps(
+                {"crumbRequestField": self.CRUMB_FIELD, "crumb": self.CRUMB})
+
+        if method == "POST" and parts == ["createItem"]:
+            if params.get("name") in self.jobs:
+                return 400, "text/plain", "A job already exists"
+            self.jobs[params["name"]] = body
+            self.views["all"].append(params["name"])
+            return 200, "text/plain", ""
+
+        if method == "POST" and parts == ["createView"]:
+            if params.get("name") in self.views:
+                return 400, "text/plain", "A view already exists"
+            self.views[params["name"]] = []
+            return 200, "text/plain", ""
+
+        if method == "POST" and parts == ["scriptText"]:
+            return self.run_script(params.get("script", ""))
+
+        if len(parts) >= 2 and parts[0] == "job":
+            name = parts[1]
+            if name not in self.jobs:
+                return 404, "text/plain", "No such job"
+            if parts[2:] == ["config.xml"] and method == "GET":
+                return 200, "application/xml", self.jobs[name]
+            if parts[2:] == ["config.xml"] and method == "POST":
+                self.jobs[name] = body
+                return 200, "text/plain", ""
+            if parts[2:] == ["doDelete"] and method == "POST":
+                del self.jobs[name]
+                self.disabled.discard(name)
+                for jobs in self.views.values():
+                    if name in jobs:
+                        jobs.remove(name)
+                return 200, "text/plain", ""
+            if parts[2:] == ["disable"] and method == "POST":
+                self.disabled.add(name)
+                return 200, "text/plain", ""
+
+        if len(parts) >= 2 and parts[0] == "view":
+            name = parts[1]
+            if name not in self.views:
+                return 404, "text/plain", "No such view"
+            if parts[2:] == ["api", "json"] and method == "GET":
+                data = {"name": name,
+                        "jobs": [{"name": job} for job in self.views[name]]}
+                return 200, "application/json", json.dumps(data)
+            if parts[2:] == ["addJobToView"] and method == "POST":
+                if params.get("name") not in self.jobs:
+                    return 404, "text/plain", "No such job"
+                if params["name"] not in self.views[name]:
+                    self.views[name].append(params["name"])
+                return 200, "text/plain", ""
+            if parts[2:] == ["doDelete"] and method == "POST":
+                del self.views[name]
+                return 200, "text/plain", ""
+
+        return 404, "text/plain", "Not found"
+
+    def run_script(self, script):
+        """Stand in for the script console, running script_push's script
+
+        Instead of running Groovy, this pulls the embedded payload out of
+        the script and does what the script would with it. String literals
+        Groovy couldn't compile are refused with the compiler's error, like
+        Jenkins does.
+        """
+
+        for literal in re.findall(r"'([^']*)'", script):
+            if len(literal.encode("utf-8")) > self.MAX_STRING_CONSTANT:
+                return 200, "text/plain", "General error during class " \
+                    "generation: String too long\n"
+
+        match = re.search(r"def encoded = \[(.*?)\]\.join\(\"\"\)", script,
+                          re.S)
+        if not match:
+            return 400, "text/plain", "Unknown script"
+        encoded = "".join(re.findall(r"'([A-Za-z0-9+/=]*)'", match.group(1)))
+        payload = json.loads(b64decode(encoded).decode("utf-8"))
+
+        results = {}
+        if payload["operation"] == "fetch":
+            for name in payload["names"]:
+                if name in self.jobs:
+                    results[name] = self.jobs[name]
+        else:
+            for job in payload["jobs"]:
+                name = job["name"]
+                result = "unchanged"
+                if job["config"] is not None:
+                    result = "updated" if name in self.jobs else "created"
+                    if result == "created":
+                        self.views["all"].append(name)
+                    self.jobs[name] = job["config"]
+                elif name not in self.jobs:
+                    results[name] = "error: No such job"
+                    continue
+                view = self.views.setdefault(job["view"], [])
+                if name not in view:
+                    view.append(name)
+                results[name] = result
+
+        return 200, "text/plain", "RESULT " + json.dumps(results) + "\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--port", type=int, default=8080,
+                        help="The port to listen on")
+    parser.add_argument("-l", "--latency", type=float, default=0.0,
+                        help="Seconds to wait before every response")
+    parser.add_argument("-c", "--crumbs", action="store_true",
+                        help="Require a CSRF crumb on every POST")
+    parser.add_argument("-f", "--fail-every", type=int, default=0,
+                        help="Answer every nth request with a 503")
+    args = parser.parse_args()
+
+    fake = FakeJenkins(port=args.port, latency=args.latency,
+                       crumbs=args.crumbs, fail_every=args.fail_every)
+    print("Serving a fake Jenkins at", fake.url)
+    try:
+        fake.httpd.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from time import monotonic
+from threading import Lock
+from datetime import datetime, timedelta, timezone
+
+
+class FakeConnection:
+    """Stands in for launchpadlib's HTTP connection, only counting requests"""
+
+    def __init__(self):
+        self.requests = 0
+        self.lock = Lock()
+
+    def request(self, *args, **kwargs):
+        with self.lock:
+            self.requests += 1
+
+
+class FakeBrowser:
+    def __init__(self):
+        self._connection = FakeConnection()
+
+
+class FakeEntry:
+    """An object whose state depends on how long ago it was uploaded
+
+    Every attribute access that would be an HTTP request on the real
+    Launchpad counts as one.
+    """
+
+    def __init__(self, lp, upload):
+        self.lp = lp
+        self.upload = upload
+
+    def request(self):
+        self.lp._browser._connection.request()
+
+    def lp_refresh(self):
+        self.request()
+
+    def since(self, seconds):
+        """Return when the upload was that many seconds old, or None"""
+        if self.upload.age() < seconds:
+            return None
+        return self.upload.uploaded_at + timedelta(seconds=seconds)
+
+
+class FakeBinary(FakeEntry):
+    def __init__(self, lp, upload, arch_tag):
+        FakeEntry.__init__(self, lp, upload)
+        self.arch_tag = arch_tag
+        self.binary_package_name = "%s-%s" % (upload.package, arch_tag)
+        self.self_link = "fake://binary/%s/%s/%s" % (upload.package,
+                                                     upload.version,
+                                                     arch_tag)
+        self.distro_arch_series_link = "fake://ubuntu/%s/%s" % (
+            upload.release, arch_tag)
+
+    @property
+    def date_created(self):
+        return self.since(self.upload.build_delay(self.arch_tag))
+
+    @property
+    def date_published(self):
+        return self.since(self.upload.binary_delay(self.arch_tag))
+
+    @property
+    def status(self):
+        return "Published" if self.date_published else "Pending"
+
+
+class FakeBuild(FakeEntry):
+    def __init__(self, lp, upload, arch_tag):
+        FakeEntry.__init__(self, lp, upload)
+        self.arch_tag = arch_tag
+
+    @property
+    def datecreated(self):
+        return self.upload.uploaded_at
+
+    @property
+    def date_started(self):
+        return self.since(self.upload.source_delay)
+
+    @property
+    def datebuilt(self):
+        return self.since(self.upload.build_delay(self.arch_tag))
+
+    @property
+    def buildstate(self):
+        if self.arch_tag in self.upload.failing and self.datebuilt:
+            return "Failed to build"
+        if self.datebuilt:
+            return "Successfully built"
+        if self.date_started:
+            return "Currently building"
+        return "Needs building"
+
+
+class FakeSource(FakeEntry):
+    @property
+    def distro_series_link(self):
+        return "fake://ubuntu/" + self.upload.release
+
+    @property
+    def status(self):
+        return "Published" if self.date_published else "Pending"
+
+    @property
+    def date_created(self):
+        return self.upload.uploaded_at
+
+    @property
+    def date_published(self):
+        return self.since(self.upload.source_delay)
+
+    def getBuilds(self):
+        self.request()
+        return [FakeBuild(self.lp, self.upload, arch)
+                for arch in self.upload.archs]
+
+    def getPublishedBinaries(self):
+        self.request()
+        return [FakeBinary(self.lp, self.upload, arch)
+                for arch in self.upload.archs
+                if self.since(self.upload.listing_delay(arch))
+                and arch not in self.upload.failing]
+
+
+class FakeUpload:
+    """One source upload and how long each step of it takes, in seconds"""
+
+    def __init__(self, package, version, archs, source_delay, build_time,
+                 publish_delay, failing, release="focal", build_times=None,
+                 list_delay=0.0):
+        self.package = package
+        self.version = version
+        self.archs = archs
+        self.source_delay = source_delay
+        self.build_time = build_time
+        self.build_times = build_times or {}
+        self.publish_delay = publish_delay
+        self.list_delay = list_delay
+        self.failing = failing
+        self.release = release
+        self.started = monotonic()
+        self.uploaded_at = datetime.now(timezone.utc)
+
+    def age(self):
+        return monotonic() - self.started
+
+    def build_delay(self, arch_tag):
+        # Unless given, every architecture takes a little longer than the
+        # one before it
+        if arch_tag in self.build_times:
+            return self.source_delay + self.build_times[arch_tag]
+        return self.source_delay + self.build_time * \
+            (1 + self.archs.index(arch_tag) * 0.5)
+
+    def listing_delay(self, arch_tag):
+        # The binaries of a build are only listed once they're uploaded and
+        # processed
+        return self.build_delay(arch_tag) + self.list_delay
+
+    def binary_delay(self, arch_tag):
+        return self.build_delay(arch_tag) + \
+            max(self.publish_delay, self.list_delay)
+
+
+class FakePPA(FakeEntry):
+    def __init__(self, lp, name):
+        self.lp = lp
+        self.name = name
+        self.uploads = []
+
+    def getPublishedSources(self, source_name=None, version=None,
+                            exact_match=False, order_by_date=False):
+        self.request()
+        return [FakeSource(self.lp, upload) for upload in self.uploads
+                if upload.package == source_name and
+                upload.version == version and upload.age() > 0]
+
+
+class FakePerson:
+    def __init__(self, lp):
+        self.lp = lp
+        self.ppas = {}
+
+    def getPPAByName(self, name):
+        self.lp._browser._connection.request()
+        if name not in self.ppas:
+            raise KeyError(name)
+        return self.ppas[name]
+
+
+class FakePeople(dict):
+    def __init__(self, lp):
+        dict.__init__(self)
+        self.lp = lp
+
+    def __getitem__(self, name):
+        self.lp._browser._connection.request()
+        return dict.__getitem__(self, name)
+
+
+class FakeLaunchpad:
+    """Fake Launchpad
+
+    A small stand-in for the parts of the launchpadlib object graph that
+    lp_check.py uses. Uploads are added with upload(), and their source,
+    builds and binaries move through their states as real time passes, so
+    use small delays. Requests are counted the same way as on the real
+    Launchpad object.
+    """
+
+    def __init__(self):
+        self._browser = FakeBrowser()
+        self.people = FakePeople(self)
+
+    def upload(self, team, ppa, package, version, archs=("amd64", "arm64"),
+               source_delay=1.0, build_time=1.0, publish_delay=0.5,
+               failing=(), build_times=None, list_delay=0.0):
+        """Upload a source package to the given PPA, creating it if needed
+
+        build_times maps architectures to how long they take to build, and
+        list_delay is how long their binaries take to be listed after that.
+        """
+
+        if team not in self.people:
+            dict.__setitem__(self.people, team, FakePerson(self))
+        person = dict.__getitem__(self.people, team)
+        if ppa not in person.ppas:
+            person.ppas[ppa] = FakePPA(self, ppa)
+
+        upload = FakeUpload(package, version, list(archs), source_delay,
+                            build_time, publish_delay, list(failing),
+                            build_times=build_times, list_delay=list_delay)
+        person.ppas[ppa].uploads.append(upload)
+        return upload
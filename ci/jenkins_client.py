@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import requests
+from random import uniform
+from threading import Lock
+from time import perf_counter, sleep
+from urllib.parse import quote, unquote, urlsplit
+from requests.adapters import HTTPAdapter
+
+
+class JenkinsClient:
+    """Jenkins Client
+
+    A thin client for the few parts of the Jenkins HTTP API the generator
+    uses. Nothing is requested until it's needed; in particular, creating
+    the client doesn't load anything from the server.
+
+    All requests go through one session, with a pool of keep-alive
+    connections as large as the number of workers using it. Requests which
+    time out, can't connect, or get a 5xx response are retried a few times
+    with an exponential, jittered and bounded backoff. Requests which
+    can't be repeated safely, such as creating a job, are only retried
+    when Jenkins can't have handled them. The CSRF crumb is
+    fetched once and sent with every POST, and fetched again if Jenkins
+    stops accepting it.
+
+    Every request is counted per endpoint, with the job and view names left
+    out:
+    endpoints = {
+        "GET /job/*/config.xml": {
+            "requests": 12,
+            "retries": 1,
+            "errors": 0,
+            "seconds": 0.5
+        }
+    }
+    """
+
+    def __init__(self, baseurl, username=None, password=None, workers=8,
+                 timeout=30.0, retries=4, backoff=0.5, max_backoff=8.0):
+        self.baseurl = baseurl.rstrip("/")
+        self.timeout = timeout
+        # How many times to retry a request, and how long to wait before
+        # the first retry and at most, in seconds
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        if username:
+            self.session.auth = (username, password)
+        # Block instead of opening extra connections when every connection
+        # is in use, so the server never sees more than one per worker
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers,
+                              pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # The crumb header, as {field: crumb}, or {} if Jenkins doesn't want
+        # one; None until it's first needed
+        self.crumb = None
+        self.crumb_lock = Lock()
+
+        self.endpoints = {}
+        self.lock = Lock()
+
+    def url(self, *parts):
+        """Return the URL of the given path on the server"""
+
+        return "/".join([self.baseurl] + [quote(part) for part in parts])
+
+    def endpoint(self, method, url):
+        """Return the name requests to the URL are counted under"""
+
+        parts = [unquote(part) for part in
+                 urlsplit(url).path[len(urlsplit(self.baseurl).path):]
+                 .strip("/").split("/")]
+        if len(parts) > 1 and parts[0] in ("job", "view"):
+            parts[1] = "*"
+        return "%s /%s" % (method, "/".join(parts))
+
+    def record(self, endpoint, key, amount=1):
+        """Add to one of the counters of the endpoint"""
+
+        with self.lock:
+            counters = self.endpoints.setdefault(
+                endpoint, {"requests": 0, "retries": 0, "errors": 0,
+                           "seconds": 0.0})
+            counters[key] += amount
+
+    def crumb_header(self, refresh=False):
+        """Return the CSRF crumb header, fetching it if needed"""
+
+        with self.crumb_lock:
+            if self.crumb is None or refresh:
+                url = self.url("crumbIssuer", "api", "json")
+                response = self.request(
+                    "GET", url, params={"tree": "crumbRequestField,crumb"},
+                    check=False)
+                if response.status_code == 404:
+                    # CSRF protection is turned off
+                    self.crumb = {}
+                else:
+                    self.check(response)
+                    data = response.json()
+                    self.crumb = {data["crumbRequestField"]: data["crumb"]}
+
+            return self.crumb
+
+    def check(self, response):
+        """Raise a ValueError if the response isn't a success"""
+
+        if not response.ok:
+            raise ValueError("%s %s returned %d: %s" %
+                             (response.request.method, response.url,
+                              response.status_code, response.text[:200]))
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                check=True, idempotent=True, timeout=None):
+        """Make a request, retrying on 5xx responses and timeouts
+
+        If the request isn't idempotent, it's only retried if connecting
+        failed or Jenkins answered with a 503, since otherwise it may have
+        been done already; a second createItem would fail because the job
+        exists. A timeout in seconds overrides the client's for requests
+        which take longer. Raises a ValueError if it doesn't succeed in the
+        end, unless check is False, in which case the last response is
+        returned.
+        """
+
+        if timeout is None:
+            timeout = self.timeout
+
+        # A read timeout isn't a ConnectionError, the request was sent
+        retried = (requests.Timeout, requests.ConnectionError) \
+            if idempotent else requests.ConnectionError
+
+        endpoint = self.endpoint(method, url)
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.record(endpoint, "retries")
+                sleep(min(self.max_backoff,
+                          self.backoff * 2 ** (attempt - 1)) *
+                      uniform(0.5, 1.0))
+
+            self.record(endpoint, "requests")
+            start = perf_counter()
+            try:
+                response = self.session.request(method, url, params=params,
+                                                data=data, headers=headers,
+                                                timeout=timeout)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                self.record(endpoint, "seconds", perf_counter() - start)
+                if attempt == self.retries or not isinstance(e, retried):
+                    self.record(endpoint, "errors")
+                    raise ValueError("%s %s failed: %s" % (method, url, e))
+                continue
+            self.record(endpoint, "seconds", perf_counter() - start)
+
+            if response.status_code < 500 or attempt == self.retries:
+                break
+            # Jenkins may have done it anyway, unless it's unavailable
+            if not idempotent and response.status_code != 503:
+                break
+
+        if not response.ok:
+            self.record(endpoint, "errors")
+            if check:
+                self.check(response)
+        return response
+
+    def get(self, url, params=None):
+        """Make a GET request to the server"""
+
+        return self.request("GET", url, params=params)
+
+    def post(self, url, params=None, data="", xml=False, idempotent=True,
+             timeout=None):
+        """Make a POST request to the server, with the CSRF crumb
+
+        If the crumb was rejected, it's fetched again and the request is
+        sent once more. Pass idempotent=False for requests which can't
+        safely be repeated, and a timeout for slow ones, see request().
+        """
+
+        headers = {"Content-Type": "application/xml"} if xml else {}
+        headers.update(self.crumb_header())
+        response = self.request("POST", url, params=params, data=data,
+                                headers=headers, check=False,
+                                idempotent=idempotent, timeout=timeout)
+        if response.status_code == 403 and self.crumb:
+            headers.update(self.crumb_header(refresh=True))
+            response = self.request("POST", url, params=params, data=data,
+                                    headers=headers, check=False,
+                                    idempotent=idempotent, timeout=timeout)
+
+        self.check(response)
+        return response
+
+    def display(self):
+        """Print a table of the requests made to every endpoint"""
+
+        from tabulate import tabulate
+
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+        if not endpoints:
+            return
+
+        table = {"Endpoint": [], "Requests": [], "Retries": [], "Errors": [],
+                 "Seconds": [], "Mean ms": []}
+        for endpoint, counters in endpoints:
+            table["Endpoint"].append(endpoint)
+            table["Requests"].append(counters["requests"])
+            table["Retries"].append(counters["retries"])
+            table["Errors"].append(counters["errors"])
+            table["Seconds"].append(counters["seconds"])
+            table["Mean ms"].append(counters["seconds"] /
+                                    counters["requests"] * 1000.0)
+
+        print(tabulate(table, headers="keys", tablefmt="grid",
+                       floatfmt=".3f"))
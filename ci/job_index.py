@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+from threading import Event, Lock
+from time import monotonic, sleep
+
+
+class JobIndex:
+    """Job Index
+
+    This keeps an in-memory snapshot of the jobs and views on a Jenkins
+    server, taken with a single API request, so checking whether a job or
+    view exists doesn't need to go back to the server every time. Jobs and
+    views created through the index are added to the snapshot locally.
+
+    Every request made through the index is counted, so it's possible to
+    check that the number of API calls is linear in the number of changed
+    jobs.
+
+    Data structure:
+    jobs = {"job name", ...}
+    disabled = {"job name", ...}
+    views = {
+        "View name": {"job name", ...}
+    }
+    """
+
+    # Only ask for the names, the rest of the tree is expensive to build
+    SNAPSHOT_TREE = "jobs[name,color],views[name,jobs[name]]"
+
+    def __init__(self, server, owns_view=None, view_timeout=300.0):
+        self.server = server
+        # Whether this generator creates the given view; views owned by
+        # another generator are waited on instead, for up to view_timeout
+        # seconds
+        self.owns_view = owns_view or (lambda name: True)
+        self.view_timeout = view_timeout
+        self.jobs = set()
+        self.disabled = set()
+        self.views = {}
+        self.requests = 0
+
+        # The index is shared by the workers creating jobs
+        self.lock = Lock()
+        self.view_lock = Lock()
+        # The views being waited on, each with an event set once the wait
+        # is over, and the views which never showed up, with the error
+        # message
+        self.view_waits = {}
+        self.missing_views = {}
+
+    def url(self, *parts):
+        """Return the URL of the given path on the server"""
+
+        return self.server.url(*parts)
+
+    def get(self, url, params=None):
+        """Make a GET request to the server, and count it"""
+
+        with self.lock:
+            self.requests += 1
+
+        return self.server.get(url, params=params)
+
+    def post(self, url, params=None, data="", xml=False, idempotent=True,
+             timeout=None):
+        """Make a POST request to the server, and count it
+
+        Creating and deleting aren't idempotent, so those aren't retried
+        if Jenkins may have done them already. The timeout overrides the
+        server's for slow requests.
+        """
+
+        with self.lock:
+            self.requests += 1
+
+        return self.server.post(url, params=params, data=data, xml=xml,
+                                idempotent=idempotent, timeout=timeout)
+
+    def snapshot(self):
+        """Load the job names, views and view membership from the server"""
+
+        response = self.get(self.url("api", "json"),
+                            params={"tree": self.SNAPSHOT_TREE})
+        data = json.loads(response.text)
+
+        self.jobs = {job["name"] for job in data.get("jobs", [])}
+        self.disabled = {job["name"] for job in data.get("jobs", [])
+                         if job.get("color") == "disabled"}
+        self.views = {}
+        self.missing_views = {}
+        for view in data.get("views", []):
+            self.views[view["name"]] = {job["name"] for job in
+                                        view.get("jobs", [])}
+
+    def job_config(self, name):
+        """Return the current config.xml of the given job"""
+
+        return self.get(self.url("job", name, "config.xml")).text
+
+    def create_job(self, name, config):
+        """Create a job with the given config"""
+
+        self.post(self.url("createItem"), params={"name": name},
+                  data=str(config), xml=True, idempotent=False)
+        with self.lock:
+            self.jobs.add(name)
+
+    def update_job(self, name, config):
+        """Replace the config of an existing job"""
+
+        self.post(self.url("job", name, "config.xml"), data=str(config),
+                  xml=True)
+
+    def delete_job(self, name):
+        """Delete the given job, and remove it from every view"""
+
+        self.post(self.url("job", name, "doDelete"), idempotent=False)
+        with self.lock:
+            self.jobs.discard(name)
+            self.disabled.discard(name)
+            for view in self.views.values():
+                view.discard(name)
+
+    def disable_job(self, name):
+        """Disable the given job, so it won't be triggered anymore"""
+
+        self.post(self.url("job", name, "disable"))
+        with self.lock:
+            self.disabled.add(name)
+
+    def delete_view(self, name):
+        """Delete the given view, leaving its jobs alone"""
+
+        self.post(self.url("view", name, "doDelete"), idempotent=False)
+        with self.view_lock:
+            self.views.pop(name, None)
+
+    def wait_for_view(self, name, timeout=300.0, max_interval=5.0):
+        """Wait for another generator to create the view, return its jobs
+
+        The view is checked again after a quarter of a second, and then
+        less and less often. Raises a ValueError if the view doesn't show up
+        within timeout seconds.
+        """
+
+        deadline = monotonic() + timeout
+        interval = 0.25
+        while True:
+            try:
+                response = self.get(self.url("view", name, "api", "json"),
+                                    params={"tree": "jobs[name]"})
+            except ValueError:
+                if monotonic() > deadline:
+                    raise ValueError("Timed out waiting for the %s view" %
+                                     name)
+                sleep(interval)
+                interval = min(max_interval, interval * 2)
+                continue
+
+            return {job["name"] for job in
+                    json.loads(response.text).get("jobs", [])}
+
+    def ensure_view(self, name):
+        """Create a list view with the given name, if it doesn't exist
+
+        Two workers can need the same new view at the same time, so the
+        check and the creation are done under a lock. If the view belongs
+        to another generator, this waits for it to be created instead. Only
+        one worker waits for each view, without holding the lock, and the
+        others wait on it. If the view never shows up, every later call
+        raises the same ValueError straight away.
+        """
+
+        while True:
+            with self.view_lock:
+                if name in self.views:
+                    return
+                if name in self.missing_views:
+                    raise ValueError(self.missing_views[name])
+
+                if self.owns_view(name):
+                    self.create_view(name)
+                    return
+
+                waiting = self.view_waits.get(name)
+                if waiting is None:
+                    waiting = self.view_waits[name] = Event()
+                    break
+
+            # Another worker is waiting for the view already
+            waiting.wait()
+
+        try:
+            jobs = self.wait_for_view(name, self.view_timeout)
+        except ValueError as e:
+            with self.view_lock:
+                self.missing_views[name] = str(e)
+            raise
+        else:
+            with self.view_lock:
+                self.views[name] = jobs
+        finally:
+            with self.view_lock:
+                del self.view_waits[name]
+            waiting.set()
+
+    def create_view(self, name):
+        """Create a list view with the given name, under the view lock"""
+
+        data = {"name": name,
+                "mode": "hudson.model.ListView",
+                "Submit": "OK",
+                "json": json.dumps({"name": name,
+                                    "mode": "hudson.model.ListView"})}
+        self.post(self.url("createView"), data=data, idempotent=False)
+        self.views[name] = set()
+
+    def add_job_to_view(self, view, name):
+        """Add the job to the view, creating the view if needed
+
+        If the job is already in the view, nothing is sent to the server.
+        """
+
+        self.ensure_view(view)
+        with self.lock:
+            if name in self.views[view]:
+                return
+
+        self.post(self.url("view", view, "addJobToView"),
+                  params={"name": name})
+        with self.lock:
+            self.views[view].add(name)
@@ -15,20 +15,354 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import git
-from os import getenv, path
-from yaml import CLoader
-from yaml import load as yaml_load
-from jinja2 import Template
+# Take the start time before anything else is imported, so the time spent
+# importing the modules can be measured
+from time import perf_counter
+STARTED = perf_counter()
+
+import re
+import sys
+import json
+import signal
+import argparse
+from collections import OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from hashlib import sha256
+from importlib import import_module
+from itertools import islice
+from os import getenv, listdir, makedirs, path, remove, replace
+from xml.etree.ElementTree import canonicalize
 from shutil import rmtree
 from tempfile import mkdtemp
-from jenkinsapi.jenkins import Jenkins
-from timer_metrics import TimerMetrics
+from threading import Event, Lock
+from fcntl import flock, LOCK_EX
+from job_index import JobIndex
+from metadata_schema import validate_metadata
+from script_push import ScriptPush
+from shards import Shard
+from timer_metrics import TimerMetrics, write_atomically
+from trigger_graph import TriggerGraph
 
 timer = TimerMetrics()
+IMPORTED = perf_counter()
+timer.record("Import modules", IMPORTED - STARTED)
+
+
+def lazy_import(name):
+    """Import a module the first time it's actually needed
+
+    git, yaml, jinja2 and the Jenkins client (which pulls in requests) make
+    up most of the startup time, and plenty of runs don't need all of them,
+    such as --render-only or a run with the metadata already parsed. Once
+    imported, the module stays in sys.modules and this is a dict lookup.
+    """
+
+    module = sys.modules.get(name)
+    if module is None:
+        with timer.span("Import " + name):
+            module = import_module(name)
+    return module
+
+
+def source_version(*sources):
+    """Return a short hash of the contents of the given source files"""
+
+    version = sha256()
+    for source in sources:
+        with open(source, "rb") as source_file:
+            version.update(source_file.read())
+    return version.hexdigest()[:12]
+
+
+# Cached metadata is only valid for the code which parsed it, so key the
+# cache on the contents of the generator itself and the metadata schema.
+# The templates decide which keys are required, so they count too.
+TEMPLATE_DIR = path.join(path.dirname(path.dirname(path.abspath(__file__))),
+                         "templates")
+GENERATOR_VERSION = source_version(
+    __file__, path.join(path.dirname(path.abspath(__file__)),
+                        "metadata_schema.py"),
+    *[path.join(TEMPLATE_DIR, name) for name in sorted(listdir(TEMPLATE_DIR))
+      if name.endswith(".xml")])
+
+# One job to render and push. The template variables are kept as sorted
+# (name, value) pairs, so a spec is small, immutable and doesn't share
+# anything with the metadata it came from.
+JobSpec = namedtuple("JobSpec", ["job_type", "name", "view", "variables"])
+
+
+def config_digest(config):
+    """Return a content hash of a job config in normalized form
+
+    Jenkins rewrites config.xml when it saves it, so the XML declaration,
+    whitespace between elements and attribute order can all differ from
+    what we rendered, even if the job is functionally the same. Hash the
+    canonical form (C14N 2.0) so only real changes are detected.
+    """
+
+    # canonicalize() doesn't accept an XML declaration with an encoding on
+    # a str, and it carries no information anyway, so drop it
+    config = str(config).strip()
+    if config.startswith("<?xml"):
+        config = config[config.index("?>") + 2:]
+
+    normalized = canonicalize(config, strip_text=True)
+    return sha256(normalized.encode("utf-8")).hexdigest()
 
 
 class Generator:
+    def __init__(self, force=False, workers=8, template_cache=None,
+                 metadata_cache=None, incremental=False, prune=None,
+                 max_prune=25, dry_run=False, push_backend="rest",
+                 batch_size=500, strict_triggers=False, shard=None,
+                 render_cache_size=256):
+        # If force is set, push every job config even if it's unchanged
+        self.force = force
+        # The maximum number of concurrent requests to Jenkins
+        self.workers = max(1, workers)
+        self.stats = {"created": 0, "updated": 0, "unchanged": 0}
+        # Failed jobs, mapping the job name to the exception raised
+        self.errors = {}
+
+        # The workers share the stats, so guard them
+        self.stats_lock = Lock()
+
+        # If set, keep a persistent mirror of the metadata in this directory
+        self.metadata_cache = metadata_cache
+        # The metadata commit we're working from, and whether it's the same
+        # one the mirror had before this run
+        self.metadata_sha = None
+        self.metadata_unchanged = False
+        # Whether the metadata came fully parsed from the cache
+        self.metadata_cached = False
+
+        # If set, only push the jobs which changed since the last applied
+        # state, which is stored in the metadata cache directory
+        self.incremental = incremental
+        self.template_digests = {}
+
+        # What to do with jobs no longer defined in the metadata: None to
+        # leave them alone, "disable" or "delete". At most max_prune jobs
+        # and views are touched in one run, and with dry_run set, they're
+        # only listed.
+        self.prune = prune
+        self.max_prune = max_prune
+        self.dry_run = dry_run
+
+        # How jobs are pushed: "rest" makes a few API calls per job, from a
+        # pool of workers, "script" sends them to the script console in
+        # batches of batch_size jobs
+        if push_backend not in ("rest", "script"):
+            raise ValueError("Unknown push backend %s" % push_backend)
+        self.push_backend = push_backend
+        self.batch_size = max(1, batch_size)
+
+        # Jobs are pushed in waves, after every job they're triggered by.
+        # Trigger cycles always stop the run; with strict_triggers set, so
+        # do triggers naming jobs that don't exist.
+        self.strict_triggers = strict_triggers
+
+        # Which slice of the jobs and views this generator is responsible
+        # for, when several of them share the work; by default, all of them
+        self.shard = shard or Shard()
+        # The totals of the last run, to be merged with the other shards
+        self.summary = {}
+
+        # Templates are parsed and compiled once per process, and kept around
+        # for the rest of the run. The templates don't change while we're
+        # running, so don't stat them every time they're used. If a cache
+        # directory is given, the compiled bytecode is also kept on disk so
+        # later runs don't have to compile them again. The environment is
+        # only set up once a template is needed.
+        self.template_cache = template_cache
+        self._env = None
+
+        # The merge commands of every cascade, keyed by the cascade as a
+        # tuple, and the most recently rendered configs, keyed by the job
+        # type and the variables. Most mergers share one cascade, and the
+        # management jobs are all rendered the same, so each of those is
+        # only built once. Other jobs are all different, so only a few
+        # configs are kept, which is enough for the second render of a job
+        # right after the trigger graph is built in small runs.
+        self.cascade_cache = {}
+        self.render_cache = OrderedDict()
+        self.render_cache_size = render_cache_size
+
+        # Kept between runs of the daemon, so it only has to authenticate
+        # and take a snapshot of the server once
+        self.server = None
+        self.index = None
+
+    @property
+    def env(self):
+        """The Jinja environment the templates are loaded from"""
+
+        if self._env is None:
+            jinja2 = lazy_import("jinja2")
+            bytecode_cache = None
+            if self.template_cache:
+                makedirs(self.template_cache, exist_ok=True)
+                bytecode_cache = jinja2.FileSystemBytecodeCache(
+                    self.template_cache)
+            self._env = jinja2.Environment(
+                loader=jinja2.FileSystemLoader(TEMPLATE_DIR), cache_size=-1,
+                auto_reload=False, bytecode_cache=bytecode_cache)
+        return self._env
+
+    def read_metadata(self, read_file):
+        """Load ci.conf and the active configs it points to
+
+        read_file is given a path relative to the root of the metadata
+        repository and returns the contents of that file.
+        """
+
+        # If this commit was already parsed, don't bother with the YAML
+        metadata_conf = self.load_parsed_metadata()
+        if metadata_conf is not None:
+            return metadata_conf
+
+        # Load ci.conf and parse it
+        yaml = lazy_import("yaml")
+        metadata_conf = yaml.load(read_file("ci.conf"), Loader=yaml.CLoader)
+
+        # Load all of the active config files and replace the given patch
+        # with the data from those files
+        active_configs = {}
+        for conf in metadata_conf["active_configs"]:
+            # Replace the string with a dict having all the data
+            conf_loaded = yaml.load(read_file(conf), Loader=yaml.CLoader)
+            active_configs[conf.replace(".conf", "")] = conf_loaded
+
+        # Since metadata_conf["active_configs"] is a list, we have to use
+        # a separate dict to store the new data until here
+        metadata_conf["active_configs"] = active_configs
+
+        return metadata_conf
+
+    def parsed_metadata_path(self):
+        """Return where the parsed metadata for this commit is cached
+
+        This is None if there is no cache directory, or the commit isn't
+        known.
+        """
+
+        if not self.metadata_cache or not self.metadata_sha:
+            return None
+
+        return path.join(self.metadata_cache, "parsed", "%s-%s.json" %
+                         (self.metadata_sha, GENERATOR_VERSION))
+
+    def load_parsed_metadata(self):
+        """Return the cached, fully parsed metadata for this commit
+
+        If it isn't in the cache, return None.
+        """
+
+        cache_path = self.parsed_metadata_path()
+        if cache_path is None:
+            return None
+
+        try:
+            with open(cache_path) as cache_file:
+                metadata_conf = json.load(cache_file)
+        except (OSError, ValueError):
+            timer.count("Metadata cache misses")
+            return None
+
+        timer.count("Metadata cache hits")
+        self.metadata_cached = True
+        return metadata_conf
+
+    def save_parsed_metadata(self, metadata_conf):
+        """Cache the fully parsed metadata for this commit
+
+        Only the entry for the current commit is kept.
+        """
+
+        cache_path = self.parsed_metadata_path()
+        if cache_path is None:
+            return
+
+        self.clear_parsed_metadata()
+        makedirs(path.dirname(cache_path), exist_ok=True)
+
+        # Write it somewhere else first, so a half-written file can never be
+        # read back
+        with open(cache_path + ".tmp", "w") as cache_file:
+            json.dump(metadata_conf, cache_file)
+        replace(cache_path + ".tmp", cache_path)
+
+    def clear_parsed_metadata(self):
+        """Remove all of the cached, parsed metadata"""
+
+        cache_dir = path.join(self.metadata_cache, "parsed")
+        if not path.isdir(cache_dir):
+            return
+
+        for cache_file in listdir(cache_dir):
+            remove(path.join(cache_dir, cache_file))
+
+    def update_metadata_mirror(self, metadata_url, mirror_loc):
+        """Fetch the latest metadata into the mirror, return the repository
+
+        The mirror is a shallow bare clone of the metadata repository, so
+        there's no working tree to keep up to date; the files are read
+        straight from the object database. If the mirror doesn't exist yet,
+        it's cloned.
+        """
+
+        git = lazy_import("git")
+        if not path.isdir(mirror_loc):
+            print("Creating the metadata mirror...")
+            return git.Repo.clone_from(metadata_url, mirror_loc, bare=True,
+                                       depth=1, single_branch=True)
+
+        mirror = git.Repo(mirror_loc)
+        old_sha = mirror.head.commit.hexsha
+
+        # Bare clones don't have a fetch refspec, so give it one explicitly.
+        # There's no working tree, so updating the current branch is fine.
+        branch = mirror.head.reference.path
+        mirror.git.fetch("--depth=1", metadata_url,
+                         "+%s:%s" % (branch, branch))
+
+        if mirror.head.commit.hexsha == old_sha:
+            self.metadata_unchanged = True
+
+        return mirror
+
+    def mirror_metadata(self, metadata_url, metadata_repo_name):
+        """Read the metadata from the persistent mirror in the cache directory
+
+        A corrupt or locked mirror is thrown away and cloned again. Only one
+        generator can use the mirror at a time.
+        """
+
+        git = lazy_import("git")
+        makedirs(self.metadata_cache, exist_ok=True)
+        mirror_loc = path.join(self.metadata_cache,
+                               metadata_repo_name + ".git")
+
+        with open(mirror_loc + ".lock", "w") as lock_file:
+            # Wait for any other generator using the mirror to finish; after
+            # this, any git lock files in the mirror are stale
+            flock(lock_file, LOCK_EX)
+
+            try:
+                mirror = self.update_metadata_mirror(metadata_url, mirror_loc)
+            except (git.exc.GitError, ValueError, OSError) as e:
+                print("Metadata mirror is unusable, cloning it again:", e)
+                rmtree(mirror_loc, ignore_errors=True)
+                mirror = self.update_metadata_mirror(metadata_url, mirror_loc)
+
+            commit = mirror.head.commit
+            self.metadata_sha = commit.hexsha
+
+            def read_file(file_path):
+                return commit.tree[file_path].data_stream.read()
+
+            return self.read_metadata(read_file)
+
     @timer.run("Clone the metadata")
     def clone_metadata(self):
         """Clone the metadata repository using the values set in the env vars
@@ -39,7 +373,8 @@ class Generator:
         The repository must have a ci.conf file in YAML format.
 
         This uses Git to clone the given repository - other VCSes are not
-        supported at this time.
+        supported at this time. If a metadata cache directory is set, a
+        persistent mirror is kept there and only fetched on later runs.
         """
 
         # Assuming this is ran inside Jenkins, this fetches the env vars set in
@@ -50,35 +385,32 @@ class Generator:
         if not metadata_url or not metadata_repo_name:
             raise ValueError("METADATA_URL and METADATA_REPO_NAME must be set")
 
+        # The daemon clones the metadata once per commit, so don't go by
+        # what the last run found
+        self.metadata_unchanged = False
+        self.metadata_cached = False
+        if self.metadata_cache:
+            metadata_conf = self.mirror_metadata(metadata_url,
+                                                 metadata_repo_name)
+            if self.metadata_unchanged:
+                print("Metadata unchanged at %s" % self.metadata_sha)
+            return metadata_conf
+
+        git = lazy_import("git")
         metadata_loc = None
         # Create a temporary directory in the most secure manner possible and
         # clone the metadata, throwing the directory away when we're done
         try:
             metadata_loc = mkdtemp()
             git.Git(metadata_loc).clone(metadata_url)
+            repo_loc = path.join(metadata_loc, metadata_repo_name)
+            self.metadata_sha = git.Repo(repo_loc).head.commit.hexsha
 
-            # Load ci.conf and parse it
-            config_file = path.join(metadata_loc,
-                                    metadata_repo_name,
-                                    "ci.conf")
-            with open(config_file) as metadata_conf_file:
-                metadata_conf = yaml_load(metadata_conf_file, Loader=CLoader)
-
-            # Load all of the active config files and replace the given patch
-            # with the data from those files
-            active_configs = {}
-            for conf in metadata_conf["active_configs"]:
-                conf_path = path.join(metadata_loc, metadata_repo_name,
-                                      conf)
-
-                # Replace the string with a dict having all the data
-                with open(conf_path) as conf_file:
-                    conf_loaded = yaml_load(conf_file, Loader=CLoader)
-                    active_configs[conf.replace(".conf", "")] = conf_loaded
-
-            # Since metadata_conf["active_configs"] is a list, we have to use
-            # a separate dict to store the new data until here
-            metadata_conf["active_configs"] = active_configs
+            def read_file(file_path):
+                with open(path.join(repo_loc, file_path)) as conf_file:
+                    return conf_file.read()
+
+            metadata_conf = self.read_metadata(read_file)
         finally:
             if metadata_loc:
                 rmtree(metadata_loc)
@@ -96,36 +428,16 @@ class Generator:
         """
 
         mdata_conf = self.clone_metadata()
-        mdata_req_keys = ["name", "packaging_url", "packaging_branch",
-                          "upload_target", "releases", "default_branch",
-                          "type", "upstream_url", "upstream_branch"]
-        mdata_opt_keys = ["upstream_url", "upstream_branch", "cascade"]
-        mdata_sub_keys = {"NAME": "name"}
-
-        for config in mdata_conf["active_configs"]:
-            # Get the data, not just the key
-            config = mdata_conf["active_configs"][config]
-
-            # If the config is a merger job, don't bother with it
-            if config["default"]["type"] == "merger":
-                continue
-            for package in config["repositories"]:
-                # Load defaults in if they're not there, ignore the optionals 
-                for mkey in mdata_req_keys:
-                    if mkey not in package and mkey in config["default"]:
-                        package[mkey] = config["default"][mkey]
-                # Don't proceed if any of the keys in the config are invalid
-                for mkey in package:
-                    if mkey not in mdata_req_keys and mkey not in \
-                       mdata_opt_keys:
-                        raise ValueError("Invalid key present:", mkey)
-                    # Substitute keys in
-                    for skey in mdata_sub_keys:
-                        if skey in package[mkey]:
-                            nkey = package[mkey]
-                            sub_key = package[mdata_sub_keys[skey]]
-                            nkey = nkey.replace(skey, sub_key)
-                            package[mkey] = nkey
+
+        # The cached metadata already has everything below done to it
+        if self.metadata_cached:
+            return mdata_conf
+
+        # Check every repository against the schema of its config, and fill
+        # in the defaults. Every problem found is reported at once.
+        validate_metadata(mdata_conf, self.template_variables())
+
+        self.save_parsed_metadata(mdata_conf)
 
         return mdata_conf
 
@@ -145,37 +457,66 @@ class Generator:
             if not envvar:
                 raise ValueError("API_SITE, API_USER, and API_KEY must be",
                                  "defined")
-        # Authenticate to the server
-        server = Jenkins(api_site, username=api_user, password=api_key)
+        # Nothing is loaded from the server yet, we take our own snapshot of
+        # what we need
+        jenkins_client = lazy_import("jenkins_client")
+        server = jenkins_client.JenkinsClient(api_site, username=api_user,
+                                              password=api_key,
+                                              workers=self.workers)
 
         return server
 
-    @timer.run("Load configuration files")
-    def load_config(self, job_type, data=None):
-        """Return a template that is a result of loading the data
+    @timer.run("Load the job index")
+    def load_job_index(self, server):
+        """Return a snapshot of the jobs and views on the server"""
+
+        index = JobIndex(server, owns_view=self.shard.owns_view)
+        index.snapshot()
+
+        return index
+
+    @timer.run("Load templates")
+    def get_template(self, job_type):
+        """Return the compiled template for the given job type
+
+        The template name should always correspond with the job type.
+        Regardless of the job type, there should always be a template.
+        """
+
+        return self.env.get_template(job_type + ".xml")
+
+    @timer.run("Load templates")
+    def template_variables(self):
+        """Return the variables every job type's template uses
+
+        The metadata schema only requires the keys these come from.
+        """
+
+        meta = lazy_import("jinja2.meta")
+        variables = {}
+        for job_type in ["merger", "package-stable", "package-unstable"]:
+            source = self.env.loader.get_source(self.env,
+                                                job_type + ".xml")[0]
+            variables[job_type] = meta.find_undeclared_variables(
+                self.env.parse(source))
+        return variables
+
+    def job_variables(self, job_type, data=None):
+        """Return the variables the template for the job type is rendered with
 
         This makes it easier to standardize several types of jobs
         """
 
-        # The template name should always correspond with the job type
-        # Regardless of the job type, there should always be a template
-        template_path = path.join("templates",
-                                  job_type + ".xml")
-        with open(template_path) as templatef:
-            template = ""
-            for text in templatef.readlines():
-                template += text
-            template = Template(template)
-
-        if data is not None:
-            url = data["packaging_url"]
-            branch = data["packaging_branch"]
-            upload_target = data["upload_target"]
-        elif job_type != "release-mgmt":
+        if data is None and job_type != "release-mgmt":
             raise AttributeError("Data cannot be empty, cannot parse job data.")
 
+        # Only the keys the template uses are required by the schema, so
+        # don't read anything else
         if job_type.startswith("package"):
-            upstream = data["upstream_url"]
+            url = data["packaging_url"]
+            branch = data["packaging_branch"]
+            upload_target = data["upload_target"]
+            upstream = data.get("upstream_url")
 
             # Parse the upload target into LP team names and PPA names
             # Example: ppa:lubuntu-ci/unstable-ci-proposed
@@ -184,150 +525,859 @@ class Generator:
             lp_info = list(upload_target.partition("/"))
             lp_info[0] = lp_info[0].replace("ppa:", "")
 
-            package_config = template.render(PACKAGING_URL=url,
-                                             PACKAGING_BRANCH=branch,
-                                             UPSTREAM_URL=upstream,
-                                             NAME=data["name"],
-                                             RELEASE=data["release"],
-                                             UPLOAD_TARGET=upload_target,
-                                             LP_TEAM=lp_info[0],
-                                             LP_PPA=lp_info[2])
+            variables = {"PACKAGING_URL": url,
+                         "PACKAGING_BRANCH": branch,
+                         "UPSTREAM_URL": upstream,
+                         "NAME": data["name"],
+                         "RELEASE": data["release"],
+                         "UPLOAD_TARGET": upload_target,
+                         "LP_TEAM": lp_info[0],
+                         "LP_PPA": lp_info[2],
+                         # The merger jobs of the package, which trigger it
+                         "MERGER_JOBS": ", ".join(
+                             merger + "_" + data["name"]
+                             for merger in data["mergers"])}
         elif job_type == "merger":
-            # Cascading merges
-            cascade = ""
-            # Iterate on each value
-            cascading = data["cascade"]
-            for i in range(len(cascading)):
-                # The default branch is first, we know this exists
-                if i == 0:
-                    cascade += "git checkout %s\n" % cascading[0]
-                    continue
-                c = cascading[i]
-                # Create branch if it doesn't exist, check it out
-                cascade += "git branch -a | egrep \"remotes/origin/"
-                cascade += "%s\" &amp;&amp; git checkout %s || git " % (c, c)
-                cascade += "checkout -b %s\n" % c
-                # Fast-forward merge the previous branch in
-                cascade += "git merge --ff-only %s\n" % cascading[i-1]
-                # Push this branch
-                cascade += "git push --set-upstream origin %s\n" % c
-
-            package_config = template.render(PACKAGING_URL=url,
-                                             MERGE_COMMANDS=cascade,
-                                             NAME=data["name"])
+            variables = {"PACKAGING_URL": data["packaging_url"],
+                         "MERGE_COMMANDS": self.merge_commands(
+                             data["cascade"]),
+                         "MERGER": data["merger"],
+                         "NAME": data["name"]}
         elif job_type == "release-mgmt":
-            package_config = template.render()
+            variables = {}
         else:
             raise ValueError("Invalid job type")
 
-        return package_config
+        return variables
+
+    def merge_commands(self, cascading):
+        """Return the shell commands doing the cascading merges
+
+        They're only built once for every cascade, and shared by all of
+        the mergers using it.
+        """
+
+        key = tuple(cascading)
+        cascade = self.cascade_cache.get(key)
+        if cascade is not None:
+            timer.count("Cascade cache hits")
+            return cascade
+        timer.count("Cascade cache misses")
+
+        # Cascading merges
+        cascade = ""
+        # Iterate on each value
+        for i in range(len(cascading)):
+            # The default branch is first, we know this exists
+            if i == 0:
+                cascade += "git checkout %s\n" % cascading[0]
+                continue
+            c = cascading[i]
+            # Create branch if it doesn't exist, check it out
+            cascade += "git branch -a | egrep \"remotes/origin/"
+            cascade += "%s\" &amp;&amp; git checkout %s || git " % (c, c)
+            cascade += "checkout -b %s\n" % c
+            # Fast-forward merge the previous branch in
+            cascade += "git merge --ff-only %s\n" % cascading[i-1]
+            # Push this branch
+            cascade += "git push --set-upstream origin %s\n" % c
+
+        self.cascade_cache[key] = cascade
+        return cascade
+
+    @timer.run("Render configuration files")
+    def load_config(self, spec):
+        """Return the rendered config of the job
+
+        Jobs with the same type and variables render the same, so the
+        config is taken from the render cache if it's there.
+        """
+
+        key = (spec.job_type, spec.variables)
+        config = self.render_cache.get(key)
+        if config is not None:
+            self.render_cache.move_to_end(key)
+            timer.count("Render cache hits")
+            return config
+        timer.count("Render cache misses")
+
+        template = self.get_template(spec.job_type)
+        config = template.render(**dict(spec.variables))
+
+        self.render_cache[key] = config
+        if len(self.render_cache) > self.render_cache_size:
+            self.render_cache.popitem(last=False)
+        return config
+
+    def render_jobs(self, specs):
+        """Render the jobs one at a time, yielding (spec, config)"""
+
+        for spec in specs:
+            yield spec, self.load_config(spec)
+
+    @timer.run("Fetch current job configs")
+    def fetch_job_config(self, index, name):
+        """Return the hash of the job's normalized config, if it exists"""
+
+        if name not in index.jobs:
+            return None
+        return config_digest(index.job_config(name))
 
     @timer.run("Create jobs and add to views")
-    def create_jenkins_job(self, server, config, name, view):
-        """This interacts with the Jenkins API to create the job"""
+    def create_jenkins_job(self, index, config, name, view):
+        """This interacts with the Jenkins API to create the job
 
-        print("Creating %s..." % name)
+        If the job exists, it's only updated if the rendered config differs
+        from the one on the server. The job is added to its view if it isn't
+        there already.
+        """
 
-        if name in server.keys():
-            job = server.get_job(name)
-            job.update_config(config)
-        else:
-            job = server.create_job(name, str(config))
-            if view in server.views:
-                view = server.views[view]
+        current = self.fetch_job_config(index, name)
+        if current is not None:
+            if not self.force and current == config_digest(config):
+                result = "unchanged"
             else:
-                view = server.views.create(view)
+                print("Updating %s..." % name)
+                index.update_job(name, config)
+                result = "updated"
+        else:
+            print("Creating %s..." % name)
+            index.create_job(name, config)
+            result = "created"
 
-            view.add_job(name)
+        index.add_job_to_view(view, name)
 
-    @timer.run("Master function loop")
-    def create_jenkins_jobs(self):
-        """Interface with Jenkins to create the jobs required
+        with self.stats_lock:
+            self.stats[result] += 1
 
-        This uses the Jenkins API to do the following tasks:
-         1. Assess which jobs are currently defined and if the jobs defined
-            in the metadata overlap with those, do an update of the job config
-            to match the current template.
-         2. If there are new jobs defined, create them. If there are jobs no
-            longer defined, remove them.
-         3. Update the per-release views to ensure the jobs are in the correct
-            views. If there are any releases no longer defined, remove them.
+    def push_jenkins_jobs(self, index, jobs):
+        """Create or update the rendered jobs using a pool of workers
+
+        jobs is an iterable of (spec, config). Only a couple of jobs per
+        worker are rendered ahead of the ones being pushed, so the rendered
+        configs don't pile up in memory. A failure is recorded in
+        self.errors instead of aborting the run, so the rest of the jobs
+        still get pushed.
         """
 
-        # Authenticate to the Jenkins server
-        print("Authenticated to Jenkins...")
-        server = self.auth_jenkins_server()
+        if self.push_backend == "script":
+            self.push_jenkins_jobs_script(index, jobs)
+            return
 
-        # Parse the metadata
-        print("Parsing the metadata...")
-        metadata = self.parse_metadata()
+        def collect(done):
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    print("Failed to push %s: %s" % (name, e))
+                    self.errors[name] = e
 
-        total_rel = set()
+        # Keep the timings of the workers under the current span
+        create_jenkins_job = timer.bind(self.create_jenkins_job)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {}
+            for spec, config in jobs:
+                if len(pending) >= 2 * self.workers:
+                    collect(wait(pending, return_when=FIRST_COMPLETED)[0])
+                future = pool.submit(create_jenkins_job, index, config,
+                                     spec.name, spec.view)
+                pending[future] = spec.name
+            collect(wait(pending)[0])
+
+    @timer.run("Push jobs with a script")
+    def push_jenkins_jobs_script(self, index, jobs):
+        """Create or update the rendered jobs through the script console
 
-        configs = {"merger": {}, "stable": {}, "unstable": {}}
+        The jobs are taken batch_size at a time. For every batch, the
+        current configs are fetched with one script, and the jobs which
+        changed or aren't in their view yet are sent with another. Failures
+        are recorded in self.errors, like push_jenkins_jobs().
+        """
+
+        pusher = ScriptPush(index, self.batch_size)
+        jobs = iter(jobs)
+        while True:
+            batch = list(islice(jobs, self.batch_size))
+            if not batch:
+                break
+
+            # The script would create missing views itself, so make sure
+            # the ones another shard owns are there first
+            if self.shard.count > 1:
+                for view in sorted({spec.view for spec, config in batch}):
+                    index.ensure_view(view)
+
+            current = pusher.fetch_configs([spec.name for spec, config in
+                                            batch if spec.name in index.jobs])
+            changes = []
+            for spec, config in batch:
+                if spec.name in current and not self.force and \
+                        config_digest(current[spec.name]) == \
+                        config_digest(config):
+                    if spec.name in index.views.get(spec.view, ()):
+                        self.stats["unchanged"] += 1
+                        continue
+                    # Only add it to its view
+                    config = None
+                changes.append((spec.name, config, spec.view))
+
+            print("Pushing %d jobs..." % len(changes))
+            for name, result in pusher.push(changes).items():
+                if result.startswith("error"):
+                    print("Failed to push %s: %s" % (name, result))
+                    self.errors[name] = ValueError(result)
+                else:
+                    self.stats[result] += 1
+
+    @timer.run("Build the trigger graph")
+    def trigger_waves(self, specs, known):
+        """Return the specs in waves, each after the jobs it's triggered by
+
+        Every job is rendered to find its triggers. The configs aren't kept,
+        so they're rendered again as each wave is pushed. known is the names
+        of the other jobs that will be there once the run is done; triggers
+        naming anything else are reported. Raises a ValueError if there are
+        trigger cycles, or missing jobs with strict_triggers set.
+        """
+
+        graph = TriggerGraph()
+        for spec, config in self.render_jobs(specs):
+            graph.add(spec.name, config)
+
+        dangling = graph.dangling(known)
+        for name, missing in sorted(dangling.items()):
+            print("%s has triggers on missing jobs: %s" %
+                  (name, ", ".join(missing)))
+        timer.count("Dangling triggers",
+                    sum(len(missing) for missing in dangling.values()))
+        if dangling and self.strict_triggers:
+            raise ValueError("%d jobs have triggers on missing jobs" %
+                             len(dangling))
+
+        by_name = {spec.name: spec for spec in specs}
+        return [[by_name[name] for name in wave] for wave in graph.waves()]
+
+    def job_specs(self, metadata):
+        """Yield every job defined by the metadata, without rendering them
+
+        Each job is a JobSpec, which carries everything needed to render
+        it. They're made one at a time, and the metadata is never changed.
+        """
+
+        configs = metadata["active_configs"]
+        by_type = {"merger": [], "stable": [], "unstable": []}
         # Sort config names into different categories
-        for config in metadata["active_configs"]:
-            config_name = config
-            config = metadata["active_configs"][config]
-            for config_type in configs:
-                if config["default"]["type"] == config_type:
-                    configs[config_type][config_name] = metadata["active_configs"][config_name].copy()
-
-
-        # Create the merger jobs first
-        for config in configs["merger"]:
-            config_name = config
-            config = configs["merger"][config]
-            parent = metadata["active_configs"][config["default"]["parent"]]
+        for config_name, config in configs.items():
+            if config["default"]["type"] in by_type:
+                by_type[config["default"]["type"]].append(config_name)
+
+        # Create the merger jobs first, and remember which configs they
+        # merge into, so the package jobs are triggered by them whatever
+        # the merger configs are named
+        mergers = {}
+        for config_name in by_type["merger"]:
+            config = configs[config_name]
+            mergers.setdefault(config["default"]["parent"],
+                               []).append(config_name)
+            parent = configs[config["default"]["parent"]]
             for package in parent["repositories"]:
-                if "cascade" not in package:
-                    package["cascade"] = config["default"]["cascade"]
-                name = config_name + "_" + package["name"]
-                p_config = self.load_config("merger", package)
-                self.create_jenkins_job(server, p_config, name, "merger")
+                # A cascade on the package overrides the one of the merger
+                data = dict(package, merger=config_name)
+                data.setdefault("cascade", config["default"]["cascade"])
+                yield self.job_spec("merger", data,
+                                    config_name + "_" + package["name"],
+                                    "merger")
 
         # Create the package jobs
+        total_rel = set()
         for job_type in ["stable", "unstable"]:
-            # This is the actual loop
-            for config in configs[job_type]:
-                config_name = config
-                config = configs[job_type][config]
+            for config_name in by_type[job_type]:
                 # Loop on the individual packages
-                for package in config["repositories"]:
+                for package in configs[config_name]["repositories"]:
                     # Loop on each release
                     for release in package["releases"]:
                         # Add the release to the total release set, which is
                         # used to generate the management jobs
                         total_rel.add(release)
 
-                        package["release"] = release
-                        # Get the package config from the template
-                        p_config = self.load_config("package-" + job_type,
-                                                    package)
                         name = "%s_%s_%s" % (release, config_name,
                                              package["name"])
                         view_name = release + " " + \
-                                config_name.replace("_", " ")
-
-                        # Actually create the job
-                        self.create_jenkins_job(server, p_config, name,
-                                                view_name)
-
-        # From here on out, the same template is used
-        p_config = self.load_config("release-mgmt")
+                            config_name.replace("_", " ")
+                        data = dict(package, release=release,
+                                    mergers=mergers.get(config_name, []))
+                        yield self.job_spec("package-" + job_type, data,
+                                            name, view_name)
 
         # Generate a management job for every release, stable and unstable
-        for release in total_rel:
+        for release in sorted(total_rel):
             for jobtype in ["stable", "unstable"]:
                 job_name = "mgmt_build_" + release + "_" + jobtype
-                self.create_jenkins_job(server, p_config, job_name, "mgmt")
+                yield self.job_spec("release-mgmt", None, job_name, "mgmt")
 
         # Generate one last merger management job
-        self.create_jenkins_job(server, p_config, "merger", "mgmt")
+        yield self.job_spec("release-mgmt", None, "merger", "mgmt")
+
+    def job_spec(self, job_type, data, name, view):
+        """Return the JobSpec of a job, given the data it's rendered from"""
+
+        variables = self.job_variables(job_type, data)
+        return JobSpec(job_type, name, view, tuple(sorted(variables.items())))
+
+    def affected_specs(self, specs, applied, desired, digests, index):
+        """Yield the specs which have to be pushed
+
+        Every spec's view is recorded in desired, by job name, whether it's
+        pushed or not. Only the specs of this shard are pushed. When running
+        incrementally, specs which haven't changed since they were applied
+        are skipped, as long as the index still has the job in its view,
+        and the hash of the others is recorded in digests.
+        """
+
+        for spec in specs:
+            desired[spec.name] = spec.view
+            if not self.shard.owns_job(spec.name):
+                continue
+            if self.incremental:
+                digest = self.job_digest(spec)
+                # Someone may have deleted the job, or taken it out of its
+                # view, by hand
+                in_place = spec.name in index.jobs and \
+                    spec.name in index.views.get(spec.view, ())
+                if not self.force and in_place and \
+                        applied.get(spec.name) == digest:
+                    continue
+                digests[spec.name] = digest
+            yield spec
+
+    def job_digest(self, spec):
+        """Return a hash of everything that goes into rendering a job
+
+        This covers the template source as well as the variables it's
+        rendered with, so a change to either one changes the hash. Metadata
+        that doesn't make it into the job, such as the list of releases for
+        a package, doesn't matter.
+        """
+
+        if spec.job_type not in self.template_digests:
+            source = self.env.loader.get_source(self.env,
+                                                spec.job_type + ".xml")[0]
+            self.template_digests[spec.job_type] = \
+                sha256(source.encode("utf-8")).hexdigest()
+
+        inputs = json.dumps([self.template_digests[spec.job_type],
+                             dict(spec.variables), spec.view], sort_keys=True)
+        return sha256(inputs.encode("utf-8")).hexdigest()
+
+    def applied_state_path(self):
+        """Return where the last applied state is stored"""
+
+        # Every shard only applies its own jobs, so they keep separate state
+        if self.shard.count > 1:
+            return path.join(self.metadata_cache, "applied-%d-of-%d.json" %
+                             (self.shard.index, self.shard.count))
+        return path.join(self.metadata_cache, "applied.json")
+
+    def load_applied_state(self):
+        """Return the state left by the last run
+
+        This holds the jobs it applied incrementally, with their hashes,
+        and every config (with its type), release and view the generator
+        has made so far. If nothing was applied yet, these are all empty.
+        """
+
+        state = {"jobs": {}, "configs": {}, "releases": [], "views": []}
+        try:
+            with open(self.applied_state_path()) as state_file:
+                state.update(json.load(state_file))
+        except (OSError, ValueError):
+            return state
+
+        print("Last applied metadata was at %s" % state["sha"])
+        return state
+
+    def save_applied_state(self, state):
+        """Store the state of this run, see load_applied_state()"""
+
+        state = dict(state, sha=self.metadata_sha)
+
+        makedirs(self.metadata_cache, exist_ok=True)
+        state_path = self.applied_state_path()
+        with open(state_path + ".tmp", "w") as state_file:
+            json.dump(state, state_file)
+        replace(state_path + ".tmp", state_path)
+
+    def known_names(self, metadata, state):
+        """Return the configs, releases and views made by the generator
+
+        These are the ones in the metadata, as well as the ones recorded in
+        the state by earlier runs, so what a config left behind is still
+        known once it's taken out of ci.conf. Configs map to their type.
+        """
+
+        configs = dict(state["configs"])
+        releases = set(state["releases"])
+        for config_name, config in metadata["active_configs"].items():
+            configs[config_name] = config["default"]["type"]
+            if config["default"]["type"] != "merger":
+                for package in config["repositories"]:
+                    releases.update(package["releases"])
+
+        views = set(state["views"])
+        for config_name, config_type in configs.items():
+            if config_type != "merger":
+                views.update(release + " " + config_name.replace("_", " ")
+                             for release in releases)
+
+        return {"configs": configs, "releases": sorted(releases),
+                "views": sorted(views)}
+
+    def managed_jobs(self, index, known, applied):
+        """Return the jobs on the server which were made by the generator
+
+        Only jobs following our naming scheme for a known release and
+        config count, as well as anything a previous run applied. Jobs
+        that aren't ours are never touched.
+        """
+
+        releases = "|".join(re.escape(name) for name in known["releases"])
+        package_configs = "|".join(
+            re.escape(name) for name, config_type in
+            sorted(known["configs"].items()) if config_type != "merger")
+        merger_configs = "|".join(
+            re.escape(name) for name, config_type in
+            sorted(known["configs"].items()) if config_type == "merger")
+
+        patterns = ["merger"]
+        if releases:
+            patterns.append("mgmt_build_(%s)_(un)?stable" % releases)
+            if package_configs:
+                patterns.append("(%s)_(%s)_.+" % (releases, package_configs))
+        if merger_configs:
+            patterns.append("(%s)_.+" % merger_configs)
+        managed = re.compile("^(%s)$" % "|".join(patterns))
+
+        return {name for name in index.jobs
+                if managed.match(name) or name in applied}
+
+    def plan_prune(self, index, known, desired, applied):
+        """Return the jobs and views to prune, see prune_jenkins_jobs()
+
+        desired maps the name of every job in the metadata to its view.
+        Anything managed by the generator that isn't desired is an orphan.
+        Known views which held jobs, and would be left empty, are dropped;
+        views which were empty already are left alone. Each shard only
+        prunes its own jobs and views. Raises a ValueError if more than
+        max_prune jobs and views would go.
+        """
+
+        desired_jobs = set(desired)
+        desired_views = set(desired.values())
+
+        # Every orphan counts when deciding whether a view ends up empty,
+        # whichever shard prunes it
+        all_orphans = self.managed_jobs(index, known, applied) - desired_jobs
+        orphans = {name for name in all_orphans if self.shard.owns_job(name)}
+        if self.prune == "disable":
+            orphans -= index.disabled
+
+        empty_views = set()
+        if self.prune == "delete":
+            for view in known["views"]:
+                jobs = index.views.get(view)
+                if view in desired_views or not jobs or \
+                        not self.shard.owns_view(view):
+                    continue
+                if not jobs - all_orphans:
+                    empty_views.add(view)
+
+        # Something is probably wrong with the metadata if this much would
+        # go away at once, so don't do anything
+        total = len(orphans) + len(empty_views)
+        if not self.dry_run and total > self.max_prune:
+            raise ValueError("Refusing to prune %d jobs and views, the limit "
+                             "is %d" % (total, self.max_prune))
+
+        return orphans, empty_views
+
+    @timer.run("Prune orphaned jobs")
+    def prune_jenkins_jobs(self, index, orphans, empty_views):
+        """Disable or delete jobs and views no longer defined in the metadata
+
+        These come from plan_prune(). Returns the names of the jobs pruned.
+        """
 
+        if self.dry_run:
+            action = "Would " + self.prune
+        else:
+            action = {"disable": "Disabling", "delete": "Deleting"}[self.prune]
+        for name in sorted(orphans):
+            print("%s %s" % (action, name))
+        for view in sorted(empty_views):
+            print("%s view %s" % ("Would delete" if self.dry_run else
+                                  "Deleting", view))
+
+        if self.dry_run or (not orphans and not empty_views):
+            return set()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            if self.prune == "delete":
+                list(pool.map(index.delete_job, orphans))
+            else:
+                list(pool.map(index.disable_job, orphans))
+        for view in empty_views:
+            index.delete_view(view)
+
+        return orphans
+
+    @timer.run("Render jobs to disk")
+    def render_jenkins_jobs(self, out_dir):
+        """Render every job into the given directory, without Jenkins
+
+        Each job is written to <job name>.xml, and manifest.json lists every
+        job with its view and the hash of its normalized config.
+        """
+
+        metadata = self.parse_metadata()
+
+        makedirs(out_dir, exist_ok=True)
+        manifest = []
+        for spec, p_config in self.render_jobs(self.job_specs(metadata)):
+            with open(path.join(out_dir, spec.name + ".xml"),
+                      "w") as job_file:
+                job_file.write(p_config)
+            manifest.append({"name": spec.name, "view": spec.view,
+                             "hash": config_digest(p_config)})
+
+        with open(path.join(out_dir, "manifest.json"), "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+        print("Rendered %d jobs into %s" % (len(manifest), out_dir))
+        return manifest
+
+    @timer.run("Master function loop")
+    def create_jenkins_jobs(self):
+        """Interface with Jenkins to create the jobs required
+
+        This uses the Jenkins API to do the following tasks:
+         1. Assess which jobs are currently defined and if the jobs defined
+            in the metadata overlap with those, do an update of the job config
+            to match the current template.
+         2. If there are new jobs defined, create them. If there are jobs no
+            longer defined, remove them.
+         3. Update the per-release views to ensure the jobs are in the correct
+            views. If there are any releases no longer defined, remove them.
+
+        The metadata is turned into job specs, which are sorted into waves
+        by their triggers, so every job is created after the jobs it's
+        triggered by. Each wave is rendered and pushed in parallel as the
+        specs come, so only a few rendered jobs are in memory at any time.
+        """
+
+        # Authenticate to the Jenkins server, unless an earlier run of the
+        # daemon already did
+        if self.server is None:
+            print("Authenticated to Jenkins...")
+            self.server = self.auth_jenkins_server()
+        server = self.server
+
+        # Take a snapshot of the jobs and views on the server. The index
+        # keeps itself up to date with what we push, so the daemon reuses
+        # it for as long as every push succeeds.
+        if self.index is None:
+            print("Loading the job index...")
+            self.index = self.load_job_index(server)
+        index = self.index
+        requests = index.requests
+
+        # Parse the metadata
+        print("Parsing the metadata...")
+        metadata = self.parse_metadata()
+
+        # What earlier runs applied and made, if there's anywhere to keep it
+        state = {"jobs": {}, "configs": {}, "releases": [], "views": []}
+        if self.metadata_cache:
+            state = self.load_applied_state()
+        applied = state["jobs"] if self.incremental else {}
+        known = self.known_names(metadata, state)
+
+        # Every job in the metadata, mapped to its view, and the hashes of
+        # the jobs pushed incrementally; both are filled in as the specs go
+        # through the pipeline
+        desired = {}
+        digests = {}
+        specs = list(self.affected_specs(self.job_specs(metadata), applied,
+                                         desired, digests, index))
+        owned = sum(1 for name in desired if self.shard.owns_job(name))
+        if self.shard.count > 1:
+            print("Shard %s has %d of %d jobs" % (self.shard, owned,
+                                                  len(desired)))
+
+            # Create this shard's views before anything else, since the
+            # other shards wait for them before adding their jobs
+            for view in sorted(set(desired.values())):
+                if self.shard.owns_view(view):
+                    index.ensure_view(view)
+
+        # Decide what to prune before pushing anything, so a run which
+        # would prune too much still pushes and reports the rest
+        orphans, empty_views = set(), set()
+        if self.prune:
+            try:
+                orphans, empty_views = self.plan_prune(index, known, desired,
+                                                       applied)
+            except ValueError as e:
+                print("Not pruning:", e)
+                self.errors[""] = e
+
+        # Find the triggers between the jobs before pushing anything. Jobs
+        # which aren't pushed are either on the server already or defined
+        # in the metadata, unless they're about to be deleted.
+        existing = set(desired) | index.jobs
+        if self.prune == "delete":
+            existing -= orphans
+        waves = self.trigger_waves(specs, existing)
+
+        # Render the jobs and push them as they come, one wave at a time
+        for i, wave in enumerate(waves):
+            print("Pushing wave %d of %d, with %d jobs..." %
+                  (i + 1, len(waves), len(wave)))
+            self.push_jenkins_jobs(index, self.render_jobs(wave))
+
+        if self.incremental and not self.force:
+            print("%d of %d jobs affected since the last applied state" %
+                  (len(digests), owned))
+
+        # Get rid of what's no longer defined
+        pruned = set()
+        if orphans or empty_views:
+            print("Pruning orphaned jobs...")
+            pruned = self.prune_jenkins_jobs(index, orphans, empty_views)
+            for name in pruned:
+                applied.pop(name, None)
+
+        # Remember what was applied, so the next run only has to push what
+        # changed since. Failed jobs are left out so they're tried again.
+        # Without incremental runs, there are no hashes to keep, but what
+        # was made is still recorded, so it can be pruned later.
+        if self.incremental:
+            applied.update({name: digest for name, digest in digests.items()
+                            if name not in self.errors})
+            for name in self.errors:
+                applied.pop(name, None)
+        if self.metadata_cache:
+            views = (set(state["views"]) | set(desired.values())) - \
+                (empty_views if not self.dry_run else set())
+            self.save_applied_state({"jobs": applied,
+                                     "configs": known["configs"],
+                                     "releases": known["releases"],
+                                     "views": sorted(views)})
+
+        print("%d created, %d updated, %d unchanged, %d failed" %
+              (self.stats["created"], self.stats["updated"],
+               self.stats["unchanged"], len(self.errors)))
+        print("%d Jenkins API requests" % (index.requests - requests))
+        timer.count("Jenkins API requests", index.requests - requests)
+        server.display()
+
+        self.summary = {"shard": str(self.shard), "sha": self.metadata_sha,
+                        "jobs": owned, "pruned": len(pruned),
+                        "failed": len(self.errors),
+                        "requests": index.requests - requests,
+                        "errors": {name: str(error) for name, error in
+                                   self.errors.items()}}
+        self.summary.update(self.stats)
+
+        # Something we didn't expect happened on the server, so don't trust
+        # the index next time
+        if self.errors:
+            self.index = None
+
+        return self.errors
+
+    def run_daemon(self, interval=60.0, after=None):
+        """Apply every new metadata commit as it comes, until stopped
+
+        The remote HEAD of the metadata repository is checked every
+        interval seconds, which is a single cheap request. When it moves,
+        the jobs are applied incrementally, reusing the Jenkins session, the
+        job index, the compiled templates and the metadata mirror of the
+        runs before. after is called once every run is done, with its
+        errors. SIGTERM and SIGINT stop the daemon between runs.
+
+        Templates are only read once, so changing them needs a restart.
+        """
+
+        metadata_url = getenv("METADATA_URL")
+        if not metadata_url:
+            raise ValueError("METADATA_URL must be set")
+
+        stopped = Event()
+
+        def stop(signum, frame):
+            print("Stopping after the current run...")
+            stopped.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        git = lazy_import("git")
+        last_sha = None
+        while not stopped.is_set():
+            try:
+                head = git.Git().ls_remote(metadata_url, "HEAD").split()[0]
+            except (git.exc.GitError, IndexError) as e:
+                print("Failed to check the metadata for changes:", e)
+                head = last_sha
+
+            if head != last_sha:
+                print("Applying metadata at %s..." % head)
+                self.stats = {"created": 0, "updated": 0, "unchanged": 0}
+                self.errors = {}
+                try:
+                    errors = self.create_jenkins_jobs()
+                except Exception as e:
+                    # Try again on the next round, from a fresh snapshot
+                    print("Run failed:", e)
+                    errors = {"": e}
+                    self.index = None
+                else:
+                    if not errors:
+                        last_sha = head
+                if after:
+                    after(errors)
+
+            stopped.wait(interval)
 
 
 if __name__ == "__main__":
-    generator = Generator()
-    print(generator.create_jenkins_jobs())
-    timer.display()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Push every job config, even if unchanged")
+    parser.add_argument("-j", "--jobs", type=int, default=8,
+                        help="Maximum number of concurrent Jenkins requests")
+    parser.add_argument("--template-cache",
+                        default=getenv("TEMPLATE_CACHE_DIR"),
+                        help="Directory to keep compiled templates in")
+    parser.add_argument("--metadata-cache",
+                        default=getenv("METADATA_CACHE_DIR"),
+                        help="Directory to keep a mirror of the metadata in")
+    parser.add_argument("--clear-metadata-cache", action="store_true",
+                        help="Remove the cached, parsed metadata and exit")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="Only push jobs affected by metadata or "
+                             "template changes since the last run")
+    parser.add_argument("--prune", choices=["disable", "delete"],
+                        help="Disable or delete jobs no longer defined in "
+                             "the metadata, and drop their empty views")
+    parser.add_argument("--max-prune", type=int, default=25,
+                        help="Refuse to prune more than this many jobs and "
+                             "views in one run")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+                        help="Only list what would be pruned")
+    parser.add_argument("--render-only", metavar="DIR",
+                        help="Write the job configs and a manifest into DIR "
+                             "instead of pushing them to Jenkins")
+    parser.add_argument("--metrics-json", default=getenv("METRICS_JSON"),
+                        help="Write the timers and counters here as JSON")
+    parser.add_argument("--metrics-textfile",
+                        default=getenv("METRICS_TEXTFILE"),
+                        help="Write the timers and counters here in the "
+                             "OpenMetrics format, for node_exporter")
+    parser.add_argument("--metrics-trace", default=getenv("METRICS_TRACE"),
+                        help="Write every timed call here as a Chrome trace")
+    parser.add_argument("--profile", action="append", default=[],
+                        metavar="LABEL",
+                        help="Run cProfile on this timer, such as \"Parse "
+                             "the metadata\"; can be given more than once")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="Track the memory allocated by every timer")
+    parser.add_argument("--profile-dir", default=getenv("TIMER_PROFILE_DIR"),
+                        help="Write the cProfile output here, one file per "
+                             "label")
+    parser.add_argument("--push-backend", choices=["rest", "script"],
+                        default=getenv("PUSH_BACKEND", "rest"),
+                        help="Push jobs with REST calls, or in batches "
+                             "through the script console")
+    parser.add_argument("--batch-size", type=int, default=500,
+                        help="Jobs per script with --push-backend script")
+    parser.add_argument("--strict-triggers", action="store_true",
+                        help="Refuse to push jobs with triggers on jobs that "
+                             "don't exist")
+    parser.add_argument("--shard", type=Shard.parse,
+                        default=getenv("GENERATOR_SHARD", "0/1"),
+                        help="Only push this shard of the jobs, given as "
+                             "i/N with i from 0 to N - 1")
+    parser.add_argument("--summary-json", default=getenv("SUMMARY_JSON"),
+                        help="Write the totals of the run here, to merge "
+                             "the shards with ci/shards.py")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Keep running, and incrementally apply every "
+                             "new metadata commit")
+    parser.add_argument("--interval", type=float, default=60.0,
+                        help="Seconds between checks for new metadata with "
+                             "--daemon")
+    args = parser.parse_args()
+
+    timer.enable_profiling(args.profile, args.profile_memory)
+
+    def report():
+        """Show the timers, and write them wherever they were asked for"""
+        timer.display()
+        if args.metrics_json:
+            timer.write_json(args.metrics_json)
+        if args.metrics_textfile:
+            timer.write_openmetrics(args.metrics_textfile)
+        if args.metrics_trace:
+            timer.write_trace(args.metrics_trace)
+        if args.profile_dir:
+            timer.write_profiles(args.profile_dir)
+        if args.summary_json and generator.summary:
+            write_atomically(args.summary_json,
+                             json.dumps(generator.summary, indent=2))
+
+    if args.incremental and not args.metadata_cache:
+        parser.error("--incremental needs --metadata-cache")
+    if args.daemon and not args.metadata_cache:
+        parser.error("--daemon needs --metadata-cache")
+
+    generator = Generator(force=args.force, workers=args.jobs,
+                          template_cache=args.template_cache,
+                          metadata_cache=args.metadata_cache,
+                          incremental=args.incremental or args.daemon,
+                          prune=args.prune, max_prune=args.max_prune,
+                          dry_run=args.dry_run,
+                          push_backend=args.push_backend,
+                          batch_size=args.batch_size,
+                          strict_triggers=args.strict_triggers,
+                          shard=args.shard)
+    # Everything between the imports and the real work
+    timer.record("Startup", perf_counter() - IMPORTED)
+
+    if args.clear_metadata_cache:
+        if not args.metadata_cache:
+            parser.error("--clear-metadata-cache needs --metadata-cache")
+        generator.clear_parsed_metadata()
+        sys.exit(0)
+
+    if args.render_only:
+        generator.render_jenkins_jobs(args.render_only)
+        report()
+        sys.exit(0)
+
+    if args.daemon:
+        def report_run(errors):
+            """Report on one run of the daemon, then start over"""
+            report()
+            timer.reset()
+
+        generator.run_daemon(args.interval, after=report_run)
+        sys.exit(0)
+
+    errors = generator.create_jenkins_jobs()
+    report()
+
+    # Only fail once every job has had a chance to be pushed
+    if errors:
+        sys.exit(1)
@@ -16,121 +16,430 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import argparse
-from time import sleep
+from os import getenv
+from random import uniform
+from time import monotonic, sleep
+from datetime import datetime, timezone
 from launchpadlib.launchpad import Launchpad
+from lazr.restfulclient.errors import NotFound
+from build_telemetry import BuildTelemetry, append_history, link_name
+
+# Build states which mean the build isn't done yet
+BUILDING_STATES = ["Needs building", "Currently building", "Uploading build"]
+
+
+class PollScheduler:
+    """Poll Scheduler
+
+    This decides how long to wait between checks. It starts with a short
+    interval, since Launchpad is often done within a couple of minutes, and
+    backs off exponentially up to a maximum interval, with some random
+    jitter so many checks started at once don't stay in lockstep. Once the
+    deadline has passed, there's no more waiting.
+    """
+
+    def __init__(self, initial=30.0, factor=1.5, jitter=0.1, maximum=300.0,
+                 deadline=7200.0):
+        self.initial = initial
+        self.factor = factor
+        # The fraction of the interval to randomly add or take away
+        self.jitter = jitter
+        self.maximum = maximum
+        self.deadline = deadline
+        self.reset()
+
+    def reset(self):
+        """Start over with the initial interval and a fresh deadline"""
+        self.start = monotonic()
+        self.interval = self.initial
+
+    def elapsed(self):
+        """Return how many seconds have passed since the start"""
+        return monotonic() - self.start
+
+    def wait(self):
+        """Sleep until the next check is due
+
+        Returns False without sleeping if the deadline has passed.
+        """
+        remaining = self.deadline - self.elapsed()
+        if remaining <= 0:
+            return False
+
+        delay = self.interval * uniform(1 - self.jitter, 1 + self.jitter)
+        sleep(max(0, min(delay, remaining)))
+        self.interval = min(self.interval * self.factor, self.maximum)
+        return True
+
+
+class BuildProgress:
+    """The progress of the builds and binaries of one source publication
+
+    builds and binaries are None until they've been listed for the first
+    time, after which they only hold the entries which are still pending,
+    keyed by architecture and by binary publication. Once every build is
+    done, builds is empty; once every binary is published, so is binaries.
+    built holds the architectures which built successfully, and listed the
+    ones with binaries listed so far, and published the links of the
+    binaries which are published. If a BuildTelemetry is given, every build
+    and binary seen is recorded in it.
+    """
+
+    def __init__(self, telemetry=None):
+        self.builds = None
+        self.binaries = None
+        self.built = set()
+        self.listed = set()
+        self.published = set()
+        self.last_published = None
+        self.telemetry = telemetry
+
+    def unlisted(self):
+        """Return the built architectures with no binaries listed yet"""
+        return self.built - self.listed
+
+    def done(self):
+        return self.binaries == {} and not self.unlisted()
 
 
 class LaunchpadCheck:
-    def __init__(self):
-        parser = argparse.ArgumentParser()
-        parser.add_argument("-p", "--package", help="The source package",
-                            required=True)
-        parser.add_argument("-v", "--package-version", help="The package version",
-                            required=True)
-        parser.add_argument("-t", "--lp-team", help="Launchpad user with the PPA",
-                            required=True)
-        parser.add_argument("-r", "--ppa", help="Name of the Launchpad PPA",
-                            required=True)
-        args = parser.parse_args()
-        self.lp_person = args.lp_team
-        self.ppa_name = args.ppa
-        self.verify_binaries_published(args.package, args.package_version)
+    def __init__(self, lp_person, ppa_name, source_schedule=None,
+                 binary_schedule=None, lp=None, cache_dir=None):
+        self.lp_person = lp_person
+        self.ppa_name = ppa_name
+        # Never wait for more than two hours for the source. Binaries get
+        # six hours, to provide time for publisher maintenance on Sundays,
+        # which can take up to six hours.
+        self.source_schedule = source_schedule or PollScheduler()
+        self.binary_schedule = binary_schedule or \
+            PollScheduler(deadline=21600.0)
+        # Where launchpadlib keeps the service description and its HTTP
+        # cache. Sharing this between jobs on a node means the WADL is only
+        # downloaded once, and unchanged entries are revalidated with their
+        # ETag instead of downloaded again. None uses ~/.launchpadlib.
+        self.cache_dir = cache_dir
+        # The number of HTTP requests made to Launchpad; every page of a
+        # collection is its own request. Of those, how many were answered
+        # from the cache (possibly after a 304 Not Modified), and how many
+        # bytes had to be downloaded.
+        self.requests = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.bytes_received = 0
+        # An existing Launchpad session (or a stand-in for one) to use
+        # instead of logging in
+        self.lp = lp
+        if lp is not None:
+            self.count_requests(lp._browser._connection)
+
+    def count_requests(self, connection):
+        """Count every request made over the connection from now on"""
+        request = connection.request
+
+        def counted_request(*args, **kwargs):
+            self.requests += 1
+            result = request(*args, **kwargs)
+            # The fake Launchpad doesn't return anything
+            if result is not None:
+                response, content = result
+                if response.fromcache:
+                    self.cache_hits += 1
+                else:
+                    self.cache_misses += 1
+                    self.bytes_received += len(content or b"")
+            return result
+
+        connection.request = counted_request
 
     def login(self):
-        """Log in to Launchpad anonymously"""
-        lp = Launchpad.login_anonymously("CI Infrastructure", "production",
-                                         version="devel")
-        return lp
+        """Log in to Launchpad anonymously
 
-    def verify_source_published(self, package, package_version):
-        """Verify that the source is published"""
-        # Log in to Launchpad
+        This only happens once, later calls return the same session.
+        """
+        if self.lp is not None:
+            return self.lp
+
+        check = self
+
+        class CountedLaunchpad(Launchpad):
+            # Count the requests made while logging in as well, which is
+            # when the service description is fetched
+            def httpFactory(self, *args, **kwargs):
+                http = Launchpad.httpFactory(self, *args, **kwargs)
+                check.count_requests(http)
+                return http
+
+        self.lp = CountedLaunchpad.login_anonymously(
+            "CI Infrastructure", "production", version="devel",
+            launchpadlib_dir=self.cache_dir)
+        return self.lp
+
+    def print_http_stats(self):
+        """Print how much of the traffic to Launchpad the cache saved"""
+        print("Launchpad API: %d requests, %d cache hits, %d cache misses, "
+              "%d bytes downloaded." % (self.requests, self.cache_hits,
+                                        self.cache_misses,
+                                        self.bytes_received))
+
+    def report_detection(self, what, published):
+        """Print how long it took to notice something was published"""
+        if published is None:
+            return
+        lag = datetime.now(timezone.utc) - published
+        print("%s published at %s, detected %d seconds later." %
+              (what, published.isoformat(), lag.total_seconds()))
+
+    def get_ppa(self, lp_person, ppa_name):
+        """Return the PPA object with the given owner and name"""
         lp = self.login()
 
-        # Grab the correct PPA object
-        ppa = None
-        for ippa in lp.people[self.lp_person].ppas:
-            if ippa.name == self.ppa_name:
-                ppa = ippa
+        try:
+            ppa = lp.people[lp_person].getPPAByName(name=ppa_name)
+        except (KeyError, NotFound):
+            ppa = None
 
         if ppa is None:
             raise ValueError("No PPA information available for package or package version.")
+        return ppa
+
+    def check_source(self, ppa, package, package_version):
+        """Check once whether the source is published
 
-        # We're verifying every five minutes; never go to more than two hours
-        # (60 minutes × 2 hours) ÷ 5 minutes = 24 max iterations
-        for i in range(0, 24):
-            print("Verifying if source is published,", (i*5), "minutes in.")
+        Returns the source publication once it's published, and None while
+        it's still pending.
+        """
+        try:
+            # Without exact_match, every source whose name contains the
+            # package name would be returned too
             ppa_source = ppa.getPublishedSources(source_name=package,
                                                  version=package_version,
+                                                 exact_match=True,
                                                  order_by_date=True)[0]
             status = ppa_source.status
-            # Error out if the package isn't on the way to becoming published
-            if status != "Pending" and status != "Published":
-                raise ValueError("Source package no longer exists")
-            if status == "Published":
+        except IndexError:
+            # The upload hasn't been processed yet
+            status = "Pending"
+
+        # Error out if the package isn't on the way to becoming published
+        if status != "Pending" and status != "Published":
+            raise ValueError("Source package no longer exists")
+        if status == "Published":
+            return ppa_source
+        return None
+
+    def check_binaries(self, source, progress):
+        """Check once whether all of the binaries are published and passed
+
+        The progress is a BuildProgress, which is updated with what was
+        found. Once an architecture has built, or a binary has published,
+        it isn't checked again; only the ones still pending are refreshed.
+        Returns True once everything is published.
+        """
+        # Ensure all of the builds have passed or are in-progress. Until the
+        # builds are known, list them; after that, only refresh the ones
+        # which haven't finished
+        if progress.builds is None:
+            progress.builds = {build.arch_tag: build
+                               for build in source.getBuilds()} or None
+        else:
+            for build in progress.builds.values():
+                build.lp_refresh()
+        for arch_tag, build in list((progress.builds or {}).items()):
+            if progress.telemetry:
+                progress.telemetry.observe_build(build)
+            if build.buildstate in BUILDING_STATES:
+                print(arch_tag, "still building.")
+            elif build.buildstate == "Successfully built":
+                print(arch_tag, "successfully built.")
+                progress.built.add(arch_tag)
+                del progress.builds[arch_tag]
+            else:
+                raise ValueError("One or more builds have an error")
+
+        # Before we verify binaries, we have to be able to read the records.
+        # There's a window we can encounter where the source is published
+        # but it has no record of any binaries, even before the binaries are
+        # actually processed. The binaries of a build only show up once
+        # they've been uploaded and processed, which can take a while after
+        # the build is done, so list them again until every architecture
+        # which built has some. After that, only refresh the pending ones.
+        if progress.builds != {}:
+            return False
+
+        if progress.binaries is None or progress.unlisted():
+            progress.binaries = {}
+            for binary in source.getPublishedBinaries():
+                if binary.self_link not in progress.published:
+                    progress.binaries[binary.self_link] = binary
+                progress.listed.add(
+                    link_name(binary, "distro_arch_series_link"))
+        else:
+            for binary in progress.binaries.values():
+                binary.lp_refresh()
+        # Make sure all of the binaries are in a good state if they've passed
+        for link, binary in list((progress.binaries or {}).items()):
+            if progress.telemetry:
+                progress.telemetry.observe_binary(binary)
+            if binary.status == "Pending":
+                print(binary.binary_package_name, "still publishing.")
+            elif binary.status == "Published":
+                print(binary.binary_package_name, "published.")
+                if progress.last_published is None or \
+                   binary.date_published > progress.last_published:
+                    progress.last_published = binary.date_published
+                progress.published.add(link)
+                del progress.binaries[link]
+            else:
+                raise ValueError("One or more builds can't publish")
+
+        return progress.done()
+
+    def verify_source_published(self, package, package_version):
+        """Verify that the source is published"""
+        # Grab the correct PPA object
+        ppa = self.get_ppa(self.lp_person, self.ppa_name)
+
+        schedule = self.source_schedule
+        schedule.reset()
+        while True:
+            print("Verifying if source is published,",
+                  int(schedule.elapsed()), "seconds in.")
+            requests = self.requests
+            ppa_source = self.check_source(ppa, package, package_version)
+            print("Made", self.requests - requests, "Launchpad API requests.")
+
+            if ppa_source is not None:
                 print("Source published.")
-                return lp, ppa_source
-            elif status == "Pending":
-                # 60 seconds × 5 minutes = 300 seconds
-                sleep(300)
+                self.report_detection("Source", ppa_source.date_published)
+                return self.lp, ppa_source
+            if not schedule.wait():
+                break
         # If we've timed out, raise an error
         raise ValueError("Timed out, contact Launchpad admins")
 
-    def verify_binaries_published(self, package, package_version):
-        """Verify that all of the binaries are published and have passed"""
+    def verify_binaries_published(self, package, package_version,
+                                  telemetry=None):
+        """Verify that all of the binaries are published and have passed
+
+        Only the builds and binaries of the given source publication are
+        checked, not everything else in the PPA. If a BuildTelemetry is
+        given, the progress is recorded in it.
+        """
         # Getting the source is a prerequisite
-        lp, ppa = self.verify_source_published(package, package_version)
-
-        # We're verifying every five minutes; never go for more than six hours
-        # The reason this is so lengthy is to provide time for publisher
-        # maintenance on Sundays, which can take up to six hours
-        # (60 minutes × 6 hours) ÷ 5 minutes = 72 max iterations
-        for i in range(0, 72):
-            print("Verifying if binaries are published,", (i*5), "minutes in.")
-            need_sleep = False
-            try:
-                # Ensure all of the builds have passed or are in-progress
-                for binary in ppa.getBuilds():
-                    if binary.buildstate == "Needs building" or \
-                       binary.buildstate == "Currently building" or \
-                       binary.buildstate == "Uploading build":
-                        print(binary.arch_tag, "still building.")
-                        # Raise a one-way flag so the sleep isn't done during
-                        # the iteration of the binaries
-                        need_sleep = True
-                    elif binary.buildstate == "Successfully built":
-                        print(binary.arch_tag, "successfully built.")
-                    else:
-                        raise ValueError("One or more builds have an error")
-
-                # Before we verify binaries, we have to be able to read the
-                # records. There's a window we can encounter where the
-                # source is published but it has no record of any binaries,
-                # even before the binaries are actually processed
-                if len(ppa.getPublishedBinaries()) < 1:
-                    raise IndexError
-                # Make sure all of the binaries are in a good state if they've
-                # passed
-                for binary in ppa.getPublishedBinaries():
-                    if binary.status == "Pending":
-                        print(binary.binary_package_name, "still publishing.")
-                        need_sleep = True
-                    elif binary.status == "Published":
-                        print(binary.binary_package_name, "published.")
-                    else:
-                        raise ValueError("One or more builds can't publish")
-            except IndexError:
-                need_sleep = True
-
-            if need_sleep:
-                # 60 seconds × 5 minutes = 300 seconds
-                sleep(300)
-            else:
+        lp, source = self.verify_source_published(package, package_version)
+        if telemetry:
+            telemetry.observe_source(source)
+
+        progress = BuildProgress(telemetry)
+        schedule = self.binary_schedule
+        schedule.reset()
+        while True:
+            print("Verifying if binaries are published,",
+                  int(schedule.elapsed()), "seconds in.")
+            requests = self.requests
+            done = self.check_binaries(source, progress)
+            print("Made", self.requests - requests, "Launchpad API requests.")
+
+            if done:
                 print("All builds have successfully published.")
+                self.report_detection("Binaries", progress.last_published)
                 return True
+            if not schedule.wait():
+                break
         # If we've timed out, raise an error
         raise ValueError("Timed out, contact Launchpad admins")
 
 
+def parse_args():
+    """Parse the command line arguments"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--package", help="The source package",
+                        required=True)
+    parser.add_argument("-v", "--package-version", help="The package version",
+                        required=True)
+    parser.add_argument("-t", "--lp-team", help="Launchpad user with the PPA",
+                        required=True)
+    parser.add_argument("-r", "--ppa", help="Name of the Launchpad PPA",
+                        required=True)
+    parser.add_argument("--initial-interval", type=float, default=30.0,
+                        help="Seconds to wait after the first check")
+    parser.add_argument("--backoff", type=float, default=1.5,
+                        help="Multiply the interval by this every check")
+    parser.add_argument("--jitter", type=float, default=0.1,
+                        help="Fraction of the interval to randomize")
+    parser.add_argument("--max-interval", type=float, default=300.0,
+                        help="Never wait longer than this between checks")
+    parser.add_argument("--source-deadline", type=float, default=7200.0,
+                        help="Seconds to wait for the source to publish")
+    parser.add_argument("--binary-deadline", type=float, default=21600.0,
+                        help="Seconds to wait for the binaries to publish")
+    parser.add_argument("-c", "--cache-dir", default=getenv("LP_CACHE_DIR"),
+                        help="Directory for the launchpadlib cache, shared "
+                             "between jobs on the same node")
+    parser.add_argument("-w", "--watcher",
+                        default=getenv("LP_WATCHER"),
+                        help="Wait on a shared lp_watcher.py instead of "
+                             "polling Launchpad, either http://host:port "
+                             "or unix:/path/to/socket")
+    parser.add_argument("--telemetry-json",
+                        default=getenv("LP_TELEMETRY_JSON"),
+                        help="Write when every step of the upload happened "
+                             "here as JSON")
+    parser.add_argument("--telemetry-textfile",
+                        default=getenv("LP_TELEMETRY_TEXTFILE"),
+                        help="Write how long every step took here in the "
+                             "OpenMetrics format, for node_exporter")
+    parser.add_argument("--history", default=getenv("LP_HISTORY"),
+                        help="Append the record of the upload to this file, "
+                             "to be queried with build_telemetry.py")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    lpcheck = LaunchpadCheck()
+    args = parse_args()
+
+    lpcheck = None
+    telemetry = BuildTelemetry(args.package, args.package_version,
+                               args.lp_team, args.ppa)
+    try:
+        if args.watcher:
+            # The watcher records the upload, and hands its record over
+            from lp_watcher import wait_for_watch
+            wait_for_watch(args.watcher, args.package, args.package_version,
+                           args.lp_team, args.ppa,
+                           args.source_deadline + args.binary_deadline,
+                           telemetry=telemetry)
+        else:
+            lpcheck = LaunchpadCheck(args.lp_team, args.ppa,
+                                     PollScheduler(args.initial_interval,
+                                                   args.backoff, args.jitter,
+                                                   args.max_interval,
+                                                   args.source_deadline),
+                                     PollScheduler(args.initial_interval,
+                                                   args.backoff, args.jitter,
+                                                   args.max_interval,
+                                                   args.binary_deadline),
+                                     cache_dir=args.cache_dir)
+            lpcheck.verify_binaries_published(args.package,
+                                              args.package_version,
+                                              telemetry)
+        if telemetry.finished is None:
+            telemetry.finish("published")
+    except ValueError as e:
+        if telemetry.finished is None:
+            telemetry.finish("timeout" if str(e).startswith("Timed out")
+                             else "failed")
+        raise
+    finally:
+        if lpcheck:
+            lpcheck.print_http_stats()
+        # Record the upload however the check ended, even if it was
+        # interrupted
+        if telemetry.finished is None:
+            telemetry.finish("interrupted")
+        if args.telemetry_json:
+            telemetry.write_json(args.telemetry_json)
+        if args.telemetry_textfile:
+            telemetry.write_openmetrics(args.telemetry_textfile)
+        if args.history:
+            append_history(args.history, telemetry.as_dict())
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import socket
+import argparse
+from copy import deepcopy
+from os import getenv, path, remove
+from time import monotonic
+from http.client import HTTPConnection, HTTPException
+from threading import Event, Lock, Thread
+from urllib.parse import parse_qs, urlencode, urlsplit
+from socketserver import ThreadingMixIn, UnixStreamServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from lp_check import BuildProgress, LaunchpadCheck, PollScheduler
+from build_telemetry import BuildTelemetry, append_history
+
+
+class Watch:
+    """One (package, version, team, PPA) being waited on
+
+    state is "pending" until the binaries are all published ("published"),
+    something goes wrong ("failed") or the deadline passes ("timeout").
+    Clients wait on the event, which is set once the state is final. The
+    progress is recorded in telemetry, which is appended to the history
+    file, if there is one, once the watch finishes. Only the polling thread
+    touches telemetry; the HTTP threads read record, a copy of it which is
+    replaced after every check.
+    """
+
+    def __init__(self, package, version, team, ppa, deadline, history=None):
+        self.package = package
+        self.version = version
+        self.team = team
+        self.ppa = ppa
+        self.deadline = monotonic() + deadline
+        self.state = "pending"
+        self.message = ""
+        self.source = None
+        self.telemetry = BuildTelemetry(package, version, team, ppa)
+        self.progress = BuildProgress(self.telemetry)
+        self.record = None
+        self.publish()
+        self.history = history
+        self.finished = None
+        self.event = Event()
+
+    @property
+    def key(self):
+        return (self.package, self.version, self.team, self.ppa)
+
+    def publish(self):
+        """Replace record with a copy of the telemetry as it is now"""
+        self.record = deepcopy(self.telemetry.as_dict())
+
+    def finish(self, state, message):
+        """Set the final state and wake up everything waiting on it"""
+        self.state = state
+        self.message = message
+        self.finished = monotonic()
+        self.telemetry.finish(state)
+        self.publish()
+        if self.history:
+            append_history(self.history, self.record)
+        self.event.set()
+
+    def as_dict(self):
+        return {"package": self.package, "version": self.version,
+                "team": self.team, "ppa": self.ppa, "state": self.state,
+                "message": self.message}
+
+
+class LaunchpadWatcher(LaunchpadCheck):
+    """Launchpad Watcher
+
+    This tracks many watches with a single Launchpad session, instead of
+    every package job running its own lp_check.py with its own login and
+    polling loop. Identical watches are shared. Every round, the pending
+    watches are grouped by PPA, so each PPA is only looked up once, and
+    each watch is checked once.
+
+    All of the Launchpad calls happen on the polling thread; the HTTP
+    threads only register watches, wait on them and read what the polling
+    thread published.
+    """
+
+    def __init__(self, interval=30.0, deadline=28800.0, keep=3600.0,
+                 lp=None, cache_dir=None, history=None):
+        LaunchpadCheck.__init__(self, None, None, lp=lp, cache_dir=cache_dir)
+        # Seconds between polling rounds
+        self.interval = interval
+        # Seconds a watch may stay pending
+        self.deadline = deadline
+        # Seconds a finished watch is kept around for late clients
+        self.keep = keep
+        # Where the record of every finished watch is appended, if anywhere
+        self.history = history
+
+        self.watches = {}
+        self.ppas = {}
+        self.lock = Lock()
+        # Set to poll right away, for example when a new watch comes in
+        self.wakeup = Event()
+        self.stopped = Event()
+
+    def watch(self, package, version, team, ppa, deadline=None):
+        """Return the watch for the given upload, adding it if it's new
+
+        The watch stays pending for deadline seconds from now, or as long
+        as another client asked for, but never longer than the watcher's
+        own deadline.
+        """
+        key = (package, version, team, ppa)
+        deadline = self.deadline if deadline is None else \
+            min(deadline, self.deadline)
+        with self.lock:
+            if key not in self.watches:
+                print("Watching %s %s in ppa:%s/%s" % key)
+                self.watches[key] = Watch(package, version, team, ppa,
+                                          deadline, self.history)
+                self.wakeup.set()
+            watch = self.watches[key]
+            if watch.state == "pending":
+                watch.deadline = max(watch.deadline, monotonic() + deadline)
+            return watch
+
+    def check_watch(self, watch, ppa):
+        """Check a single watch once, finishing it if it's done"""
+        print("Checking %s %s in ppa:%s/%s" % watch.key)
+        if watch.source is None:
+            watch.source = self.check_source(ppa, watch.package,
+                                             watch.version)
+            if watch.source is None:
+                return
+            print("Source published.")
+            watch.telemetry.observe_source(watch.source)
+
+        if self.check_binaries(watch.source, watch.progress):
+            print("All builds have successfully published.")
+            watch.finish("published", "All builds have successfully "
+                         "published.")
+
+    def poll(self):
+        """Check every pending watch once, grouped by PPA
+
+        A ValueError means the upload failed. Anything else, such as
+        Launchpad or the network having trouble, only leaves the watches it
+        hit pending until the next round, and the rest are still checked.
+        """
+        with self.lock:
+            pending = [watch for watch in self.watches.values()
+                       if watch.state == "pending"]
+
+        by_ppa = {}
+        for watch in pending:
+            by_ppa.setdefault((watch.team, watch.ppa), []).append(watch)
+
+        requests = self.requests
+        for (team, ppa_name), watches in by_ppa.items():
+            try:
+                if (team, ppa_name) not in self.ppas:
+                    self.ppas[(team, ppa_name)] = self.get_ppa(team, ppa_name)
+                ppa = self.ppas[(team, ppa_name)]
+            except ValueError as e:
+                for watch in watches:
+                    watch.finish("failed", str(e))
+                continue
+            except Exception as e:
+                print("Failed to look up ppa:%s/%s: %s" % (team, ppa_name, e))
+                continue
+
+            for watch in watches:
+                if monotonic() > watch.deadline:
+                    watch.finish("timeout", "Timed out, contact Launchpad "
+                                 "admins")
+                    continue
+                try:
+                    self.check_watch(watch, ppa)
+                except ValueError as e:
+                    watch.finish("failed", str(e))
+                except Exception as e:
+                    print("Failed to check %s %s in ppa:%s/%s:" % watch.key,
+                          e)
+                watch.publish()
+
+        if pending:
+            print("Checked %d watches in %d PPAs with %d Launchpad API "
+                  "requests." % (len(pending), len(by_ppa),
+                                 self.requests - requests))
+
+    def expire(self):
+        """Forget finished watches nobody has asked about for a while"""
+        now = monotonic()
+        with self.lock:
+            for key, watch in list(self.watches.items()):
+                if watch.finished and now - watch.finished > self.keep:
+                    del self.watches[key]
+
+    def run(self):
+        """Poll Launchpad until stopped"""
+        while not self.stopped.is_set():
+            self.wakeup.clear()
+            try:
+                self.poll()
+            except Exception as e:
+                # Launchpad being unreachable for a while shouldn't take the
+                # whole watcher down; the watches time out on their own
+                print("Polling failed:", e)
+            self.expire()
+            self.wakeup.wait(self.interval)
+
+    def start(self):
+        """Poll Launchpad from a background thread"""
+        thread = Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+
+
+def make_server(watcher, address):
+    """Return an HTTP server for the watcher on the given address
+
+    The address is either http://host:port or unix:/path/to/socket. Clients
+    call GET /watch?package=&version=&team=&ppa=&timeout=&deadline=, which
+    waits up to timeout seconds for the watch to finish and returns it as
+    JSON, with the record of its telemetry so far. Once the client's
+    deadline, in seconds from the request, has passed, the watch is
+    returned as timed out to that client, even if others still wait on it.
+    GET /status lists every watch.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status, data):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+            if url.path == "/status":
+                with watcher.lock:
+                    watches = [watch.as_dict() for watch in
+                               watcher.watches.values()]
+                self.reply(200, {"watches": watches,
+                                 "requests": watcher.requests,
+                                 "cache_hits": watcher.cache_hits,
+                                 "cache_misses": watcher.cache_misses,
+                                 "bytes_received": watcher.bytes_received})
+            elif url.path == "/watch":
+                try:
+                    timeout = float(params.get("timeout", 60))
+                    deadline = float(params.get("deadline",
+                                                watcher.deadline))
+                    watch = watcher.watch(params["package"],
+                                          params["version"], params["team"],
+                                          params["ppa"], deadline)
+                except KeyError as e:
+                    self.reply(400, {"message": "Missing %s" % e})
+                    return
+                except ValueError as e:
+                    self.reply(400, {"message": str(e)})
+                    return
+                watch.event.wait(min(timeout, deadline))
+                reply = dict(watch.as_dict(), telemetry=watch.record)
+                if reply["state"] == "pending" and timeout >= deadline:
+                    reply.update(state="timeout", message="Timed out, "
+                                 "contact Launchpad admins")
+                self.reply(200, reply)
+            else:
+                self.reply(404, {"message": "Not found"})
+
+    if address.startswith("unix:"):
+        class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+            daemon_threads = True
+
+            def get_request(self):
+                # HTTP handlers expect the client address to be a tuple
+                request, _ = UnixStreamServer.get_request(self)
+                return request, ("local", 0)
+
+        socket_path = address[len("unix:"):]
+        if path.exists(socket_path):
+            remove(socket_path)
+        return UnixHTTPServer(socket_path, Handler)
+
+    url = urlsplit(address)
+    server = ThreadingHTTPServer((url.hostname, url.port or 80), Handler)
+    server.daemon_threads = True
+    return server
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """An HTTP connection over a Unix socket"""
+
+    def __init__(self, socket_path, timeout):
+        HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def wait_for_watch(address, package, version, team, ppa, deadline,
+                   poll_timeout=60.0, telemetry=None, retry_interval=1.0,
+                   max_retry_interval=30.0):
+    """Block until the watcher says the upload is published
+
+    This is the client side of lp_watcher.py, used by lp_check.py. Raises a
+    ValueError if the builds fail or time out, the same way lp_check.py
+    would. If the watcher can't be reached, for example while it restarts,
+    it's tried again with a growing interval until the deadline. If a
+    BuildTelemetry is given, it's kept up to date with the watcher's
+    record of the upload.
+    """
+
+    retry = PollScheduler(initial=retry_interval, factor=2.0,
+                          maximum=max_retry_interval, deadline=deadline)
+    while retry.elapsed() < deadline:
+        # The watcher enforces what's left of the deadline
+        query = urlencode({"package": package, "version": version,
+                           "team": team, "ppa": ppa, "timeout": poll_timeout,
+                           "deadline": deadline - retry.elapsed()})
+        if address.startswith("unix:"):
+            connection = UnixHTTPConnection(address[len("unix:"):],
+                                            poll_timeout + 30)
+        else:
+            url = urlsplit(address)
+            connection = HTTPConnection(url.hostname, url.port or 80,
+                                        timeout=poll_timeout + 30)
+        try:
+            connection.request("GET", "/watch?" + query)
+            response = connection.getresponse()
+            body = response.read()
+        except (OSError, HTTPException) as e:
+            print("Couldn't reach the watcher:", e)
+            if not retry.wait():
+                break
+            continue
+        finally:
+            connection.close()
+        retry.interval = retry.initial
+
+        try:
+            watch = json.loads(body)
+        except ValueError:
+            watch = {"message": body[:200].decode("utf-8", "replace")}
+        if response.status != 200 or "state" not in watch:
+            raise ValueError("The watcher returned %d: %s" %
+                             (response.status, watch.get("message")))
+
+        if telemetry and "telemetry" in watch:
+            telemetry.load(watch["telemetry"])
+        print("Waiting on the watcher,", int(retry.elapsed()),
+              "seconds in:", watch["state"])
+        if watch["state"] == "published":
+            print(watch["message"])
+            return True
+        if watch["state"] != "pending":
+            raise ValueError(watch["message"])
+
+    raise ValueError("Timed out, contact Launchpad admins")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-l", "--listen", default="http://127.0.0.1:8765",
+                        help="Where to listen, either http://host:port or "
+                             "unix:/path/to/socket")
+    parser.add_argument("-i", "--interval", type=float, default=30.0,
+                        help="Seconds between polling rounds")
+    parser.add_argument("-d", "--deadline", type=float, default=28800.0,
+                        help="Seconds a watch may stay pending")
+    parser.add_argument("-c", "--cache-dir", default=getenv("LP_CACHE_DIR"),
+                        help="Directory for the launchpadlib cache")
+    parser.add_argument("--history", default=getenv("LP_HISTORY"),
+                        help="Append the record of every finished watch to "
+                             "this file, to be queried with "
+                             "build_telemetry.py")
+    args = parser.parse_args()
+
+    watcher = LaunchpadWatcher(interval=args.interval, deadline=args.deadline,
+                               cache_dir=args.cache_dir, history=args.history)
+    watcher.login()
+    watcher.start()
+
+    server = make_server(watcher, args.listen)
+    print("Serving watches on", args.listen)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        watcher.stop()
+        server.server_close()
+        watcher.print_http_stats()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+
+# Keys every repository gets from its config's default block if it doesn't
+# set them itself
+DEFAULTED_KEYS = frozenset(["name", "packaging_url", "packaging_branch",
+                            "upload_target", "releases", "default_branch",
+                            "type", "upstream_url", "upstream_branch"])
+# Keys a repository may leave out entirely
+OPTIONAL_KEYS = frozenset(["upstream_url", "upstream_branch", "cascade"])
+VALID_KEYS = DEFAULTED_KEYS | OPTIONAL_KEYS
+
+# Every repository needs a name, and its releases decide which package jobs
+# it has. The rest of the keys it needs depend on the templates rendered
+# for it, so they're worked out from the variables each template uses.
+BASE_KEYS = frozenset(["name", "releases"])
+# The repository key every template variable comes from. MERGE_COMMANDS,
+# MERGER and MERGER_JOBS aren't here, they come from the merger configs.
+VARIABLE_KEYS = {"NAME": "name", "RELEASE": "releases",
+                 "PACKAGING_URL": "packaging_url",
+                 "PACKAGING_BRANCH": "packaging_branch",
+                 "UPSTREAM_URL": "upstream_url",
+                 "UPLOAD_TARGET": "upload_target",
+                 "LP_TEAM": "upload_target", "LP_PPA": "upload_target"}
+
+# Placeholders in values, and the repository key they're replaced with
+SUBSTITUTIONS = {"NAME": "name"}
+SUBSTITUTION_RE = re.compile("(%s)" % "|".join(map(re.escape,
+                                                   SUBSTITUTIONS)))
+
+CONFIG_TYPES = frozenset(["merger", "stable", "unstable"])
+
+
+class MetadataError(ValueError):
+    """Every problem found in the metadata, with where it was found"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        ValueError.__init__(self, "%d problems in the metadata:\n%s" %
+                            (len(errors), "\n".join(errors)))
+
+
+def required_keys(variables):
+    """Return the repository keys a template using the variables needs"""
+
+    return BASE_KEYS | frozenset(VARIABLE_KEYS[variable] for variable in
+                                 variables if variable in VARIABLE_KEYS)
+
+
+def compile_value(value):
+    """Return a value as a substitution template, or None if it has none
+
+    The template is a format string, filled in from the repository with
+    str.format_map().
+    """
+
+    if not isinstance(value, str) or not SUBSTITUTION_RE.search(value):
+        return None
+    parts = SUBSTITUTION_RE.split(value)
+    return "".join(part.replace("{", "{{").replace("}", "}}") if i % 2 == 0
+                   else "{%s}" % SUBSTITUTIONS[part]
+                   for i, part in enumerate(parts))
+
+
+class ConfigSchema:
+    """The schema of the repositories of one config
+
+    This is compiled once from the config's default block: the defaults a
+    repository can inherit, and which of them need substitutions, are
+    worked out up front, so each repository only needs a few set
+    operations and dict lookups.
+    """
+
+    def __init__(self, default, required):
+        # The keys every repository needs, after the defaults
+        self.required = required
+        defaults = [(key, value) for key, value in default.items()
+                    if key in DEFAULTED_KEYS]
+        self.default_keys = frozenset(key for key, value in defaults)
+        # Defaults used as they are, and ones with substitutions in them,
+        # as format strings
+        self.plain = tuple((key, value) for key, value in defaults
+                           if compile_value(value) is None)
+        self.templates = tuple((key, compile_value(value))
+                               for key, value in defaults
+                               if compile_value(value) is not None)
+
+    def expand(self, repository, where, index, errors):
+        """Validate the repository, and fill in its defaults in place
+
+        Problems are added to errors, prefixed with where and the index of
+        the repository.
+        """
+
+        if not isinstance(repository, dict):
+            errors.append("%s: repositories[%d]: expected a mapping, got %r"
+                          % (where, index, repository))
+            return
+
+        keys = repository.keys()
+        if not keys <= VALID_KEYS:
+            errors.append("%s: repositories[%d]: Invalid keys present: %s" %
+                          (where, index,
+                           ", ".join(sorted(keys - VALID_KEYS))))
+
+        name = repository.get("name")
+        if not isinstance(name, str):
+            errors.append("%s: repositories[%d]: name must be set to a "
+                          "string" % (where, index))
+            return
+
+        if not self.required <= keys | self.default_keys:
+            errors.append("%s: repositories[%d] (%s): Missing keys: %s" %
+                          (where, index, name,
+                           ", ".join(sorted(self.required - keys -
+                                            self.default_keys))))
+
+        # Substitute into the repository's own values, then fill in the
+        # defaults, whose templates are already compiled
+        for key, value in repository.items():
+            if isinstance(value, str) and SUBSTITUTION_RE.search(value):
+                repository[key] = compile_value(value).format_map(
+                    repository)
+        for key, value in self.plain:
+            if key not in repository:
+                repository[key] = value
+        for key, template in self.templates:
+            if key not in repository:
+                repository[key] = template.format_map(repository)
+
+
+def validate_metadata(metadata, template_variables=None):
+    """Validate the loaded metadata, and expand every repository in place
+
+    template_variables maps every job type, such as "package-stable" or
+    "merger", to the variables its template uses. A repository only needs
+    the keys the templates of its jobs are rendered from; without
+    template_variables, only BASE_KEYS are checked.
+
+    Every problem is collected, with the config file and the index of the
+    repository it's in, and raised together as a MetadataError.
+    """
+
+    template_variables = template_variables or {}
+    errors = []
+    configs = metadata.get("active_configs")
+    if not isinstance(configs, dict):
+        raise MetadataError(["ci.conf: active_configs must be a list"])
+
+    # The repositories of a merger's parent are rendered as mergers too
+    parents = set()
+    for config in configs.values():
+        if isinstance(config, dict) and isinstance(config.get("default"),
+                                                   dict) and \
+                config["default"].get("type") == "merger":
+            parents.add(config["default"].get("parent"))
+
+    for config_name, config in configs.items():
+        where = config_name + ".conf"
+        if not isinstance(config, dict) or \
+                not isinstance(config.get("default"), dict):
+            errors.append("%s: default must be set to a mapping" % where)
+            continue
+        default = config["default"]
+
+        config_type = default.get("type")
+        if config_type not in CONFIG_TYPES:
+            errors.append("%s: type must be one of %s, not %r" %
+                          (where, ", ".join(sorted(CONFIG_TYPES)),
+                           config_type))
+            continue
+
+        # Merger configs use the repositories of their parent
+        if config_type == "merger":
+            if default.get("parent") not in configs:
+                errors.append("%s: parent %r is not an active config" %
+                              (where, default.get("parent")))
+            if not isinstance(default.get("cascade"), list):
+                errors.append("%s: cascade must be set to a list" % where)
+            continue
+
+        repositories = config.get("repositories")
+        if not isinstance(repositories, list):
+            errors.append("%s: repositories must be set to a list" % where)
+            continue
+
+        required = required_keys(
+            template_variables.get("package-" + config_type, ()))
+        if config_name in parents:
+            required |= required_keys(template_variables.get("merger", ()))
+
+        schema = ConfigSchema(default, required)
+        for i, repository in enumerate(repositories):
+            schema.expand(repository, where, i, errors)
+
+    if errors:
+        raise MetadataError(errors)
+
+    return metadata
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+from base64 import b64encode
+
+# Groovy compiles every string literal into a constant of the script's
+# class, and those can't be longer than 65535 bytes, so the payload is
+# split into chunks which are joined again on the server
+CHUNK_SIZE = 60000
+
+# Run by the Jenkins script console. The payload is base64-encoded JSON,
+# replaced into @PAYLOAD@ as a list of chunks, so nothing in it needs
+# escaping. Every job is handled on its own, so one bad config doesn't stop
+# the rest, and the results come back as JSON on a line starting with
+# RESULT.
+SCRIPT = """
+import groovy.json.JsonOutput
+import groovy.json.JsonSlurper
+import hudson.model.ListView
+import javax.xml.transform.stream.StreamSource
+import jenkins.model.Jenkins
+
+def encoded = [
+    @PAYLOAD@
+].join("")
+def payload = new JsonSlurper().parseText(
+    new String(encoded.decodeBase64(), "UTF-8"))
+def jenkins = Jenkins.get()
+def results = [:]
+
+if (payload.operation == "fetch") {
+    payload.names.each { name ->
+        def item = jenkins.getItemByFullName(name)
+        if (item != null) {
+            results[name] = item.getConfigFile().asString()
+        }
+    }
+} else {
+    payload.jobs.each { job ->
+        try {
+            def item = jenkins.getItemByFullName(job.name)
+            def result = "unchanged"
+            if (job.config != null) {
+                def stream = new ByteArrayInputStream(
+                    job.config.getBytes("UTF-8"))
+                if (item == null) {
+                    item = jenkins.createProjectFromXML(job.name, stream)
+                    result = "created"
+                } else {
+                    // This saves the job as given, saving it again would
+                    // add the plugin versions and make the config differ
+                    item.updateByXml(new StreamSource(stream))
+                    result = "updated"
+                }
+            }
+            def view = jenkins.getView(job.view)
+            if (view == null) {
+                view = new ListView(job.view, jenkins)
+                jenkins.addView(view)
+            }
+            if (!view.contains(item)) {
+                view.add(item)
+            }
+            results[job.name] = result
+        } catch (e) {
+            results[job.name] = "error: " + e
+        }
+    }
+}
+
+println("RESULT " + JsonOutput.toJson(results))
+"""
+
+
+def render_script(payload):
+    """Return the script carrying the given payload"""
+
+    encoded = b64encode(json.dumps(payload).encode("utf-8")).decode("ascii")
+    chunks = ["'%s'" % encoded[i:i + CHUNK_SIZE]
+              for i in range(0, len(encoded), CHUNK_SIZE)]
+    return SCRIPT.replace("@PAYLOAD@", ",\n    ".join(chunks))
+
+
+class ScriptPush:
+    """Script Push
+
+    Instead of a few REST calls per job, this sends the changed jobs and
+    their view memberships to the Jenkins script console in batches, as a
+    Groovy script with the configs embedded in it. The script applies them
+    on the server and returns a result for every job. This needs an API
+    user with the Overall/Administer permission.
+
+    A large batch can keep a busy Jenkins busy for minutes, so the script
+    gets a much longer timeout than other requests. Jenkins keeps running
+    a script when the client goes away, so pushes are never retried once
+    they may have reached it; fetching is.
+
+    The job index is updated locally with what the script did.
+    """
+
+    def __init__(self, index, batch_size=500, timeout=900.0):
+        self.index = index
+        self.batch_size = batch_size
+        self.timeout = timeout
+
+    def run(self, payload, idempotent=True):
+        """Run the script with the given payload, and return its results
+
+        Pass idempotent=False if running the script twice would do harm.
+        """
+
+        response = self.index.post(self.index.url("scriptText"),
+                                   data={"script": render_script(payload)},
+                                   idempotent=idempotent,
+                                   timeout=self.timeout)
+
+        for line in response.text.splitlines():
+            if line.startswith("RESULT "):
+                return json.loads(line[len("RESULT "):])
+        raise ValueError("The script didn't return any results: %s" %
+                         response.text[:200])
+
+    def batches(self, items):
+        """Split the list into batches of at most batch_size items"""
+
+        for i in range(0, len(items), self.batch_size):
+            yield items[i:i + self.batch_size]
+
+    def fetch_configs(self, names):
+        """Return the current config.xml of every given job that exists"""
+
+        configs = {}
+        for batch in self.batches(list(names)):
+            configs.update(self.run({"operation": "fetch", "names": batch}))
+        return configs
+
+    def push(self, jobs):
+        """Apply the jobs, given as (name, config, view), on the server
+
+        A config of None only makes sure the job is in its view. Returns a
+        dict mapping every job name to "created", "updated", "unchanged" or
+        "error: <reason>". If a whole batch fails, all of its jobs get the
+        error.
+        """
+
+        results = {}
+        for batch in self.batches(jobs):
+            payload = {"operation": "push",
+                       "jobs": [{"name": name, "config": config,
+                                 "view": view}
+                                for name, config, view in batch]}
+            try:
+                batch_results = self.run(payload, idempotent=False)
+            except ValueError as e:
+                batch_results = {}
+                for name, config, view in batch:
+                    batch_results[name] = "error: %s" % e
+
+            for name, config, view in batch:
+                result = batch_results.get(name, "error: no result")
+                results[name] = result
+                if result.startswith("error"):
+                    continue
+                with self.index.lock:
+                    self.index.jobs.add(name)
+                with self.index.view_lock:
+                    self.index.views.setdefault(view, set()).add(name)
+
+        return results
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+import sys
+import json
+import argparse
+from hashlib import sha256
+
+# The management jobs all go to the shard owning their view, so the view
+# and everything in it are handled by one generator
+MGMT_VIEW = "mgmt"
+MGMT_JOB_RE = re.compile(r"^(merger|mgmt_build_.+)$")
+
+# Summed up over the shards by merge_summaries()
+SUMMED = ["jobs", "created", "updated", "unchanged", "failed", "pruned",
+          "requests"]
+
+
+def shard_of(name, count):
+    """Return which of count shards a name belongs to
+
+    This uses a hash of the name rather than hash(), which changes between
+    processes, so every generator agrees on it.
+    """
+
+    digest = sha256(name.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+class Shard:
+    """Shard
+
+    One of count generators, numbered from 0, each pushing a disjoint slice
+    of the jobs. Jobs are split by a hash of their name, apart from the
+    management jobs, which go along with their view. Every view belongs to
+    one shard too, which is the only one creating it. The default of a
+    single shard owns everything.
+    """
+
+    def __init__(self, index=0, count=1):
+        if count < 1 or not 0 <= index < count:
+            raise ValueError("Invalid shard %d/%d" % (index, count))
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, value):
+        """Return the shard given as "i/N" on the command line"""
+
+        try:
+            index, count = value.split("/")
+            return cls(int(index), int(count))
+        except ValueError:
+            raise ValueError("Shards are given as i/N, with i from 0 to "
+                             "N - 1, not %s" % value)
+
+    def __str__(self):
+        return "%d/%d" % (self.index, self.count)
+
+    def owns_view(self, name):
+        """Return whether this shard creates the given view"""
+
+        return self.count == 1 or shard_of(name, self.count) == self.index
+
+    def owns_job(self, name):
+        """Return whether this shard pushes (or prunes) the given job"""
+
+        if MGMT_JOB_RE.match(name):
+            return self.owns_view(MGMT_VIEW)
+        return self.count == 1 or shard_of(name, self.count) == self.index
+
+
+def merge_summaries(summaries):
+    """Merge the summaries written by every shard of a run into one
+
+    The counts are added up and the errors combined. Shards which didn't
+    write a summary, or wrote more than one, are listed.
+    """
+
+    merged = {key: 0 for key in SUMMED}
+    merged["errors"] = {}
+    seen = {}
+    count = None
+    for summary in summaries:
+        index, count = map(int, summary["shard"].split("/"))
+        seen[index] = seen.get(index, 0) + 1
+        for key in SUMMED:
+            merged[key] += summary.get(key, 0)
+        merged["errors"].update(summary.get("errors", {}))
+
+    merged["shards"] = count or 0
+    merged["missing"] = [index for index in range(count or 0)
+                         if index not in seen]
+    merged["duplicate"] = sorted(index for index, times in seen.items()
+                                 if times > 1)
+    return merged
+
+
+def print_summary(merged):
+    """Print a merged summary"""
+
+    print("%d shards: %d jobs, %d created, %d updated, %d unchanged, "
+          "%d failed, %d pruned, %d Jenkins API requests" %
+          (merged["shards"], merged["jobs"], merged["created"],
+           merged["updated"], merged["unchanged"], merged["failed"],
+           merged["pruned"], merged["requests"]))
+    for name, error in sorted(merged["errors"].items()):
+        print("Failed to push %s: %s" % (name, error))
+    if merged["missing"]:
+        print("No summary from shards %s" %
+              ", ".join(map(str, merged["missing"])))
+    if merged["duplicate"]:
+        print("More than one summary from shards %s" %
+              ", ".join(map(str, merged["duplicate"])))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Merge the summaries written by the shards of a "
+                    "generator run with --summary-json")
+    parser.add_argument("summaries", nargs="+",
+                        help="The summary of every shard")
+    parser.add_argument("-o", "--output",
+                        help="Write the merged summary here as JSON")
+    args = parser.parse_args()
+
+    summaries = []
+    for file_name in args.summaries:
+        with open(file_name) as summary_file:
+            summaries.append(json.load(summary_file))
+
+    merged = merge_summaries(summaries)
+    print_summary(merged)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(merged, output_file, indent=2)
+
+    # Fail if anything failed, or the run isn't complete
+    if merged["failed"] or merged["missing"] or merged["duplicate"]:
+        sys.exit(1)
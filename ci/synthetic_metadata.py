@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import git
+import argparse
+from os import makedirs, path
+from yaml import CDumper
+from yaml import dump as yaml_dump
+
+RELEASES = ["bionic", "focal", "groovy", "hirsute", "impish", "jammy",
+            "kinetic", "lunar", "mantic", "noble"]
+
+
+def count_jobs(configs, repositories, releases, mergers=1):
+    """Return how many jobs write_metadata's output turns into
+
+    Every config has its own repositories, each built for every release
+    (apart from every tenth one), and every merger config adds one job per
+    repository of its parent. There are also two management jobs per
+    release, and the merger one.
+    """
+
+    # Every tenth repository is only built for the latest release
+    single = (repositories + 9) // 10
+    packages = (repositories - single) * releases + single
+
+    mergers = min(mergers, configs)
+    return (configs * packages + mergers * repositories + 2 * releases + 1)
+
+
+def write_metadata(metadata_loc, configs, repositories, releases, mergers=1):
+    """Write a synthetic metadata repository into the given directory
+
+    This makes the given number of package configs, alternating between
+    unstable and stable, each with the given number of repositories built
+    for the given number of releases. The first few configs also get a
+    merger config with a cascade over every release. The result is
+    committed, so it can be used as METADATA_URL.
+    """
+
+    if releases > len(RELEASES):
+        raise ValueError("At most %d releases are supported" % len(RELEASES))
+    releases = RELEASES[-releases:]
+
+    makedirs(metadata_loc, exist_ok=True)
+    active_configs = []
+
+    def write(name, data):
+        with open(path.join(metadata_loc, name), "w") as conf_file:
+            yaml_dump(data, conf_file, Dumper=CDumper)
+
+    for i in range(configs):
+        config_name = "config%d" % i
+        config_type = "unstable" if i % 2 == 0 else "stable"
+        default = {"type": config_type,
+                   "packaging_url": "https://git.example.org/NAME",
+                   "packaging_branch": "ubuntu/master",
+                   "upload_target": "ppa:example-ci/%s-ci" % config_type,
+                   "releases": releases,
+                   "default_branch": "ubuntu/master",
+                   "upstream_url": "https://upstream.example.org/NAME",
+                   "upstream_branch": "master"}
+
+        # Override something on every tenth repository, so not everything
+        # comes from the defaults
+        repos = []
+        for j in range(repositories):
+            repo = {"name": "package%d" % j}
+            if j % 10 == 0:
+                repo["packaging_branch"] = "ubuntu/NAME"
+                repo["releases"] = releases[-1:]
+            repos.append(repo)
+
+        write(config_name + ".conf", {"default": default,
+                                      "repositories": repos})
+        active_configs.append(config_name + ".conf")
+
+    for i in range(min(mergers, configs)):
+        cascade = ["ubuntu/master"] + ["ubuntu/" + release for release in
+                                       reversed(releases)]
+        merger_name = "merger%d" % i
+        write(merger_name + ".conf",
+              {"default": {"type": "merger", "parent": "config%d" % i,
+                           "cascade": cascade}})
+        active_configs.append(merger_name + ".conf")
+
+    write("ci.conf", {"active_configs": active_configs})
+
+    repo = git.Repo.init(metadata_loc)
+    repo.index.add(["ci.conf"] + active_configs)
+    repo.index.commit("Synthetic metadata")
+
+    return metadata_loc
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", help="Where to write the metadata")
+    parser.add_argument("-c", "--configs", type=int, default=2,
+                        help="The number of package configs")
+    parser.add_argument("-m", "--repositories", type=int, default=10,
+                        help="The number of repositories per config")
+    parser.add_argument("-r", "--releases", type=int, default=2,
+                        help="The number of releases")
+    parser.add_argument("--mergers", type=int, default=1,
+                        help="The number of merger configs")
+    args = parser.parse_args()
+
+    write_metadata(args.directory, args.configs, args.repositories,
+                   args.releases, args.mergers)
+    print("Wrote metadata for %d jobs" %
+          count_jobs(args.configs, args.repositories, args.releases,
+                     args.mergers))
@@ -15,10 +15,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import sys
+import json
 import time
-from tabulate import tabulate
+import argparse
+from os import getenv, getpid, makedirs, path, replace
+from functools import wraps
+from contextvars import ContextVar
+from inspect import iscoroutinefunction
+from threading import Lock, get_ident, local
 
-tabulate.PRESERVE_WHITESPACE = True
+# From Python 3.12, a profiler watches every thread, and only one can be
+# enabled in the process at a time
+SHARED_PROFILER = sys.version_info >= (3, 12)
 
 
 class TimerMetrics:
@@ -28,142 +37,649 @@ class TimerMetrics:
     utilities, to keep track of how long specific sub-processes in a Python
     program are taking.
 
-    Data structure:
+    Every call of a timed function is recorded as its own span. Spans
+    started while another one is running become its children, so the same
+    label can show up in more than one place in the tree. The span that is
+    currently running is kept in a context variable, which makes this safe
+    to use from several threads and asyncio tasks at once.
+
+    Data structure, keyed on the path from the root span down:
+    {
+        ("Parent name", "Timer name"): [0.12, 0.1, ...]
+    }
+
+    Every finished span is also kept, in the order they finished:
+    [
+        (("Parent name", "Timer name"), start, duration, thread id)
+    ]
+
+    Counters, such as cache hits and misses, are kept separately:
     {
-        "Timer name": {
-            "running": True,
-            "start_time": 123.4,
-            "total_time": 0.0
-        }
+        "Counter name": 12
     }
+
+    Profiling is off unless enable_profiling() is called, or the
+    TIMER_PROFILE (a comma-separated list of labels, or "*") or
+    TIMER_PROFILE_MEMORY environment variables are set.
     """
 
     def __init__(self):
         # Store the data in a dictionary
         self.data = {}
+        self.spans = []
+        self.lock = Lock()
+        # Span start times are relative to this
+        self.epoch = time.perf_counter()
+        # The path of the span running in the current thread or task
+        self.current = ContextVar("current_span", default=())
+        self.counters = {}
+        self.counter_lock = Lock()
+
+        # Checked on every start(), so this is all profiling costs when off
+        self.profiling = False
+        # The labels to run cProfile on, with a profiler for each label and
+        # thread, since a profiler can only watch one thread at a time. With
+        # SHARED_PROFILER, there's one profiler per label instead, keyed on
+        # a thread of None, and only one label is profiled at a time.
+        self.profile_labels = set()
+        self.profilers = {}
+        # The profiler running in this thread, if any
+        self.profiler = local()
+        # With SHARED_PROFILER, the label being profiled, its profiler, and
+        # how many spans are using it
+        self.shared_label = None
+        self.shared_profiler = None
+        self.shared_users = 0
+        # Whether to track memory with tracemalloc, the memory figures of
+        # the span running in this thread or task, and for each path, the
+        # (peak, net) bytes allocated during every call
+        self.memory = False
+        self.memory_frame = ContextVar("memory_frame", default=None)
+        self.memory_data = {}
+
+        labels = getenv("TIMER_PROFILE")
+        self.enable_profiling(labels.split(",") if labels else (),
+                              bool(getenv("TIMER_PROFILE_MEMORY")))
+
+    def enable_profiling(self, labels=(), memory=False):
+        """Turn on profiling for the given labels, and memory tracking
+
+        Spans with one of the labels (every span if one of them is "*") run
+        under cProfile. Only the outermost of these in each thread is
+        profiled, since a thread can only have one profiler; nested ones
+        show up in its profile anyway. From Python 3.12, there can only be
+        one profiler in the process, so spans with the label being profiled
+        share it, and spans with other labels aren't profiled until it's
+        done. If something else is already profiling, such as a debugger
+        or a coverage tool, spans aren't profiled either. With memory, the
+        peak and net memory allocated during every span is recorded with
+        tracemalloc. Memory is tracked for the whole process, so spans
+        running concurrently see each other's allocations.
+        """
+
+        self.profile_labels.update(label.strip() for label in labels)
+        if memory and not self.memory:
+            import tracemalloc
+            self.memory = True
+            tracemalloc.start()
+        self.profiling = bool(self.profile_labels) or self.memory
 
     def start(self, name):
-        """Start a timer with a given name
+        """Start a span with a given name
 
-        This records the current time and adds a new entry. If the entry
-        already exists and the timer is not running, start it up again. If
-        the entry exists and the timer is already running, do nothing.
+        It becomes a child of whichever span is currently running. Returns
+        a token to hand to stop().
+        """
+
+        span_path = self.current.get() + (name,)
+        with self.lock:
+            # Register the path when it starts, so parents come before their
+            # children in the report
+            self.data.setdefault(span_path, [])
+
+        profile = self.start_profiling(span_path) if self.profiling else None
+
+        # Get a timer value as late as possible
+        return (span_path, self.current.set(span_path), profile,
+                time.perf_counter())
+
+    def stop(self, token):
+        """Stop the span started with the given token
+
+        This records how long it ran, and makes its parent the current span
+        again.
         """
 
         # Get a timer value ASAP
         t_val = time.perf_counter()
 
-        # If it isn't already there, create an entry
-        if name not in self.data:
-            # Initialize the entry
-            self.data[name] = {}
+        span_path, context_token, profile, start = token
+        duration = t_val - start
+        if profile is not None:
+            self.stop_profiling(span_path, profile)
+        self.current.reset(context_token)
+
+        with self.lock:
+            self.data[span_path].append(duration)
+            self.spans.append((span_path, start - self.epoch, duration,
+                               get_ident()))
+
+    def start_profiling(self, span_path):
+        """Start whichever profiling applies to the span, see start()"""
+
+        # The profilers are only imported once they're used, so the timers
+        # stay cheap to import
+        import cProfile
+        import tracemalloc
+
+        profile = {}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # The peak is reset for every span, so hand the parent's peak so
+            # far to it before losing it
+            parent = self.memory_frame.get()
+            if parent is not None:
+                parent["peak"] = max(parent["peak"], peak)
+            tracemalloc.reset_peak()
+            frame = {"start": current, "peak": current}
+            profile["memory"] = (frame, self.memory_frame.set(frame))
+
+        label = span_path[-1]
+        if (label in self.profile_labels or "*" in self.profile_labels) \
+                and getattr(self.profiler, "running", None) is None:
+            profiler = self.enable_profiler(cProfile, label)
+            if profiler is not None:
+                self.profiler.running = profiler
+                profile["cprofile"] = profiler
+
+        return profile
+
+    def enable_profiler(self, cProfile, label):
+        """Enable the profiler of the label, return it
+
+        Returns None if the span can't be profiled, see enable_profiling().
+        """
+
+        key = (label, None if SHARED_PROFILER else get_ident())
+        with self.lock:
+            if SHARED_PROFILER and self.shared_users:
+                if label != self.shared_label:
+                    return None
+                self.shared_users += 1
+                return self.shared_profiler
+
+            profiler = self.profilers.get(key) or cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                return None
+            self.profilers[key] = profiler
+            if SHARED_PROFILER:
+                self.shared_label = label
+                self.shared_profiler = profiler
+                self.shared_users = 1
+            return profiler
+
+    def disable_profiler(self, profiler):
+        """Disable a profiler enabled by enable_profiler()
+
+        A shared profiler is only disabled once no span is using it.
+        """
+
+        with self.lock:
+            if SHARED_PROFILER:
+                self.shared_users -= 1
+                if self.shared_users:
+                    return
+                self.shared_label = None
+                self.shared_profiler = None
+            profiler.disable()
+
+    def stop_profiling(self, span_path, profile):
+        """Stop the profiling started by start_profiling()"""
+
+        import tracemalloc
+
+        if "cprofile" in profile:
+            self.disable_profiler(profile["cprofile"])
+            self.profiler.running = None
+
+        if "memory" in profile:
+            frame, context_token = profile["memory"]
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, frame["peak"])
+            self.memory_frame.reset(context_token)
+            parent = self.memory_frame.get()
+            if parent is not None:
+                parent["peak"] = max(parent["peak"], peak)
+            with self.lock:
+                self.memory_data.setdefault(span_path, []).append(
+                    (peak - frame["start"], current - frame["start"]))
+
+    def profile_stats(self):
+        """Return the cProfile statistics of every profiled label"""
+
+        import pstats
+
+        with self.lock:
+            profilers = list(self.profilers.items())
+
+        stats = {}
+        for (label, thread), profiler in profilers:
+            if label in stats:
+                stats[label].add(profiler)
+            else:
+                stats[label] = pstats.Stats(profiler)
+        return stats
+
+    def write_profiles(self, directory):
+        """Write the profile of every profiled label into the directory
+
+        These can be loaded with pstats, or viewed with snakeviz.
+        """
 
-            # Make sure it is running
-            self.data[name]["running"] = True
+        makedirs(directory, exist_ok=True)
+        for label, stats in self.profile_stats().items():
+            file_name = "".join(c if c.isalnum() else "_" for c in label)
+            stats.dump_stats(path.join(directory, file_name + ".prof"))
 
-            # Put our times in there
-            self.data[name]["start_time"] = t_val
-            self.data[name]["total_time"] = 0.0
+    def record(self, name, duration):
+        """Record a span which already finished, lasting duration seconds
 
-        # If it is there, only act if it's running
-        elif self.data[name]["running"] is False:
-            # Now we're running
-            self.data[name]["running"] = True
+        This is for what can't be wrapped in a span, such as the time it
+        took to import the modules the timers live in.
+        """
 
-            # Change our start time as well
-            self.data[name]["start_time"] = t_val
+        span_path = self.current.get() + (name,)
+        start = time.perf_counter() - duration
+        with self.lock:
+            self.data.setdefault(span_path, []).append(duration)
+            self.spans.append((span_path, start - self.epoch, duration,
+                               get_ident()))
 
-    def stop(self, name):
-        """Stop a timer with the given name
+    def reset(self):
+        """Forget everything recorded so far, but keep profiling settings
 
-        This stops the timer if it is running. If there is no such timer
-        currently running, throw an error. If the timer exists and is running,
-        stop it and update total_time. If the timer exists but isn't running,
-        do nothing.
+        A long-running program can use this to report on one round of work
+        at a time.
         """
 
-        # Get a timer value ASAP
-        t_val = time.perf_counter()
+        with self.lock:
+            self.data = {}
+            self.spans = []
+            self.memory_data = {}
+            self.profilers = {}
+            self.epoch = time.perf_counter()
+        with self.counter_lock:
+            self.counters = {}
+
+    def span(self, name):
+        """Time a block of code, as in 'with timer.span("name"):'"""
+        return _Span(self, name)
+
+    def bind(self, func):
+        """Make spans started by func children of the current span
+
+        New threads, including the ones in a thread pool, start without a
+        current span. Wrap functions handed to them with this to keep the
+        spans they record under the span that submitted them.
+        """
+
+        parent = self.current.get()
 
-        # Raise an error if the timer doesn't exist
-        if name not in self.data:
-            assert ValueError("Timer " + name + " not found")
+        @wraps(func)
+        def bound(*args, **kwargs):
+            context_token = self.current.set(parent)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.current.reset(context_token)
 
-        # If the timer is running, update total_time and stop it
-        if self.data[name]["running"] is True:
-            # Stop the timer
-            self.data[name]["running"] = False
+        return bound
 
-            # Get the current time and add it to any existing time, which
-            # may indeed exist
-            cur_time = t_val - self.data[name]["start_time"]
-            self.data[name]["total_time"] += cur_time
+    def count(self, name, amount=1):
+        """Increment a counter with the given name
+
+        The counter is created if it doesn't exist yet.
+        """
+
+        with self.counter_lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
 
     def run(self, label):
         """Wrap a function inside a timer
 
         This allows for the usage of a decorator on a function which
-        automatically and easily starts and ends a timer
+        automatically and easily records a span every time it's called.
+        Coroutine functions are timed until they return, not until they
+        first yield.
         """
-        self.start(label)
-
-        # Pause all other timers
-        paused = []
-        for timer in self.data:
-            if not timer == label and self.data[timer]["running"]:
-                self.stop(timer)
-                paused.append(timer)
 
         def wrap(func):
+            if iscoroutinefunction(func):
+                @wraps(func)
+                async def run_coroutine(*args, **kwargs):
+                    token = self.start(label)
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        self.stop(token)
+
+                return run_coroutine
+
+            @wraps(func)
             def run_function(*args, **kwargs):
+                token = self.start(label)
                 try:
                     return func(*args, **kwargs)
                 finally:
-                    self.stop(label)
- 
-                    # Unpause other timers
-                    for timer in paused:
-                        self.start(timer)
+                    self.stop(token)
 
             return run_function
         return wrap
 
+    def summary(self):
+        """Return the statistics for every path, parents before children
+
+        Each entry is a dict with the path, the number of calls, and the
+        total, minimum, mean, median, 95th percentile and maximum seconds.
+        """
+
+        with self.lock:
+            data = {span_path: list(durations) for span_path, durations in
+                    self.data.items() if durations}
+            memory = {span_path: list(usage) for span_path, usage in
+                      self.memory_data.items()}
+
+        # Sort depth first, keeping siblings in the order they first ran
+        order = {span_path: i for i, span_path in enumerate(data)}
+        paths = sorted(data, key=lambda span_path: [
+            order.get(span_path[:i + 1], len(order))
+            for i in range(len(span_path))])
+
+        summary = []
+        for span_path in paths:
+            durations = sorted(data[span_path])
+            total = sum(durations)
+            summary.append({"path": span_path,
+                            "calls": len(durations),
+                            "total": total,
+                            "min": durations[0],
+                            "mean": total / len(durations),
+                            "p50": percentile(durations, 50),
+                            "p95": percentile(durations, 95),
+                            "max": durations[-1]})
+            # The largest peak, and the total net memory allocated, in bytes
+            if span_path in memory:
+                summary[-1]["peak_bytes"] = max(peak for peak, net in
+                                                memory[span_path])
+                summary[-1]["net_bytes"] = sum(net for peak, net in
+                                               memory[span_path])
+
+        return summary
+
     def display(self):
         """Print a pretty(-ish) table with all of the data in it"""
 
+        # Only needed here, so don't make every program using the timers
+        # pay for importing it
+        from tabulate import tabulate
+
+        summary = self.summary()
+
+        # Children overlap with their parents, and with each other when they
+        # run concurrently, so only the top-level spans add up to the total
+        total_secs = sum(entry["total"] for entry in summary
+                         if len(entry["path"]) == 1)
+
         # Initialize the dict for the table we're going to render
         # The dict keys are the headers
-        table = {}
-
-        # Simplify the data with just the times and the timer labels
-        pretty = {}
-        for item in self.data:
-            pretty[item] = self.data[item]["total_time"]
-
-        # Sort the data into descending order and then put them into two lists
-        # Keys have one list and values have another
-        s_pretty = {k: v for k,
-                    v in sorted(pretty.items(),
-                                key=lambda item: item[1],
-                                reverse=True)}
-        table["Timer"] = list(s_pretty.keys())
-        table["Seconds"] = list(s_pretty.values())
-
-        # Get a total second count
-        total_secs = 0.0
-        for i in range(len(table["Seconds"])):
-            total_secs += table["Seconds"][i]
+        table = {"Timer": [], "Calls": [], "Seconds": [], "Min": [],
+                 "Mean": [], "p50": [], "p95": [], "Max": [],
+                 "% of total": []}
+        if self.memory:
+            table["Peak KiB"] = []
+            table["Net KiB"] = []
+        for entry in summary:
+            # Indent children under their parents. tabulate strips leading
+            # whitespace, so use dots
+            depth = len(entry["path"]) - 1
+            table["Timer"].append(". " * depth + entry["path"][-1])
+            table["Calls"].append(entry["calls"])
+            table["Seconds"].append(entry["total"])
+            for column, key in [("Min", "min"), ("Mean", "mean"),
+                                ("p50", "p50"), ("p95", "p95"),
+                                ("Max", "max")]:
+                table[column].append(entry[key])
+            percent = entry["total"] / total_secs * 100.0 if total_secs \
+                else 0.0
+            # Round to the nearest hundredth and add a %
+            table["% of total"].append(str(round(percent, 2)) + "%")
+            if self.memory:
+                table["Peak KiB"].append(entry.get("peak_bytes", 0) / 1024)
+                table["Net KiB"].append(entry.get("net_bytes", 0) / 1024)
 
         # Add the totals to the table
         table["Timer"].append("Total Time")
         table["Seconds"].append(total_secs)
-
-        # Get percentages in its own column
-        table["% of total"] = []
-        for i in range(len(table["Seconds"])):
-            percent = (table["Seconds"][i] / total_secs) * 100.0
-            # Round to the nearest hundredth and add a %
-            table["% of total"].append(str(round(percent, 2)) + "%")
+        table["% of total"].append("100.0%")
+        for column in table:
+            if len(table[column]) < len(table["Timer"]):
+                table[column].append("")
 
         # Show the pretty table
-        print(tabulate(table, headers="keys", tablefmt="grid"))
+        print(tabulate(table, headers="keys", tablefmt="grid",
+                       floatfmt=".4f"))
+
+        # Show the counters, if there are any
+        if self.counters:
+            counters = {"Counter": list(self.counters.keys()),
+                        "Count": list(self.counters.values())}
+            print(tabulate(counters, headers="keys", tablefmt="grid"))
+
+        # Show where the time went in the profiled labels
+        for label, stats in self.profile_stats().items():
+            print("Profile of %s:" % label)
+            stats.sort_stats("cumulative").print_stats(20)
+
+    def as_dict(self):
+        """Return the summary and the counters, ready to be dumped as JSON"""
+
+        timers = []
+        for entry in self.summary():
+            entry = dict(entry)
+            entry["label"] = entry["path"][-1]
+            entry["path"] = list(entry["path"])
+            timers.append(entry)
+
+        with self.counter_lock:
+            counters = dict(self.counters)
+
+        return {"timers": timers, "counters": counters}
+
+    def write_json(self, file_name):
+        """Write the summary and the counters to a JSON file"""
+        write_atomically(file_name, json.dumps(self.as_dict(), indent=2))
+
+    def write_openmetrics(self, file_name, prefix="jobgenerator"):
+        """Write the summary and the counters in the OpenMetrics format
+
+        This is meant for node_exporter's textfile collector. Every path
+        is a summary with its median and 95th percentile, and a separate
+        gauge for the fastest and slowest call.
+        """
+
+        summary = self.as_dict()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append("# TYPE %s_%s %s" % (prefix, name, kind))
+            lines.append("# HELP %s_%s %s" % (prefix, name, help_text))
+            for suffix, labels, value in samples:
+                lines.append("%s_%s%s{%s} %r" % (
+                    prefix, name, suffix,
+                    ",".join('%s="%s"' % (key, escape_label(str(label)))
+                             for key, label in labels), value))
+
+        def labels(entry, *extra):
+            return [("label", entry["label"]),
+                    ("path", "/".join(entry["path"]))] + list(extra)
+
+        samples = []
+        for entry in summary["timers"]:
+            samples.append(("", labels(entry, ("quantile", "0.5")),
+                            entry["p50"]))
+            samples.append(("", labels(entry, ("quantile", "0.95")),
+                            entry["p95"]))
+            samples.append(("_sum", labels(entry), entry["total"]))
+            samples.append(("_count", labels(entry), entry["calls"]))
+        metric("span_seconds", "summary", "Time spent in each timer",
+               samples)
+
+        for name, key in [("span_min_seconds", "min"),
+                          ("span_max_seconds", "max")]:
+            metric(name, "gauge", "The %s call of each timer" %
+                   ("fastest" if key == "min" else "slowest"),
+                   [("", labels(entry), entry[key])
+                    for entry in summary["timers"]])
+
+        if self.memory:
+            for name, key, help_text in [
+                    ("span_peak_bytes", "peak_bytes",
+                     "The most memory in use during one call of each timer"),
+                    ("span_net_bytes", "net_bytes",
+                     "Memory allocated and not freed by each timer")]:
+                metric(name, "gauge", help_text,
+                       [("", labels(entry), entry[key])
+                        for entry in summary["timers"] if key in entry])
+
+        metric("counter", "counter", "Counters, such as cache hits",
+               [("_total", [("name", name)], value)
+                for name, value in summary["counters"].items()])
+
+        lines.append("# EOF")
+        write_atomically(file_name, "\n".join(lines) + "\n")
+
+    def write_trace(self, file_name):
+        """Write every span as a Chrome trace event
+
+        Open the file in chrome://tracing or https://ui.perfetto.dev to see
+        the run as a timeline, with a row per thread.
+        """
+
+        with self.lock:
+            spans = list(self.spans)
+
+        # Number the threads in the order they first finished a span
+        threads = {}
+        events = []
+        for span_path, start, duration, thread in spans:
+            tid = threads.setdefault(thread, len(threads))
+            # Times are in microseconds
+            events.append({"name": span_path[-1], "cat": "timer", "ph": "X",
+                           "ts": start * 1e6, "dur": duration * 1e6,
+                           "pid": getpid(), "tid": tid,
+                           "args": {"path": "/".join(span_path)}})
+
+        for thread, tid in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": getpid(),
+                           "tid": tid,
+                           "args": {"name": "Thread %d" % tid}})
+
+        write_atomically(file_name, json.dumps({"traceEvents": events,
+                                                "displayTimeUnit": "ms"}))
+
+
+def write_atomically(file_name, contents):
+    """Write the file under a temporary name, then move it into place
+
+    This way, a collector never sees a half-written file.
+    """
+
+    temp_name = path.join(path.dirname(path.abspath(file_name)),
+                          "." + path.basename(file_name) + ".tmp")
+    with open(temp_name, "w") as out_file:
+        out_file.write(contents)
+    replace(temp_name, file_name)
+
+
+def escape_label(value):
+    """Escape a label value for the OpenMetrics text format"""
+    return value.replace("\\", "\\\\").replace("\"", "\\\"") \
+        .replace("\n", "\\n")
+
+
+def compare(old, new, threshold, stat="mean", minimum=0.01):
+    """Return the timers which got slower between two JSON summaries
+
+    Anything more than threshold percent slower counts, as long as it takes
+    at least minimum seconds, so tiny timers don't add noise.
+    """
+
+    base = {tuple(entry["path"]): entry for entry in old["timers"]}
+    slower = []
+    for entry in new["timers"]:
+        key = tuple(entry["path"])
+        if key not in base:
+            continue
+        before = base[key][stat]
+        after = entry[stat]
+        if not before or after < minimum:
+            continue
+        change = (after - before) / before * 100.0
+        if change > threshold:
+            slower.append(("/".join(key), before, after, change))
+
+    return slower
+
+
+class _Span:
+    """Context manager returned by TimerMetrics.span()"""
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.token = self.timer.start(self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.stop(self.token)
+
+
+def percentile(durations, percent):
+    """Return the given percentile of a sorted list, by nearest rank"""
+    rank = max(1, -(-len(durations) * percent // 100))
+    return durations[int(rank) - 1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compare_parser = subparsers.add_parser(
+        "compare", help="Compare two JSON summaries written by write_json")
+    compare_parser.add_argument("old", help="The baseline summary")
+    compare_parser.add_argument("new", help="The summary to check")
+    compare_parser.add_argument("-t", "--threshold", type=float,
+                                default=20.0,
+                                help="Percent slower than the baseline that "
+                                     "counts as a regression")
+    compare_parser.add_argument("-s", "--stat", default="mean",
+                                choices=["total", "min", "mean", "p50",
+                                         "p95", "max"],
+                                help="The statistic to compare")
+    compare_parser.add_argument("-m", "--minimum", type=float, default=0.01,
+                                help="Ignore timers faster than this many "
+                                     "seconds")
+    args = parser.parse_args()
+
+    with open(args.old) as old_file, open(args.new) as new_file:
+        slower = compare(json.load(old_file), json.load(new_file),
+                         args.threshold, args.stat, args.minimum)
+
+    for label, before, after, change in slower:
+        print("Regression: %s %s went from %.4f to %.4f (+%.1f%%)" %
+              (label, args.stat, before, after, change))
+    if slower:
+        sys.exit(1)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+from xml.sax.saxutils import unescape
+
+# Jobs this one is triggered by (ReverseBuildTrigger), and jobs it triggers
+# itself (BuildTrigger), as comma-separated names
+UPSTREAM_RE = re.compile(r"<upstreamProjects>(.*?)</upstreamProjects>", re.S)
+CHILDREN_RE = re.compile(r"<childProjects>(.*?)</childProjects>", re.S)
+
+
+def project_names(text):
+    """Return the job names in a comma-separated list from a config"""
+
+    return [unescape(name.strip()) for name in text.split(",")
+            if name.strip()]
+
+
+class TriggerGraph:
+    """Trigger Graph
+
+    The build triggers between jobs only exist as text in the rendered
+    configs. This reads them into a graph, so references to jobs which
+    don't exist and trigger cycles are found before anything is pushed,
+    and jobs can be created after every job they're triggered by.
+
+    Data structure, mapping every job added to the jobs named in its
+    config, whichever side of the trigger they're on:
+    upstreams = {
+        "job name": {"job it's triggered by", ...}
+    }
+    children = {
+        "job name": {"job it triggers", ...}
+    }
+    """
+
+    def __init__(self):
+        self.upstreams = {}
+        self.children = {}
+        # The reverse of children, so every job can find what triggers it
+        self.parents = {}
+
+    def add(self, name, config):
+        """Add a job, with the triggers in its rendered config"""
+
+        self.upstreams[name] = set()
+        self.children[name] = set()
+        for match in UPSTREAM_RE.finditer(config):
+            self.upstreams[name].update(project_names(match.group(1)))
+        for match in CHILDREN_RE.finditer(config):
+            self.children[name].update(project_names(match.group(1)))
+        for child in self.children[name]:
+            self.parents.setdefault(child, set()).add(name)
+
+    def dangling(self, known):
+        """Return the references to jobs which aren't in the graph or known
+
+        This maps every job to the sorted names it references that can't
+        be found. known is the names of the other jobs which exist, or will
+        exist.
+        """
+
+        dangling = {}
+        for name in self.upstreams:
+            missing = [other for other in
+                       self.upstreams[name] | self.children[name]
+                       if other not in self.upstreams and other not in known]
+            if missing:
+                dangling[name] = sorted(missing)
+        return dangling
+
+    def edges(self, name):
+        """Return the jobs in the graph the job is triggered by"""
+
+        triggered_by = self.upstreams[name] | self.parents.get(name, set())
+        return [other for other in sorted(triggered_by)
+                if other in self.upstreams]
+
+    def cycles(self):
+        """Return every trigger cycle, as a list of the job names in it
+
+        These are the strongly connected components of the graph with more
+        than one job in them, or a job triggering itself, found with
+        Tarjan's algorithm. It's iterative, since a long chain of triggers
+        could hit the recursion limit.
+        """
+
+        order = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        cycles = []
+
+        for root in self.upstreams:
+            if root in order:
+                continue
+            work = [(root, iter(self.edges(root)))]
+            order[root] = lowlink[root] = len(order)
+            stack.append(root)
+            on_stack.add(root)
+
+            while work:
+                name, upstreams = work[-1]
+                for upstream in upstreams:
+                    if upstream not in order:
+                        order[upstream] = lowlink[upstream] = len(order)
+                        stack.append(upstream)
+                        on_stack.add(upstream)
+                        work.append((upstream,
+                                     iter(self.edges(upstream))))
+                        break
+                    if upstream in on_stack:
+                        lowlink[name] = min(lowlink[name], order[upstream])
+                else:
+                    # Every upstream is done, so this job is too
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[name])
+                    if lowlink[name] != order[name]:
+                        continue
+
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == name:
+                            break
+                    if len(component) > 1 or name in self.edges(name):
+                        cycles.append(sorted(component))
+
+        return cycles
+
+    def waves(self):
+        """Return the jobs in waves, each one after the waves it depends on
+
+        A job is in the wave after the last one with a job it's triggered
+        by, so the jobs in one wave don't depend on each other and can be
+        created at the same time. Within a wave, jobs keep the order they
+        were added in. Raises a ValueError if there are any cycles.
+        """
+
+        cycles = self.cycles()
+        if cycles:
+            raise ValueError("Trigger cycles between jobs: %s" %
+                             "; ".join(", ".join(cycle) for cycle in cycles))
+
+        # Kahn's algorithm, one wave at a time
+        position = {name: i for i, name in enumerate(self.upstreams)}
+        remaining = {name: len(self.edges(name)) for name in self.upstreams}
+        downstreams = {name: [] for name in self.upstreams}
+        for name in self.upstreams:
+            for upstream in self.edges(name):
+                downstreams[upstream].append(name)
+
+        waves = []
+        wave = [name for name, count in remaining.items() if count == 0]
+        while wave:
+            waves.append(wave)
+            ready = set()
+            for name in wave:
+                for downstream in downstreams[name]:
+                    remaining[downstream] -= 1
+                    if remaining[downstream] == 0:
+                        ready.add(downstream)
+            wave = sorted(ready, key=position.get)
+
+        return waves
@@ -0,0 +1,89 @@
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from fake_jenkins import FakeJenkins
+from jenkins_client import JenkinsClient
+from job_index import JobIndex
+
+CONFIG = "<project/>"
+
+
+class FlakyJenkins(FakeJenkins):
+    """A fake Jenkins failing the next few POSTs with the given statuses
+
+    A 503 means the request wasn't handled. Other statuses are sent after
+    handling it, like a proxy timing out on a slow Jenkins.
+    """
+
+    def __init__(self):
+        FakeJenkins.__init__(self)
+        self.failures = []
+
+    def route(self, method, parts, params, body):
+        if method != "POST" or not self.failures:
+            return FakeJenkins.route(self, method, parts, params, body)
+
+        status = self.failures.pop(0)
+        if status == 503:
+            return 503, "text/plain", "Jenkins is getting ready to work"
+        FakeJenkins.route(self, method, parts, params, body)
+        return status, "text/plain", "Bad gateway"
+
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FlakyJenkins().start()
+        self.addCleanup(self.fake.stop)
+        self.index = JobIndex(JenkinsClient(self.fake.url, backoff=0.0))
+        self.index.snapshot()
+
+    def test_create_unavailable(self):
+        self.fake.failures = [503]
+        self.index.create_job("a", CONFIG)
+
+        self.assertEqual(self.fake.jobs, {"a": CONFIG})
+        self.assertEqual(self.fake.requests["POST /createItem"], 2)
+
+    def test_create_done(self):
+        # Retrying would fail because the job already exists
+        self.fake.failures = [502]
+        with self.assertRaisesRegex(ValueError, "returned 502"):
+            self.index.create_job("a", CONFIG)
+
+        self.assertEqual(self.fake.jobs, {"a": CONFIG})
+        self.assertEqual(self.fake.requests["POST /createItem"], 1)
+
+    def test_delete_done(self):
+        self.index.create_job("a", CONFIG)
+        self.fake.failures = [502]
+        with self.assertRaisesRegex(ValueError, "returned 502"):
+            self.index.delete_job("a")
+
+        self.assertEqual(self.fake.jobs, {})
+        self.assertEqual(self.fake.requests["POST /job/*/doDelete"], 1)
+
+    def test_update_retried(self):
+        self.index.create_job("a", CONFIG)
+        self.fake.failures = [502]
+        self.index.update_job("a", "<project><disabled/></project>")
+
+        self.assertEqual(self.fake.jobs["a"],
+                         "<project><disabled/></project>")
+        self.assertEqual(self.fake.requests["POST /job/*/config.xml"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from time import monotonic, sleep
+from threading import Thread, Timer
+from fake_jenkins import FakeJenkins
+from jenkins_client import JenkinsClient
+from job_index import JobIndex
+
+
+class ViewWaitTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeJenkins().start()
+        self.addCleanup(self.fake.stop)
+        # Another generator owns every view but "mine"
+        self.index = JobIndex(JenkinsClient(self.fake.url),
+                              owns_view=lambda name: name == "mine",
+                              view_timeout=0.5)
+        self.index.snapshot()
+
+    def ensure_views(self, names):
+        """Ensure the views from a thread each, return the errors"""
+
+        errors = {}
+
+        def ensure(i, name):
+            try:
+                self.index.ensure_view(name)
+            except ValueError as e:
+                errors[i] = e
+
+        threads = [Thread(target=ensure, args=(i, name))
+                   for i, name in enumerate(names)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def view_requests(self):
+        return self.fake.requests.get("GET /view/*/api/json", 0)
+
+    def test_created_meanwhile(self):
+        Timer(0.2, lambda: self.fake.views.setdefault("theirs", [])).start()
+        self.assertEqual(self.ensure_views(["theirs"] * 8), {})
+        self.assertEqual(self.index.views["theirs"], set())
+
+    def test_missing(self):
+        start = monotonic()
+        errors = self.ensure_views(["theirs"] * 8)
+
+        # Every worker gives up after the one wait
+        self.assertEqual(len(errors), 8)
+        self.assertLess(monotonic() - start, 2.0)
+        requests = self.view_requests()
+
+        # Later jobs in the view fail straight away
+        with self.assertRaisesRegex(ValueError, "Timed out"):
+            self.index.ensure_view("theirs")
+        self.assertEqual(self.view_requests(), requests)
+
+    def test_other_views(self):
+        # Waiting on one view doesn't hold up creating another
+        waiting = Thread(target=self.ensure_views, args=(["theirs"],))
+        waiting.start()
+        while "theirs" not in self.index.view_waits:
+            sleep(0.01)
+        start = monotonic()
+        self.index.ensure_view("mine")
+        self.assertLess(monotonic() - start, 0.25)
+        waiting.join()
+
+        self.assertIn("mine", self.fake.views)
+
+
+if __name__ == "__main__":
+    unittest.main()
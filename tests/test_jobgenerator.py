@@ -0,0 +1,253 @@
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import signal
+import unittest
+from io import StringIO
+from contextlib import redirect_stdout
+from os import getpid, kill, path
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import mock
+from fake_jenkins import FakeJenkins
+from jobgenerator import Generator
+from synthetic_metadata import count_jobs, write_metadata
+
+
+class GeneratorTestCase(unittest.TestCase):
+    """Run the generator on synthetic metadata against a fake Jenkins"""
+
+    def setUp(self):
+        self.tmp = mkdtemp()
+        self.addCleanup(rmtree, self.tmp)
+        self.metadata_loc = path.join(self.tmp, "metadata")
+        self.metadata_cache = path.join(self.tmp, "cache")
+
+        self.fake = FakeJenkins().start()
+        self.addCleanup(self.fake.stop)
+
+        env = mock.patch.dict("os.environ", {
+            "METADATA_URL": self.metadata_loc,
+            "METADATA_REPO_NAME": "metadata",
+            "API_SITE": self.fake.url, "API_USER": "test",
+            "API_KEY": "test"})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def write_metadata(self, repositories):
+        """Commit metadata with this many repositories, return the jobs"""
+
+        write_metadata(self.metadata_loc, 1, repositories, 1)
+        return count_jobs(1, repositories, 1)
+
+
+class IncrementalTest(GeneratorTestCase):
+    def run_generator(self):
+        with redirect_stdout(StringIO()):
+            generator = Generator(metadata_cache=self.metadata_cache,
+                                  incremental=True)
+            self.assertEqual(generator.create_jenkins_jobs(), {})
+        return generator
+
+    def test_unchanged(self):
+        self.write_metadata(3)
+        self.run_generator()
+        generator = self.run_generator()
+
+        self.assertEqual(generator.stats,
+                         {"created": 0, "updated": 0, "unchanged": 0})
+
+    def test_changed_by_hand(self):
+        jobs = self.write_metadata(3)
+        self.run_generator()
+
+        # Delete one job, and take another out of its view
+        del self.fake.jobs["merger0_package1"]
+        for view in self.fake.views.values():
+            if "merger0_package1" in view:
+                view.remove("merger0_package1")
+        self.fake.views["merger"].remove("merger0_package2")
+
+        generator = self.run_generator()
+        self.assertEqual(generator.stats,
+                         {"created": 1, "updated": 0, "unchanged": 1})
+        self.assertEqual(len(self.fake.jobs), jobs)
+        self.assertIn("merger0_package1", self.fake.views["merger"])
+        self.assertIn("merger0_package2", self.fake.views["merger"])
+
+
+class TriggerTest(GeneratorTestCase):
+    def metadata(self):
+        """Return parsed metadata with a merger config called cascade"""
+
+        package = {"name": "lxqt-panel", "releases": ["mantic", "noble"],
+                   "packaging_url": "https://git.example.org/lxqt-panel",
+                   "packaging_branch": "ubuntu/master",
+                   "upstream_url": "https://upstream.example.org/lxqt-panel",
+                   "upload_target": "ppa:example-ci/unstable-ci"}
+        return {"active_configs": {
+            "desktop": {"default": {"type": "unstable"},
+                        "repositories": [package]},
+            "cascade": {"default": {"type": "merger", "parent": "desktop",
+                                    "cascade": ["ubuntu/master"]}}}}
+
+    def test_merger_config_name(self):
+        with redirect_stdout(StringIO()):
+            generator = Generator(strict_triggers=True)
+            specs = list(generator.job_specs(self.metadata()))
+            # The merger jobs are also triggered by the generator's own job
+            waves = generator.trigger_waves(
+                specs, set(spec.name for spec in specs) | {"jobgenerator"})
+
+        # The package jobs wait for the merger job, whatever its config is
+        # called, and nothing is triggered by a merger_ job
+        wave_of = {spec.name: i for i, wave in enumerate(waves)
+                   for spec in wave}
+        for name in ["mantic_desktop_lxqt-panel", "noble_desktop_lxqt-panel"]:
+            self.assertGreater(wave_of[name], wave_of["cascade_lxqt-panel"])
+        for spec, config in generator.render_jobs(specs):
+            self.assertNotIn("merger_lxqt-panel", config)
+
+    def test_strict_triggers(self):
+        # None of the synthetic jobs are triggered by a missing job
+        jobs = self.write_metadata(3)
+        self.fake.jobs["jobgenerator"] = "<project/>"
+        with redirect_stdout(StringIO()):
+            generator = Generator(strict_triggers=True)
+            self.assertEqual(generator.create_jenkins_jobs(), {})
+        self.assertEqual(len(self.fake.jobs), jobs + 1)
+
+
+class PruneTest(GeneratorTestCase):
+    # Other teams' jobs and views, which look a lot like ours
+    FOREIGN_JOBS = ["someone_elses", "lubuntu_daily_iso", "ci_tooling_tests",
+                    "noble_daily_iso"]
+    FOREIGN_VIEWS = {"Nightly builds": [],
+                     "Release team": ["ci_tooling_tests"]}
+
+    def run_generator(self, errors=None, **kwargs):
+        with redirect_stdout(StringIO()):
+            generator = Generator(prune="delete", **kwargs)
+            self.assertEqual(list(generator.create_jenkins_jobs()),
+                             errors or [])
+        return generator
+
+    def add_foreign(self):
+        for name in self.FOREIGN_JOBS:
+            self.fake.jobs[name] = "<project/>"
+            self.fake.views["all"].append(name)
+        for view, jobs in self.FOREIGN_VIEWS.items():
+            self.fake.views[view] = list(jobs)
+
+    def assert_foreign_kept(self):
+        for name in self.FOREIGN_JOBS:
+            self.assertIn(name, self.fake.jobs)
+        for view, jobs in self.FOREIGN_VIEWS.items():
+            self.assertEqual(self.fake.views[view], jobs)
+
+    def assert_config_removed(self, **kwargs):
+        self.add_foreign()
+        write_metadata(self.metadata_loc, 2, 3, 2)
+        self.run_generator(**kwargs)
+        self.assertIn("noble_config1_package1", self.fake.jobs)
+        self.assertIn("noble config1", self.fake.views)
+        self.assert_foreign_kept()
+
+        # Take config1 out of ci.conf
+        write_metadata(self.metadata_loc, 1, 3, 2)
+        jobs = count_jobs(1, 3, 2)
+        self.run_generator(**kwargs)
+        self.assertEqual(sorted(name for name in self.fake.jobs
+                                if "_config1_" in name), [])
+        self.assertEqual(len(self.fake.jobs), jobs + len(self.FOREIGN_JOBS))
+        self.assertNotIn("mantic config1", self.fake.views)
+        self.assertNotIn("noble config1", self.fake.views)
+        self.assertIn("mantic config0", self.fake.views)
+        self.assert_foreign_kept()
+
+    def test_removed_config(self):
+        self.assert_config_removed(metadata_cache=self.metadata_cache)
+
+    def test_removed_config_incremental(self):
+        self.assert_config_removed(metadata_cache=self.metadata_cache,
+                                   incremental=True)
+
+    def test_foreign_without_state(self):
+        # Without any recorded state, only the configs in ci.conf are ours
+        self.add_foreign()
+        write_metadata(self.metadata_loc, 2, 3, 2)
+        self.run_generator()
+        write_metadata(self.metadata_loc, 1, 3, 2)
+        self.run_generator()
+
+        self.assertIn("noble_config1_package1", self.fake.jobs)
+        self.assert_foreign_kept()
+
+    def test_max_prune(self):
+        write_metadata(self.metadata_loc, 2, 3, 2)
+        self.run_generator(metadata_cache=self.metadata_cache,
+                           incremental=True)
+
+        # Too much would go, but the rest is still pushed and recorded
+        write_metadata(self.metadata_loc, 1, 4, 2)
+        generator = self.run_generator(errors=[""], max_prune=3,
+                                       metadata_cache=self.metadata_cache,
+                                       incremental=True)
+        self.assertIn("noble_config0_package3", self.fake.jobs)
+        self.assertIn("noble_config1_package1", self.fake.jobs)
+        self.assertEqual(generator.summary["pruned"], 0)
+        self.assertIn("noble_config0_package3",
+                      generator.load_applied_state()["jobs"])
+
+
+class DaemonTest(GeneratorTestCase):
+    def test_new_commits_after_cache_hit(self):
+        # Fill the parsed metadata cache from another run first
+        jobs = self.write_metadata(3)
+        with redirect_stdout(StringIO()):
+            errors = Generator(metadata_cache=self.metadata_cache,
+                               incremental=True).create_jenkins_jobs()
+        self.assertEqual(errors, {})
+        self.assertEqual(len(self.fake.jobs), jobs)
+
+        # The daemon starts on the cached commit, then two more land
+        runs = []
+        commits = [4, 5]
+        expected = [jobs]
+
+        def after(errors):
+            runs.append((errors, len(self.fake.jobs)))
+            if commits:
+                expected.append(self.write_metadata(commits.pop(0)))
+            else:
+                kill(getpid(), signal.SIGTERM)
+
+        handlers = {signum: signal.getsignal(signum)
+                    for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            generator = Generator(metadata_cache=self.metadata_cache,
+                                  incremental=True)
+            with redirect_stdout(StringIO()):
+                generator.run_daemon(interval=0, after=after)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+        self.assertEqual(runs, [({}, count) for count in expected])
+        self.assertIn("merger0_package4", self.fake.jobs)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from io import StringIO
+from contextlib import redirect_stdout
+from build_telemetry import BuildTelemetry
+from fake_launchpad import FakeLaunchpad
+from lp_check import LaunchpadCheck, PollScheduler
+
+
+def schedule(deadline=5.0):
+    """Return a scheduler polling every few hundredths of a second"""
+
+    return PollScheduler(initial=0.02, jitter=0.0, maximum=0.05,
+                         deadline=deadline)
+
+
+class LaunchpadCheckTest(unittest.TestCase):
+    def setUp(self):
+        self.lp = FakeLaunchpad()
+
+    def check(self, source_deadline=5.0, binary_deadline=5.0):
+        """Verify the package is published, with the fake Launchpad"""
+
+        check = LaunchpadCheck("team", "ppa", schedule(source_deadline),
+                               schedule(binary_deadline), lp=self.lp)
+        telemetry = BuildTelemetry("package", "1.0", "team", "ppa")
+        with redirect_stdout(StringIO()):
+            check.verify_binaries_published("package", "1.0", telemetry)
+        return check, telemetry
+
+    def upload(self, **kwargs):
+        delays = {"source_delay": 0.1, "build_time": 0.1,
+                  "publish_delay": 0.05}
+        delays.update(kwargs)
+        return self.lp.upload("team", "ppa", "package", "1.0", **delays)
+
+    def test_published(self):
+        self.upload()
+        check, telemetry = self.check()
+
+        self.assertEqual(sorted(telemetry.builds), ["amd64", "arm64"])
+        stages = {(stage, arch) for stage, arch, seconds in
+                  telemetry.latencies()}
+        self.assertIn(("upload_to_binary_publish", "arm64"), stages)
+        self.assertGreater(check.requests, 0)
+
+    def test_late_binaries(self):
+        # The binaries of the architectures which built first are listed,
+        # and published, before the ones of the last one are listed
+        upload = self.upload(archs=["amd64", "arm64", "riscv64"],
+                             build_times={"amd64": 0.05, "arm64": 0.1,
+                                          "riscv64": 0.3},
+                             list_delay=0.15, publish_delay=0.1)
+        check, telemetry = self.check()
+
+        self.assertGreaterEqual(upload.age(), upload.binary_delay("riscv64"))
+        self.assertEqual(sorted(binary["arch"] for binary in
+                                telemetry.binaries.values()),
+                         ["amd64", "arm64", "riscv64"])
+        for binary in telemetry.binaries.values():
+            self.assertIsNotNone(binary["published"])
+
+    def test_failed(self):
+        self.upload(failing=["arm64"])
+        with self.assertRaisesRegex(ValueError, "builds have an error"):
+            self.check()
+
+    def test_timeout(self):
+        self.upload(source_delay=10.0)
+        with self.assertRaisesRegex(ValueError, "Timed out"):
+            self.check(source_deadline=0.2)
+
+    def test_missing_ppa(self):
+        with self.assertRaisesRegex(ValueError, "No PPA"):
+            self.check()
+
+
+if __name__ == "__main__":
+    unittest.main()
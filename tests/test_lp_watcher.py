@@ -0,0 +1,242 @@
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import sys
+import json
+import unittest
+from io import StringIO
+from os import path
+from contextlib import redirect_stdout
+from shutil import rmtree
+from subprocess import run
+from tempfile import mkdtemp
+from threading import Thread, Timer
+from time import monotonic
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tests import ROOT
+from build_telemetry import BuildTelemetry, load_history
+from fake_launchpad import FakeLaunchpad
+from lp_watcher import LaunchpadWatcher, make_server, wait_for_watch
+
+
+class LaunchpadWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = mkdtemp()
+        self.addCleanup(rmtree, self.tmp)
+        self.history = path.join(self.tmp, "history")
+
+        self.lp = FakeLaunchpad()
+        self.watcher = LaunchpadWatcher(interval=0.02, deadline=5.0,
+                                        lp=self.lp, history=self.history)
+
+        # The watcher prints every round, keep it quiet
+        output = redirect_stdout(StringIO())
+        output.__enter__()
+        self.addCleanup(output.__exit__, None, None, None)
+
+    def serve(self):
+        """Serve the watcher on a Unix socket, return its address"""
+
+        address = "unix:" + path.join(self.tmp, "watcher.sock")
+        server = make_server(self.watcher, address)
+        Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        self.watcher.start()
+        self.addCleanup(self.watcher.stop)
+        return address
+
+    def upload(self, package="package", **kwargs):
+        delays = {"source_delay": 0.1, "build_time": 0.1,
+                  "publish_delay": 0.05}
+        delays.update(kwargs)
+        return self.lp.upload("team", "ppa", package, "1.0", **delays)
+
+    def wait(self, address, package="package"):
+        return wait_for_watch(address, package, "1.0", "team", "ppa", 10.0,
+                              poll_timeout=1.0)
+
+    def test_shared_watch(self):
+        self.upload()
+        address = self.serve()
+
+        results = []
+        clients = [Thread(target=lambda: results.append(self.wait(address)))
+                   for i in range(3)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        self.assertEqual(results, [True] * 3)
+        self.assertEqual(len(self.watcher.watches), 1)
+        self.assertEqual(list(self.watcher.ppas), [("team", "ppa")])
+
+        records = list(load_history(self.history))
+        self.assertEqual([record["outcome"] for record in records],
+                         ["published"])
+
+    def test_failed(self):
+        self.upload(failing=["amd64"])
+        address = self.serve()
+
+        with self.assertRaisesRegex(ValueError, "builds have an error"):
+            self.wait(address)
+
+    def test_timeout(self):
+        self.upload(source_delay=10.0)
+        self.watcher.deadline = 0.2
+        address = self.serve()
+
+        with self.assertRaisesRegex(ValueError, "Timed out"):
+            self.wait(address)
+
+    def test_unreachable(self):
+        address = "unix:" + path.join(self.tmp, "missing.sock")
+        with self.assertRaisesRegex(ValueError, "Timed out"):
+            wait_for_watch(address, "package", "1.0", "team", "ppa", 0.3,
+                           poll_timeout=1.0, retry_interval=0.05)
+
+    def test_restarting(self):
+        # The watcher only comes up after the client started waiting
+        self.upload()
+        address = "unix:" + path.join(self.tmp, "watcher.sock")
+        timer = Timer(0.3, self.serve)
+        timer.start()
+        self.addCleanup(timer.join)
+
+        self.assertTrue(wait_for_watch(address, "package", "1.0", "team",
+                                       "ppa", 10.0, poll_timeout=1.0,
+                                       retry_interval=0.05))
+
+    def test_client_deadline(self):
+        # The watcher would wait for 5 seconds, the client only wants to
+        # wait for a fraction of that
+        self.upload(source_delay=10.0)
+        address = self.serve()
+
+        start = monotonic()
+        with self.assertRaisesRegex(ValueError, "Timed out"):
+            wait_for_watch(address, "package", "1.0", "team", "ppa", 0.3,
+                           poll_timeout=2.0)
+        self.assertLess(monotonic() - start, 1.5)
+
+        # Other clients may still be waiting on it
+        watch = self.watcher.watches[("package", "1.0", "team", "ppa")]
+        self.assertEqual(watch.state, "pending")
+
+    def test_error_reply(self):
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                body = json.dumps({"message": "Something broke"}).encode()
+                self.send_response(500)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        address = "http://127.0.0.1:%d" % server.server_address[1]
+        with self.assertRaisesRegex(ValueError,
+                                    "returned 500: Something broke"):
+            self.wait(address)
+
+    def test_telemetry(self):
+        self.upload()
+        address = self.serve()
+
+        telemetry = BuildTelemetry("package", "1.0", "team", "ppa")
+        wait_for_watch(address, "package", "1.0", "team", "ppa", 10.0,
+                       poll_timeout=1.0, telemetry=telemetry)
+        self.assertEqual(telemetry.outcome, "published")
+        self.assertEqual(sorted(telemetry.builds), ["amd64", "arm64"])
+
+    def test_published_record(self):
+        # The HTTP threads only see copies made between checks, never the
+        # telemetry the polling thread is updating
+        self.upload(source_delay=0.0, build_time=10.0)
+        watch = self.watcher.watch("package", "1.0", "team", "ppa")
+        self.watcher.poll()
+        self.watcher.poll()
+
+        record = watch.record
+        self.assertEqual(sorted(record["builds"]), ["amd64", "arm64"])
+        watch.telemetry.builds["amd64"]["note"] = "changed"
+        self.assertNotIn("note", record["builds"]["amd64"])
+        self.watcher.poll()
+        self.assertIn("note", watch.record["builds"]["amd64"])
+
+    def test_check_telemetry(self):
+        # lp_check.py writes the watcher's record of the upload
+        self.upload(failing=["arm64"])
+        self.watcher.history = None
+        address = self.serve()
+
+        telemetry_json = path.join(self.tmp, "telemetry.json")
+        checked = run([sys.executable, path.join(ROOT, "ci", "lp_check.py"),
+                       "-p", "package", "-v", "1.0", "-t", "team", "-r",
+                       "ppa", "--watcher", address, "--telemetry-json",
+                       telemetry_json, "--telemetry-textfile",
+                       path.join(self.tmp, "telemetry.prom"), "--history",
+                       self.history], capture_output=True, text=True)
+
+        self.assertNotEqual(checked.returncode, 0)
+        with open(telemetry_json) as telemetry_file:
+            record = json.load(telemetry_file)
+        self.assertEqual(record["outcome"], "failed")
+        self.assertEqual(record["builds"]["arm64"]["state"],
+                         "Failed to build")
+        self.assertTrue(path.exists(path.join(self.tmp, "telemetry.prom")))
+        self.assertEqual([record["outcome"] for record in
+                          load_history(self.history)], ["failed"])
+
+    def test_launchpad_error(self):
+        # Launchpad failing on one watch leaves it pending, and doesn't
+        # stop the others in the same round from being checked
+        self.upload("broken", source_delay=0.0)
+        self.upload("package", source_delay=0.0)
+        broken = self.watcher.watch("broken", "1.0", "team", "ppa")
+        working = self.watcher.watch("package", "1.0", "team", "ppa")
+
+        ppa = dict.__getitem__(self.lp.people, "team").ppas["ppa"]
+        get_sources = ppa.getPublishedSources
+
+        def failing_sources(source_name=None, **kwargs):
+            if source_name == "broken":
+                raise OSError("Connection reset by peer")
+            return get_sources(source_name=source_name, **kwargs)
+
+        ppa.getPublishedSources = failing_sources
+        self.watcher.poll()
+
+        self.assertEqual(broken.state, "pending")
+        self.assertIsNone(broken.source)
+        self.assertIsNotNone(working.source)
+
+        # Once Launchpad recovers, the watch carries on
+        ppa.getPublishedSources = get_sources
+        self.watcher.poll()
+        self.assertIsNotNone(broken.source)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from jobgenerator import Generator
+from metadata_schema import MetadataError, validate_metadata
+
+
+def metadata(config_type, repository, merger=False):
+    """Return metadata with one config holding the repository"""
+
+    default = {"type": config_type, "releases": ["focal"],
+               "packaging_url": "https://git.example.org/NAME",
+               "packaging_branch": "ubuntu/master",
+               "upload_target": "ppa:example-ci/ci"}
+    configs = {"packages": {"default": default,
+                            "repositories": [repository]}}
+    if merger:
+        configs["merger"] = {"default": {"type": "merger",
+                                         "parent": "packages",
+                                         "cascade": ["ubuntu/master"]}}
+    return {"active_configs": configs}
+
+
+class TemplateKeysTest(unittest.TestCase):
+    def setUp(self):
+        self.generator = Generator()
+        self.variables = self.generator.template_variables()
+
+    def render(self, metadata):
+        """Validate and render every job of the metadata"""
+
+        validate_metadata(metadata, self.variables)
+        return [self.generator.load_config(spec)
+                for spec in self.generator.job_specs(metadata)]
+
+    def test_unused_keys(self):
+        # Nothing renders default_branch, type or the upstream of a stable
+        # package
+        configs = self.render(metadata("stable", {"name": "foo"},
+                                       merger=True))
+        self.assertEqual(len(configs), 5)
+
+    def test_used_keys(self):
+        with self.assertRaisesRegex(MetadataError,
+                                    r"\(foo\): Missing keys: upstream_url"):
+            validate_metadata(metadata("unstable", {"name": "foo"}),
+                              self.variables)
+
+        configs = self.render(metadata("unstable", {
+            "name": "foo", "upstream_url": "https://example.org/foo"}))
+        self.assertIn("https://example.org/foo", configs[0])
+
+
+class ErrorReportTest(unittest.TestCase):
+    def test_every_error(self):
+        default = metadata("unstable", {})["active_configs"]["packages"][
+            "default"]
+        configs = {
+            "packages": {"default": default, "repositories": [
+                {"name": "fine", "upstream_url": "https://example.org"},
+                "just-a-name",
+                {"name": "extra", "upstream_url": "https://example.org",
+                 "colour": "red", "size": 1},
+                {"releases": ["focal"]},
+                {"name": "no-upstream"}]},
+            "broken": {"default": {"type": "nightly"}},
+            "other": {"default": dict(default, type="stable"),
+                      "repositories": "none"},
+            "merger": {"default": {"type": "merger", "parent": "missing"}}}
+
+        with self.assertRaises(MetadataError) as raised:
+            validate_metadata({"active_configs": configs},
+                              Generator().template_variables())
+
+        # Everything is reported at once, with where it was found
+        self.assertEqual(raised.exception.errors, [
+            "packages.conf: repositories[1]: expected a mapping, got "
+            "'just-a-name'",
+            "packages.conf: repositories[2]: Invalid keys present: colour, "
+            "size",
+            "packages.conf: repositories[3]: name must be set to a string",
+            "packages.conf: repositories[4] (no-upstream): Missing keys: "
+            "upstream_url",
+            "broken.conf: type must be one of merger, stable, unstable, not "
+            "'nightly'",
+            "other.conf: repositories must be set to a list",
+            "merger.conf: parent 'missing' is not an active config",
+            "merger.conf: cascade must be set to a list"])
+        self.assertTrue(str(raised.exception).startswith(
+            "8 problems in the metadata:\n"))
+
+        # The valid repositories still had their defaults filled in
+        fine = configs["packages"]["repositories"][0]
+        self.assertEqual(fine["packaging_url"], "https://git.example.org/fine")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+import unittest
+from os import environ, path
+from shutil import rmtree, which
+from subprocess import run
+from tempfile import mkdtemp
+from time import monotonic, sleep
+from tests import ROOT
+from fake_jenkins import FakeJenkins
+from jenkins_client import JenkinsClient
+from job_index import JobIndex
+from script_push import ScriptPush, render_script
+
+CONFIG = "<project><description>%s</description></project>"
+
+
+class ScriptPushTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeJenkins().start()
+        self.addCleanup(self.fake.stop)
+        self.index = JobIndex(JenkinsClient(self.fake.url, retries=0))
+        self.index.snapshot()
+        self.pusher = ScriptPush(self.index, batch_size=2)
+
+    def test_created(self):
+        results = self.pusher.push([("a", CONFIG % "a", "view")])
+
+        self.assertEqual(results, {"a": "created"})
+        self.assertEqual(self.fake.jobs["a"], CONFIG % "a")
+        self.assertEqual(self.fake.views["view"], ["a"])
+        self.assertIn("a", self.index.jobs)
+        self.assertEqual(self.index.views["view"], {"a"})
+
+    def test_updated(self):
+        self.pusher.push([("a", CONFIG % "a", "view")])
+        results = self.pusher.push([("a", CONFIG % "b", "view")])
+
+        self.assertEqual(results, {"a": "updated"})
+        self.assertEqual(self.fake.jobs["a"], CONFIG % "b")
+
+    def test_unchanged(self):
+        self.pusher.push([("a", CONFIG % "a", "view")])
+        results = self.pusher.push([("a", None, "view")])
+
+        self.assertEqual(results, {"a": "unchanged"})
+        self.assertEqual(self.fake.jobs["a"], CONFIG % "a")
+        self.assertEqual(self.fake.views["view"], ["a"])
+
+    def test_view_only(self):
+        self.pusher.push([("a", CONFIG % "a", "view")])
+        results = self.pusher.push([("a", None, "other")])
+
+        self.assertEqual(results, {"a": "unchanged"})
+        self.assertEqual(self.fake.views["other"], ["a"])
+        self.assertEqual(self.index.views["other"], {"a"})
+
+    def test_job_error(self):
+        results = self.pusher.push([("missing", None, "view"),
+                                    ("a", CONFIG % "a", "view")])
+
+        self.assertTrue(results["missing"].startswith("error"))
+        self.assertEqual(results["a"], "created")
+        self.assertNotIn("missing", self.index.jobs)
+        self.assertEqual(self.index.views["view"], {"a"})
+
+    def test_batch_error(self):
+        self.pusher.push([("a", CONFIG % "a", "view")])
+        self.fake.fail_every = 1
+        results = self.pusher.push([("b", CONFIG % "b", "view"),
+                                    ("c", CONFIG % "c", "view"),
+                                    ("d", CONFIG % "d", "view")])
+
+        self.assertEqual(sorted(results), ["b", "c", "d"])
+        for result in results.values():
+            self.assertTrue(result.startswith("error"))
+        self.assertEqual(self.index.jobs, {"a"})
+
+    def test_large_batch(self):
+        # Well over what fits in one string literal
+        jobs = [("job%d" % i, CONFIG % ("x" * 20000), "view")
+                for i in range(20)]
+        self.pusher.batch_size = 20
+
+        results = self.pusher.push(jobs)
+        self.assertEqual(set(results.values()), {"created"})
+        self.assertEqual(self.pusher.fetch_configs([name for name, config,
+                                                    view in jobs]),
+                         {name: config for name, config, view in jobs})
+
+
+class SlowScriptJenkins(FakeJenkins):
+    """A fake Jenkins taking a while to run every script"""
+
+    script_seconds = 0.5
+
+    def handle(self, request, method):
+        if request.path.startswith("/scriptText"):
+            sleep(self.script_seconds)
+        FakeJenkins.handle(self, request, method)
+
+
+class SlowScriptTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = SlowScriptJenkins().start()
+        self.addCleanup(self.fake.stop)
+        # Other requests time out well before the script is done
+        self.index = JobIndex(JenkinsClient(self.fake.url, timeout=0.2,
+                                            backoff=0.0))
+        self.index.snapshot()
+
+    def test_slow_script(self):
+        pusher = ScriptPush(self.index)
+        results = pusher.push([("a", CONFIG % "a", "view")])
+
+        self.assertEqual(results, {"a": "created"})
+        self.assertEqual(self.fake.requests["POST /scriptText"], 1)
+
+    def test_timed_out_script(self):
+        pusher = ScriptPush(self.index, timeout=0.2)
+        results = pusher.push([("a", CONFIG % "a", "view")])
+
+        self.assertTrue(results["a"].startswith("error"))
+        # Jenkins finishes the script anyway, so it mustn't be sent again
+        deadline = monotonic() + 5.0
+        while "a" not in self.fake.jobs and monotonic() < deadline:
+            sleep(0.05)
+        self.assertIn("a", self.fake.jobs)
+        self.assertEqual(self.fake.requests["POST /scriptText"], 1)
+
+
+class ScriptCompileTest(unittest.TestCase):
+    def setUp(self):
+        payload = {"operation": "push",
+                   "jobs": [{"name": "job%d" % i,
+                             "config": CONFIG % ("x" * 7000), "view": "v"}
+                            for i in range(500)]}
+        self.script = render_script(payload)
+
+    def test_string_constants(self):
+        for literal in re.findall(r"'([^']*)'", self.script):
+            self.assertLessEqual(len(literal.encode("utf-8")),
+                                 FakeJenkins.MAX_STRING_CONSTANT)
+
+    @unittest.skipUnless(which("groovyc") and environ.get("JENKINS_CLASSPATH"),
+                         "needs groovyc, and the Jenkins core classes in "
+                         "JENKINS_CLASSPATH")
+    def test_compiles(self):
+        tmp = mkdtemp()
+        self.addCleanup(rmtree, tmp)
+        script_path = path.join(tmp, "push.groovy")
+        with open(script_path, "w") as script_file:
+            script_file.write(self.script)
+
+        compiled = run(["groovyc", "-cp", environ["JENKINS_CLASSPATH"],
+                        "-d", tmp, script_path], cwd=ROOT,
+                       capture_output=True, text=True)
+        self.assertEqual(compiled.returncode, 0, compiled.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
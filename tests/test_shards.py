@@ -0,0 +1,91 @@
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from shards import Shard, merge_summaries, shard_of
+
+JOBS = ["%s_config%d_package%d" % (release, config, package)
+        for release in ("mantic", "noble") for config in range(3)
+        for package in range(20)]
+MGMT_JOBS = ["merger", "mgmt_build_mantic_stable", "mgmt_build_noble_unstable"]
+
+
+class ShardTest(unittest.TestCase):
+    def test_stable(self):
+        # A hash of the name, which doesn't change between processes
+        digest = int.from_bytes(bytes.fromhex("35cf78943f86bc2d"), "big")
+        for count in range(1, 8):
+            self.assertEqual(shard_of("noble_config0_package0", count),
+                             digest % count)
+
+    def test_disjoint(self):
+        shards = [Shard(i, 3) for i in range(3)]
+        for name in JOBS + MGMT_JOBS:
+            self.assertEqual(sum(shard.owns_job(name) for shard in shards),
+                             1, name)
+        # Every shard gets some of the jobs
+        for shard in shards:
+            self.assertTrue(any(shard.owns_job(name) for name in JOBS))
+
+    def test_mgmt_together(self):
+        for shard in [Shard(i, 5) for i in range(5)]:
+            owned = [shard.owns_job(name) for name in MGMT_JOBS]
+            self.assertEqual(owned, [shard.owns_view("mgmt")] * len(owned))
+
+    def test_single(self):
+        shard = Shard()
+        self.assertTrue(all(shard.owns_job(name) for name in JOBS))
+        self.assertTrue(shard.owns_view("noble config0"))
+
+    def test_parse(self):
+        self.assertEqual(str(Shard.parse("2/3")), "2/3")
+        for value in ["3/3", "-1/3", "1", "a/b", "0/0"]:
+            with self.assertRaisesRegex(ValueError, "i/N"):
+                Shard.parse(value)
+
+
+class MergeSummariesTest(unittest.TestCase):
+    def summary(self, shard, **counts):
+        return dict({"shard": shard, "jobs": 10, "created": 1,
+                     "failed": 0, "errors": {}}, **counts)
+
+    def test_complete(self):
+        merged = merge_summaries([
+            self.summary("0/2"),
+            self.summary("1/2", failed=1, errors={"a": "error"})])
+
+        self.assertEqual(merged["shards"], 2)
+        self.assertEqual(merged["jobs"], 20)
+        self.assertEqual(merged["created"], 2)
+        self.assertEqual(merged["failed"], 1)
+        self.assertEqual(merged["updated"], 0)
+        self.assertEqual(merged["errors"], {"a": "error"})
+        self.assertEqual(merged["missing"], [])
+        self.assertEqual(merged["duplicate"], [])
+
+    def test_missing(self):
+        merged = merge_summaries([self.summary("0/3"), self.summary("2/3")])
+        self.assertEqual(merged["missing"], [1])
+        self.assertEqual(merged["duplicate"], [])
+
+    def test_duplicate(self):
+        merged = merge_summaries([self.summary("1/2"), self.summary("1/2"),
+                                  self.summary("0/2")])
+        self.assertEqual(merged["missing"], [])
+        self.assertEqual(merged["duplicate"], [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,286 @@
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+import sys
+import json
+import asyncio
+import cProfile
+import unittest
+from os import path
+from shutil import rmtree
+from subprocess import run
+from tempfile import mkdtemp
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from tests import ROOT
+from timer_metrics import SHARED_PROFILER, TimerMetrics, compare
+
+SUMMARY_KEYS = {"path", "label", "calls", "total", "min", "mean", "p50",
+                "p95", "max"}
+
+
+class SpanTest(unittest.TestCase):
+    def setUp(self):
+        self.timer = TimerMetrics()
+
+    def test_nesting(self):
+        with self.timer.span("Parent"):
+            for i in range(2):
+                with self.timer.span("Child"):
+                    with self.timer.span("Grandchild"):
+                        pass
+            with self.timer.span("Other child"):
+                pass
+        with self.timer.span("Child"):
+            pass
+
+        calls = {entry["path"]: entry["calls"]
+                 for entry in self.timer.summary()}
+        self.assertEqual(list(calls), [("Parent",), ("Parent", "Child"),
+                                       ("Parent", "Child", "Grandchild"),
+                                       ("Parent", "Other child"),
+                                       ("Child",)])
+        self.assertEqual(list(calls.values()), [1, 2, 2, 1, 1])
+        self.assertEqual(len(self.timer.spans), 7)
+        self.assertEqual(self.timer.current.get(), ())
+
+    def test_exception(self):
+        @self.timer.run("Failing")
+        def failing():
+            raise KeyError("failed")
+
+        with self.timer.span("Parent"):
+            with self.assertRaises(KeyError):
+                failing()
+            self.assertEqual(self.timer.current.get(), ("Parent",))
+
+        self.assertEqual(len(self.timer.data[("Parent", "Failing")]), 1)
+
+    def test_threads(self):
+        def work():
+            with self.timer.span("Work"):
+                pass
+
+        with self.timer.span("Parent"):
+            # A new thread starts without a current span, unless it's bound
+            # to the one submitting it
+            thread = Thread(target=work)
+            thread.start()
+            thread.join()
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                for future in [pool.submit(self.timer.bind(work))
+                               for i in range(8)]:
+                    future.result()
+
+        self.assertEqual(len(self.timer.data[("Work",)]), 1)
+        self.assertEqual(len(self.timer.data[("Parent", "Work")]), 8)
+
+    def test_tasks(self):
+        @self.timer.run("Inner")
+        async def inner():
+            await asyncio.sleep(0.02)
+
+        async def task(name):
+            with self.timer.span(name):
+                # Let the other task start its span in between
+                await asyncio.sleep(0)
+                await inner()
+
+        async def main():
+            with self.timer.span("Outer"):
+                await asyncio.gather(task("A"), task("B"))
+
+        asyncio.run(main())
+
+        self.assertEqual(set(self.timer.data),
+                         {("Outer",), ("Outer", "A"), ("Outer", "B"),
+                          ("Outer", "A", "Inner"), ("Outer", "B", "Inner")})
+        # Coroutines are timed until they return, not until they first
+        # yield
+        for task_name in ("A", "B"):
+            self.assertGreater(
+                self.timer.data[("Outer", task_name, "Inner")][0], 0.015)
+
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = mkdtemp()
+        self.addCleanup(rmtree, self.tmp)
+
+        self.timer = TimerMetrics()
+        with self.timer.span("Parent"):
+            for i in range(3):
+                with self.timer.span('Say "hi"'):
+                    pass
+        self.timer.count("Cache hits", 2)
+
+    def test_json(self):
+        file_name = path.join(self.tmp, "metrics.json")
+        self.timer.write_json(file_name)
+        with open(file_name) as json_file:
+            data = json.load(json_file)
+
+        self.assertEqual(data["counters"], {"Cache hits": 2})
+        self.assertEqual([entry["path"] for entry in data["timers"]],
+                         [["Parent"], ["Parent", 'Say "hi"']])
+        for entry in data["timers"]:
+            self.assertEqual(set(entry), SUMMARY_KEYS)
+            self.assertEqual(entry["label"], entry["path"][-1])
+            self.assertLessEqual(entry["min"], entry["p50"])
+            self.assertLessEqual(entry["p95"], entry["max"])
+        self.assertEqual(data["timers"][1]["calls"], 3)
+
+    def test_openmetrics(self):
+        file_name = path.join(self.tmp, "metrics.prom")
+        self.timer.write_openmetrics(file_name)
+        with open(file_name) as metrics_file:
+            lines = metrics_file.read().splitlines()
+
+        self.assertEqual(lines[-1], "# EOF")
+        samples = {}
+        for line in lines[:-1]:
+            if line.startswith("#"):
+                self.assertRegex(line, r"^# (TYPE|HELP) jobgenerator_\w+ ")
+                continue
+            match = re.match(r"^(jobgenerator_\w+)\{(.*)\} (\S+)$", line)
+            self.assertIsNotNone(match, line)
+            samples[(match.group(1), match.group(2))] = float(match.group(3))
+
+        labels = 'label="Say \\"hi\\"",path="Parent/Say \\"hi\\""'
+        self.assertEqual(samples[("jobgenerator_span_seconds_count",
+                                  labels)], 3)
+        self.assertIn(("jobgenerator_span_seconds",
+                       labels + ',quantile="0.95"'), samples)
+        self.assertIn(("jobgenerator_span_max_seconds", labels), samples)
+        self.assertEqual(samples[("jobgenerator_counter_total",
+                                  'name="Cache hits"')], 2)
+        self.assertIn("# TYPE jobgenerator_span_seconds summary", lines)
+
+    def test_trace(self):
+        file_name = path.join(self.tmp, "trace.json")
+        self.timer.write_trace(file_name)
+        with open(file_name) as trace_file:
+            trace = json.load(trace_file)
+
+        spans = [event for event in trace["traceEvents"]
+                 if event["ph"] == "X"]
+        self.assertEqual(len(spans), 4)
+        for event in spans:
+            self.assertEqual(set(event), {"name", "cat", "ph", "ts", "dur",
+                                          "pid", "tid", "args"})
+            self.assertEqual(event["tid"], 0)
+        parent = [event for event in spans if event["name"] == "Parent"][0]
+        for event in spans:
+            if event is not parent:
+                self.assertEqual(event["args"]["path"], 'Parent/Say "hi"')
+                # Children run within their parent
+                self.assertGreaterEqual(event["ts"], parent["ts"])
+                self.assertLessEqual(event["ts"] + event["dur"],
+                                     parent["ts"] + parent["dur"])
+
+        metadata = [event for event in trace["traceEvents"]
+                    if event["ph"] == "M"]
+        self.assertEqual([event["args"]["name"] for event in metadata],
+                         ["Thread 0"])
+
+
+class CompareTest(unittest.TestCase):
+    def summary(self, **means):
+        return {"timers": [{"path": name.split("/"), "mean": mean}
+                           for name, mean in means.items()],
+                "counters": {}}
+
+    def test_compare(self):
+        old = self.summary(**{"A": 1.0, "A/B": 0.5, "C": 0.001, "D": 2.0})
+        new = self.summary(**{"A": 1.1, "A/B": 1.0, "C": 0.005, "D": 1.0,
+                              "E": 9.0})
+
+        # A is within the threshold, C is too small to count, D got
+        # faster, and E is new
+        self.assertEqual(compare(old, new, 20.0),
+                         [("A/B", 0.5, 1.0, 100.0)])
+        slower = compare(old, new, 5.0)
+        self.assertEqual([entry[0] for entry in slower], ["A", "A/B"])
+        self.assertAlmostEqual(slower[0][3], 10.0)
+
+    def test_command(self):
+        tmp = mkdtemp()
+        self.addCleanup(rmtree, tmp)
+        old_name = path.join(tmp, "old.json")
+        new_name = path.join(tmp, "new.json")
+
+        def command(old, new):
+            for file_name, summary in [(old_name, old), (new_name, new)]:
+                with open(file_name, "w") as summary_file:
+                    json.dump(summary, summary_file)
+            return run([sys.executable,
+                        path.join(ROOT, "ci", "timer_metrics.py"), "compare",
+                        old_name, new_name], capture_output=True, text=True)
+
+        slower = command(self.summary(A=1.0, B=1.0),
+                         self.summary(A=1.5, B=1.0))
+        self.assertEqual(slower.returncode, 1)
+        self.assertEqual(slower.stdout.splitlines(),
+                         ["Regression: A mean went from 1.0000 to 1.5000 "
+                          "(+50.0%)"])
+
+        same = command(self.summary(A=1.0), self.summary(A=1.1))
+        self.assertEqual(same.returncode, 0, same.stderr)
+        self.assertEqual(same.stdout, "")
+
+
+class ProfilingTest(unittest.TestCase):
+    def setUp(self):
+        self.timer = TimerMetrics()
+        self.timer.enable_profiling(["Work", "Other"])
+
+    def work(self):
+        with self.timer.span("Work"):
+            return sum(range(10000))
+
+    def test_threads(self):
+        # Every thread profiling at once can't make any of the spans fail
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda i: self.timer.bind(self.work)(),
+                                    range(32)))
+
+        self.assertEqual(results, [sum(range(10000))] * 32)
+        self.assertEqual(len(self.timer.data[("Work",)]), 32)
+        self.assertIn("Work", self.timer.profile_stats())
+        self.assertEqual(self.timer.shared_users, 0)
+
+    def test_nested_labels(self):
+        with self.timer.span("Other"):
+            self.work()
+
+        self.assertEqual(list(self.timer.profile_stats()), ["Other"])
+
+    @unittest.skipUnless(SHARED_PROFILER, "needs Python 3.12 or later")
+    def test_other_profiler(self):
+        # Something else is already profiling the process
+        other = cProfile.Profile()
+        other.enable()
+        try:
+            self.assertEqual(self.work(), sum(range(10000)))
+        finally:
+            other.disable()
+
+        self.assertEqual(len(self.timer.data[("Work",)]), 1)
+        self.assertEqual(self.timer.profile_stats(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
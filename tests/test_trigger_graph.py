@@ -0,0 +1,91 @@
+# Copyright (C) 2020 Simon Quigley <tsimonq2@lubuntu.me>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from trigger_graph import TriggerGraph
+
+
+def config(upstreams=(), children=()):
+    """Return a config with the given triggers"""
+
+    return ("<project><triggers><jenkins.triggers.ReverseBuildTrigger>"
+            "<upstreamProjects>%s</upstreamProjects>"
+            "</jenkins.triggers.ReverseBuildTrigger></triggers>"
+            "<publishers><hudson.tasks.BuildTrigger>"
+            "<childProjects>%s</childProjects>"
+            "</hudson.tasks.BuildTrigger></publishers></project>" %
+            (", ".join(upstreams), ",".join(children)))
+
+
+class TriggerGraphTest(unittest.TestCase):
+    def graph(self, jobs):
+        graph = TriggerGraph()
+        for name, job_config in jobs:
+            graph.add(name, job_config)
+        return graph
+
+    def test_waves(self):
+        # c is triggered by b through b's childProjects, and by a through
+        # its own upstreamProjects; d only depends on c
+        graph = self.graph([("d", config(upstreams=["c"])),
+                            ("c", config(upstreams=["a"])),
+                            ("b", config(children=["c"])),
+                            ("a", config()),
+                            ("e", config())])
+
+        self.assertEqual(graph.cycles(), [])
+        self.assertEqual(graph.waves(), [["b", "a", "e"], ["c"], ["d"]])
+
+    def test_cycle(self):
+        graph = self.graph([("a", config(upstreams=["c"])),
+                            ("b", config(upstreams=["a"])),
+                            ("c", config(children=["a"], upstreams=["b"])),
+                            ("d", config(upstreams=["a"]))])
+
+        self.assertEqual(graph.cycles(), [["a", "b", "c"]])
+        with self.assertRaisesRegex(ValueError, "a, b, c"):
+            graph.waves()
+
+    def test_self_trigger(self):
+        graph = self.graph([("a", config(children=["a"])),
+                            ("b", config(upstreams=["a"]))])
+
+        self.assertEqual(graph.cycles(), [["a"]])
+        with self.assertRaisesRegex(ValueError, "cycles between jobs: a$"):
+            graph.waves()
+
+    def test_long_chain(self):
+        # Deeper than the recursion limit
+        jobs = [("job0", config())]
+        jobs += [("job%d" % i, config(upstreams=["job%d" % (i - 1)]))
+                 for i in range(1, 5000)]
+        graph = self.graph(jobs)
+
+        self.assertEqual(graph.cycles(), [])
+        self.assertEqual(len(graph.waves()), 5000)
+
+    def test_dangling(self):
+        graph = self.graph([("a", config(upstreams=["missing", "b"],
+                                         children=["known"])),
+                            ("b", config())])
+
+        self.assertEqual(graph.dangling({"known"}), {"a": ["missing"]})
+        self.assertEqual(graph.dangling({"known", "missing"}), {})
+        # Jobs outside the graph don't hold anything back
+        self.assertEqual(graph.waves(), [["b"], ["a"]])
+
+
+if __name__ == "__main__":
+    unittest.main()